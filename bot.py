@@ -1,21 +1,37 @@
-import os
-import time
-
-# Установка часового пояса Москвы (решает баг со сдвигом 3 часа на Linux серверах)
-os.environ['TZ'] = 'Europe/Moscow'
-if hasattr(time, 'tzset'):
-    time.tzset()
-
 import asyncio
 import logging
 from aiogram import Bot, Dispatcher
-from config import BOT_TOKEN
-from database.setup import init_db
-from reminders.scheduler import start_reminder_scheduler
+from config import BOT_TOKEN, BOT_MODE, BOT_WORKERS, WORKER_BASE_PORT, WORKER_INDEX, WORKER_SECRET
+from database.setup import init_db, close_db
+from database.identity import identity_cache
+from database.versions import shared_versions
+from reminders.scheduler import start_reminder_scheduler, stop_reminder_scheduler
+from utils.messenger import messenger
+from utils.calendar_outbox import outbox
+from utils.fsm_storage import fsm_storage, FSMFlushMiddleware
+from utils.webhook import run_webhook
+from utils.leader import leader
+from utils.workers import is_worker, owns_chat, start_worker, start_shared_state, run_front
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
+def build_dispatcher() -> Dispatcher:
+    dp = Dispatcher(storage=fsm_storage)
+    # Все update_data() одного апдейта — одна запись в БД
+    dp.update.outer_middleware(FSMFlushMiddleware(fsm_storage))
+
+    from handlers.start import router as start_router
+    from handlers.master import router as master_router
+    from handlers.client import router as client_router
+    from handlers.template import router as template_router
+    
+    dp.include_router(start_router)
+    dp.include_router(master_router)
+    dp.include_router(client_router)
+    dp.include_router(template_router)
+    return dp
+
 async def main():
     # 1. Initialize Database
     await init_db()
@@ -23,6 +39,7 @@ async def main():
     # 2. Check Token
     if not BOT_TOKEN:
         print("Error: Please set BOT_TOKEN in .env file")
+        await close_db()
         return
 
     # 3. Start Bot
@@ -30,24 +47,61 @@ async def main():
     from aiogram.enums import ParseMode
     
     bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.MARKDOWN))
-    dp = Dispatcher()
+    dp = build_dispatcher()
+
+    if BOT_WORKERS > 1 and not is_worker():
+        # Фронт-процесс: только принимает апдейты и раздаёт их воркерам по чатам
+        await close_db()
+        await run_front(bot, dp.resolve_used_update_types())
+        return
+
+    # Мастера и пользователи в памяти: обычный апдейт не ходит в БД за ролью
+    await identity_cache.warm()
+    # Незавершённые записи и настройки шаблона переживают перезапуск (воркер — только свои чаты)
+    await fsm_storage.warm(owns=owns_chat)
+    if is_worker():
+        # Доля лимита сообщений
+        start_worker()
+    # Сброс кэшей и передача задач между процессами на одной базе
+    await start_shared_state()
     
-    # Запуск системы напоминаний
-    start_reminder_scheduler(bot) # Added call to scheduler
+    # Очередь исходящих сообщений (лимиты Telegram, повторы)
+    messenger.start(bot)
+    # Очистка брошенных сессий (TTL по группам состояний)
+    fsm_storage.start()
+
+    # Фоновые задачи — только у держателя lease (один процесс на базу)
+    async def start_jobs():
+        # Фоновая запись в Google Calendar
+        outbox.start()
+        # Запуск системы напоминаний
+        start_reminder_scheduler(bot)
+
+    async def stop_jobs():
+        stop_reminder_scheduler()
+        await outbox.stop()
+
+    leader.on_acquired(start_jobs)
+    leader.on_lost(stop_jobs)
+    await leader.start()
     
     print("Bot is running...")
     
-    from handlers.start import router as start_router
-    from handlers.master import router as master_router
-    from handlers.client import router as client_router
-    from handlers.template import router as template_router
-    
-    dp.include_router(start_router)
-    dp.include_router(master_router)
-    dp.include_router(client_router)
-    dp.include_router(template_router)
-    
-    await dp.start_polling(bot)
+    try:
+        if is_worker():
+            await run_webhook(dp, bot, "127.0.0.1", WORKER_BASE_PORT + WORKER_INDEX, WORKER_SECRET, register=False)
+        elif BOT_MODE == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            # Telegram refuses getUpdates while a webhook is set (e.g. after switching back from webhook mode)
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        await leader.stop()  # stops the jobs and hands the lease over
+        await fsm_storage.close()  # stops the sweeper; the dispatcher has usually flushed already
+        await messenger.stop()
+        await shared_versions.stop()
+        await close_db()
 
 if __name__ == "__main__":
     try:
@@ -1,10 +1,110 @@
 import os
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Часовой пояс салона. Задаётся здесь, а не в bot.py: config импортируют все точки входа
+# (бот, cron-скрипты, load_services), и datetime.now() везде должен давать московское время
+TIMEZONE = "Europe/Moscow"
+os.environ['TZ'] = TIMEZONE
+if hasattr(time, 'tzset'):
+    time.tzset()
+
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_ID = os.getenv("ADMIN_ID")
 
 if not BOT_TOKEN:
     print("WARNING: BOT_TOKEN is not set in .env")
+
+# --- Run mode ---
+# "polling" (default) or "webhook": aiohttp server behind a TLS reverse proxy (utils/webhook.py)
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+# Public HTTPS base address Telegram posts to (WEBHOOK_URL + WEBHOOK_PATH) and the local listen address
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+# Updates handled concurrently; parallel connections Telegram may open (1-100)
+WEBHOOK_MAX_IN_FLIGHT = int(os.getenv("WEBHOOK_MAX_IN_FLIGHT", "100"))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+# --- Worker processes (utils/workers.py) ---
+# BOT_WORKERS > 1: a front process takes updates (polling or webhook, as above) and hands each chat
+# to one of BOT_WORKERS local processes listening on 127.0.0.1:WORKER_BASE_PORT + index
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", "8100"))
+# Seconds between cross-process cache invalidation checks (database/versions.py)
+WORKER_SYNC_SECONDS = float(os.getenv("WORKER_SYNC_SECONDS", "2"))
+# Set by the front process for the workers it starts (not for .env)
+WORKER_INDEX = int(os.getenv("BOT_WORKER_INDEX", "-1"))
+WORKER_SECRET = os.getenv("BOT_WORKER_SECRET", "")
+
+# --- Background jobs leader (utils/leader.py) ---
+# Of all processes on one database only the lease holder runs reminders and the calendar outbox.
+# A crashed holder is replaced after at most LEASE + HEARTBEAT seconds, a stopped one within HEARTBEAT.
+LEADER_LEASE_SECONDS = float(os.getenv("LEADER_LEASE_SECONDS", "15"))
+LEADER_HEARTBEAT_SECONDS = float(os.getenv("LEADER_HEARTBEAT_SECONDS", "3"))
+
+# --- SQLite performance profile (applied by init_db) ---
+DB_JOURNAL_MODE = os.getenv("DB_JOURNAL_MODE", "WAL")
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "16384"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(64 * 1024 * 1024)))
+DB_CHECKPOINT_MINUTES = int(os.getenv("DB_CHECKPOINT_MINUTES", "10"))
+
+# --- Availability cache ---
+# Seconds a cached slot list built with Google Calendar data stays valid
+AVAILABILITY_GCAL_TTL = int(os.getenv("AVAILABILITY_GCAL_TTL", "120"))
+
+# --- Service catalog cache (database/catalog.py) ---
+# Seconds between checks whether scripts/load_services.py reloaded the catalog
+CATALOG_CHECK_SECONDS = int(os.getenv("CATALOG_CHECK_SECONDS", "30"))
+
+# --- Identity cache (database/identity.py) ---
+# Seconds between re-reads of the masters table (rows edited by hand, e.g. google_calendar_id)
+IDENTITY_REFRESH_SECONDS = int(os.getenv("IDENTITY_REFRESH_SECONDS", "300"))
+
+# --- FSM sessions (utils/fsm_storage.py) ---
+# Minutes an untouched session lives; per state group overrides ("BookingStates=180,TemplateStates=720"; 0 = never)
+FSM_SESSION_TTL_MINUTES = float(os.getenv("FSM_SESSION_TTL_MINUTES", "1440"))
+FSM_STATE_TTL_MINUTES = os.getenv("FSM_STATE_TTL_MINUTES", "BookingStates=180")
+FSM_SWEEP_MINUTES = float(os.getenv("FSM_SWEEP_MINUTES", "10"))
+
+# --- Outbound messages (utils/messenger.py) ---
+# Telegram allows ~30 messages/s per bot and ~1 message/s per chat
+TG_GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "25"))
+TG_CHAT_RATE = float(os.getenv("TG_CHAT_RATE", "1"))
+TG_CHAT_BURST = int(os.getenv("TG_CHAT_BURST", "3"))
+TG_SEND_WORKERS = int(os.getenv("TG_SEND_WORKERS", "8"))
+TG_SEND_RETRIES = int(os.getenv("TG_SEND_RETRIES", "5"))
+
+# --- Reminders ---
+# Catch-up sweep for reminders whose scheduled job didn't deliver
+REMINDER_SWEEP_MINUTES = int(os.getenv("REMINDER_SWEEP_MINUTES", "15"))
+
+# --- Google Calendar busy-time cache (utils/calendar_cache.py) ---
+# Seconds between incremental syncs of a calendar; days of past events kept on a full sync
+CALENDAR_SYNC_SECONDS = int(os.getenv("CALENDAR_SYNC_SECONDS", "60"))
+CALENDAR_LOOKBACK_DAYS = int(os.getenv("CALENDAR_LOOKBACK_DAYS", "1"))
+
+# --- Google Calendar outbox (utils/calendar_outbox.py) ---
+# Jobs per batch request (Google allows up to 50), idle poll interval, retries with backoff
+CALENDAR_OUTBOX_BATCH = int(os.getenv("CALENDAR_OUTBOX_BATCH", "20"))
+CALENDAR_OUTBOX_POLL_SECONDS = int(os.getenv("CALENDAR_OUTBOX_POLL_SECONDS", "30"))
+CALENDAR_OUTBOX_MAX_ATTEMPTS = int(os.getenv("CALENDAR_OUTBOX_MAX_ATTEMPTS", "8"))
+CALENDAR_OUTBOX_RETRY_SECONDS = int(os.getenv("CALENDAR_OUTBOX_RETRY_SECONDS", "30"))
+
+# --- Google Calendar reads: deadline and circuit breaker ---
+# Seconds a client request waits for Google; HTTP socket timeout for the calls themselves
+CALENDAR_READ_TIMEOUT = float(os.getenv("CALENDAR_READ_TIMEOUT", "3"))
+CALENDAR_HTTP_TIMEOUT = int(os.getenv("CALENDAR_HTTP_TIMEOUT", "20"))
+CALENDAR_READ_THREADS = int(os.getenv("CALENDAR_READ_THREADS", "4"))
+# Background cache syncs (utils/calendar_cache.py): deadline per page and their own threads
+CALENDAR_SYNC_TIMEOUT = float(os.getenv("CALENDAR_SYNC_TIMEOUT", "30"))
+CALENDAR_SYNC_THREADS = int(os.getenv("CALENDAR_SYNC_THREADS", "2"))
+# Consecutive failures that open the breaker, and seconds before it lets one trial call through
+CALENDAR_BREAKER_FAILURES = int(os.getenv("CALENDAR_BREAKER_FAILURES", "5"))
+CALENDAR_BREAKER_RESET_SECONDS = int(os.getenv("CALENDAR_BREAKER_RESET_SECONDS", "30"))
@@ -0,0 +1,95 @@
+"""
+In-process availability cache.
+
+Entries are keyed by master_id plus the query parameters (service duration
+and the optional date window) and tagged with the
+master's version counter. Every write that changes a master's schedule bumps
+the counter, so stale entries are simply never matched again. Entries built
+with Google Calendar data also expire after a TTL, because the calendar can
+change without the bot knowing. A stale entry is dropped when it is next
+looked up, and the least recently used ones once there are MAX_ENTRIES, so
+keys of past windows don't pile up for masters that rarely change.
+
+With several worker processes a bump is also published to the others
+(database/versions.py), which drop their entries of that master.
+"""
+import time
+from collections import OrderedDict, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from config import AVAILABILITY_GCAL_TTL
+from database.versions import shared_versions
+
+# Shared version key of a master's schedule (other worker processes drop their entries)
+SCHEDULE_KEY = "schedule:{}"
+# (master, duration, window) combinations kept; a month view is one entry
+MAX_ENTRIES = 5000
+
+
+class AvailabilityCache:
+    def __init__(self, gcal_ttl: int = AVAILABILITY_GCAL_TTL, max_entries: int = MAX_ENTRIES):
+        self.gcal_ttl = gcal_ttl
+        self.max_entries = max_entries
+        self._versions: Dict[int, int] = defaultdict(int)
+        # (master_id, params) -> (version, min_hours, expires_at or None, slots), least recently used first
+        self._entries: "OrderedDict[Tuple[int, tuple], tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def version(self, master_id: int) -> int:
+        return self._versions[master_id]
+
+    def bump(self, master_id: int):
+        """Invalidate every cached entry of this master, here and in the other worker processes"""
+        self.invalidate(master_id)
+        shared_versions.publish(SCHEDULE_KEY.format(master_id))
+
+    def invalidate(self, master_id: int):
+        """Invalidate this process's entries of the master"""
+        self._versions[master_id] += 1
+        for key in [k for k in self._entries if k[0] == master_id]:
+            del self._entries[key]
+
+    def get(self, master_id: int, params: tuple, now_ts: int) -> Optional[List[tuple]]:
+        key = (master_id, params)
+        entry = self._entries.get(key)
+        if entry:
+            version, min_hours, expires_at, slots = entry
+            if version != self._versions[master_id] or (expires_at is not None and time.monotonic() >= expires_at):
+                del self._entries[key]
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                # Slots that slid under the minimum booking time since the entry was built
+                min_start_ts = now_ts + min_hours * 3600
+                if slots and slots[0][2] <= min_start_ts:
+                    slots = [s for s in slots if s[2] > min_start_ts]
+                return slots
+        self.misses += 1
+        return None
+
+    def put(self, master_id: int, params: tuple, version: int, min_hours: int, slots: List[tuple], uses_calendar: bool):
+        # A write landed while we were computing — don't cache a result that may predate it
+        if version != self._versions[master_id]:
+            return
+        expires_at = time.monotonic() + self.gcal_ttl if uses_calendar else None
+        key = (master_id, params)
+        self._entries[key] = (version, min_hours, expires_at, slots)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evicted += 1
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evicted": self.evicted,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+availability_cache = AvailabilityCache()
@@ -0,0 +1,136 @@
+"""
+In-process service catalog.
+
+The booking menus walk categories -> subcategories -> services of one master,
+and the catalog only changes when scripts/load_services.py reloads it. Each
+master's catalog is read from SQLite once and then served from memory.
+
+The importer runs in its own process, so it bumps meta.catalog_version in
+the same transaction as the reload. The cache compares that number with the
+one its catalogs were built from at most every CATALOG_CHECK_SECONDS and
+drops everything when it changed.
+"""
+import time
+from typing import Dict, List, Optional, Tuple
+
+from config import CATALOG_CHECK_SECONDS
+from database.setup import pool
+
+# Display order of the top-level menu; other categories follow alphabetically
+CATEGORY_ORDER = ["🫶🏻 Комплекс", "💅 Маникюр", "🐾 Педикюр", "❤️ Другое", "⛓ Мужской"]
+
+CATALOG_VERSION_KEY = "catalog_version"
+
+
+def _category_key(category: str):
+    return (CATEGORY_ORDER.index(category) if category in CATEGORY_ORDER else len(CATEGORY_ORDER), category)
+
+
+class ServiceCatalog:
+    """One master's services: categories in display order, subcategory tree, id -> service"""
+
+    def __init__(self, rows):
+        # rows: (id, category, subcategory, name, price, duration, description), ordered by id
+        self.services: Dict[int, tuple] = {}
+        # (category, subcategory or None) -> [(id, name, price, duration, description, subcategory)]
+        self.menu: Dict[Tuple[str, Optional[str]], List[tuple]] = {}
+        subcategories: Dict[str, set] = {}
+        for service_id, category, subcategory, name, price, duration, description in rows:
+            # Same shape as get_service_info()
+            self.services[service_id] = (name, price, duration, description, category, subcategory)
+            self.menu.setdefault((category, subcategory), []).append(
+                (service_id, name, price, duration, description, subcategory)
+            )
+            subs = subcategories.setdefault(category, set())
+            if subcategory is not None:
+                subs.add(subcategory)
+        self.categories: List[str] = sorted(subcategories, key=_category_key)
+        self.subcategories: Dict[str, List[str]] = {cat: sorted(subs) for cat, subs in subcategories.items()}
+
+
+async def bump_catalog_version(db):
+    """Call inside the transaction that changes the services table"""
+    await db.execute(
+        "INSERT INTO meta (key, value) VALUES (?, 1) ON CONFLICT(key) DO UPDATE SET value = value + 1",
+        (CATALOG_VERSION_KEY,)
+    )
+
+
+class CatalogCache:
+    def __init__(self, check_seconds: float = CATALOG_CHECK_SECONDS):
+        self.check_seconds = check_seconds
+        self._catalogs: Dict[int, ServiceCatalog] = {}
+        # service id -> master id, for get_service_info() which only knows the service
+        self._owners: Dict[int, int] = {}
+        self._version: Optional[int] = None
+        self._checked_at: Optional[float] = None
+        self.hits = 0
+        self.loads = 0
+        self.reloads = 0
+
+    async def get(self, master_id: int) -> ServiceCatalog:
+        await self._check_version()
+        catalog = self._catalogs.get(master_id)
+        if catalog is not None:
+            self.hits += 1
+            return catalog
+
+        async with pool.read() as db:
+            async with db.execute(
+                "SELECT id, category, subcategory, name, price, duration, description "
+                "FROM services WHERE master_id = ? ORDER BY id",
+                (master_id,)
+            ) as cursor:
+                catalog = ServiceCatalog(await cursor.fetchall())
+        self.loads += 1
+        self._catalogs[master_id] = catalog
+        for service_id in catalog.services:
+            self._owners[service_id] = master_id
+        return catalog
+
+    async def get_service(self, service_id: int) -> Optional[tuple]:
+        """(name, price, duration, description, category, subcategory) or None"""
+        await self._check_version()
+        master_id = self._owners.get(service_id)
+        if master_id is None:
+            async with pool.read() as db:
+                async with db.execute("SELECT master_id FROM services WHERE id = ?", (service_id,)) as cursor:
+                    row = await cursor.fetchone()
+            if not row:
+                return None
+            master_id = row[0]
+        return (await self.get(master_id)).services.get(service_id)
+
+    def invalidate(self):
+        """Drop every catalog (the services table changed in this process)"""
+        self._catalogs.clear()
+        self._owners.clear()
+        self._checked_at = None
+
+    async def _check_version(self):
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.check_seconds:
+            return
+        self._checked_at = now
+        async with pool.read() as db:
+            async with db.execute("SELECT value FROM meta WHERE key = ?", (CATALOG_VERSION_KEY,)) as cursor:
+                row = await cursor.fetchone()
+        version = row[0] if row else 0
+        if self._version is not None and version != self._version:
+            self._catalogs.clear()
+            self._owners.clear()
+            self.reloads += 1
+        self._version = version
+
+    def stats(self) -> dict:
+        return {
+            "masters": len(self._catalogs),
+            "services": len(self._owners),
+            "version": self._version,
+            "hits": self.hits,
+            "loads": self.loads,
+            "reloads": self.reloads,
+        }
+
+
+catalog_cache = CatalogCache()
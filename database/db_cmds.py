@@ -1,322 +1,390 @@
-import aiosqlite
-from database.setup import DB_NAME
+from database.setup import pool
+from database.cache import availability_cache
+from database.catalog import catalog_cache
+from database.identity import identity_cache, MASTER_COLUMNS
+import json
 from typing import Optional, List, Tuple
-from datetime import datetime
+from datetime import datetime, timedelta
+from utils.slot_time import SLOT_MINUTES, resolve_slot_datetime, format_slot, slot_end, to_ts, from_ts
+from utils.availability import merge_intervals, fits_between
+
+# Reminder type -> seconds before the visit (scheduled by reminders/scheduler.py)
+REMINDER_OFFSETS = {"24h": 24 * 3600, "3h": 3 * 3600}
+# A reminder whose time passed less than this long ago is still sent (late booking, restart)
+REMINDER_GRACE = 3600
 
 # --- User Management ---
 async def add_user(user_id: int, username: str, full_name: str, deep_link_master: int = None):
-    async with aiosqlite.connect(DB_NAME) as db:
+    stored = await identity_cache.user(user_id)
+    if stored and (not deep_link_master or stored[2] == deep_link_master):
+        # Already stored as is: no write, no fsync
+        identity_cache.skipped_writes += 1
+        return
+    async with pool.write() as db:
         await db.execute("INSERT OR IGNORE INTO users (id, username, full_name) VALUES (?, ?, ?)", (user_id, username, full_name))
         if deep_link_master:
              await db.execute("UPDATE users SET linked_master_id = ? WHERE id = ?", (deep_link_master, user_id))
-        await db.commit()
+    if stored:
+        identity_cache.user_written(user_id, stored[0], stored[1], deep_link_master)
+    else:
+        identity_cache.user_written(user_id, username, full_name, deep_link_master)
 
 async def get_user_master(user_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT linked_master_id FROM users WHERE id = ?", (user_id,)) as cursor:
-             result = await cursor.fetchone()
-             return result[0] if result else None
+    user = await identity_cache.user(user_id)
+    return user[2] if user else None
 
 # --- Master Management ---
 async def get_master_by_tg_id(telegram_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT * FROM masters WHERE telegram_id = ?", (telegram_id,)) as cursor:
-            return await cursor.fetchone()
+    """(id, telegram_id, name, description, google_calendar_id) or None"""
+    return await identity_cache.master_by_tg(telegram_id)
 
 async def get_master_id_by_tg_id(telegram_id: int):
     row = await get_master_by_tg_id(telegram_id)
     return row[0] if row else None
 
 async def get_master_name_by_id(master_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT name FROM masters WHERE id = ?", (master_id,)) as cursor:
-            result = await cursor.fetchone()
-            return result[0] if result else "Мастер"
+    row = await identity_cache.master_by_id(master_id)
+    return row[2] if row else "Мастер"
 
 async def register_master(telegram_id: int, name: str):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("INSERT INTO masters (telegram_id, name) VALUES (?, ?)", (telegram_id, name))
-        await db.commit()
+    async with pool.write() as db:
+        cursor = await db.execute("INSERT INTO masters (telegram_id, name) VALUES (?, ?)", (telegram_id, name))
+        async with db.execute(f"SELECT {MASTER_COLUMNS} FROM masters WHERE id = ?", (cursor.lastrowid,)) as cursor:
+            row = tuple(await cursor.fetchone())
+    identity_cache.master_added(row)
 
 async def get_master_google_calendar_id(master_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT google_calendar_id FROM masters WHERE id = ?", (master_id,)) as cursor:
-            result = await cursor.fetchone()
-            return result[0] if result else None
+    row = await identity_cache.master_by_id(master_id)
+    return row[4] if row else None
 
 # --- Services Management (New) ---
 async def get_service_categories(master_id: int) -> List[str]:
     """Get all service categories in desired order."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT DISTINCT category FROM services WHERE master_id = ?", (master_id,)) as cursor:
-            rows = await cursor.fetchall()
-            categories = [row[0] for row in rows]
-            
-            # Custom order
-            order = ["🫶🏻 Комплекс", "💅 Маникюр", "🐾 Педикюр", "❤️ Другое", "⛓ Мужской"]
-            return sorted(categories, key=lambda x: order.index(x) if x in order else 999)
+    return (await catalog_cache.get(master_id)).categories
 
 async def get_subcategories(master_id: int, category: str) -> List[str]:
     """Get subcategories for a category (returns empty if none)."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute(
-            "SELECT DISTINCT subcategory FROM services WHERE master_id = ? AND category = ? AND subcategory IS NOT NULL ORDER BY subcategory",
-            (master_id, category)
-        ) as cursor:
-            rows = await cursor.fetchall()
-            return [row[0] for row in rows]
+    return (await catalog_cache.get(master_id)).subcategories.get(category, [])
 
 async def get_services_in_category(master_id: int, category: str, subcategory: str = None):
     """Get services, optionally filtered by subcategory."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        if subcategory:
-            query = "SELECT id, name, price, duration, description, subcategory FROM services WHERE master_id = ? AND category = ? AND subcategory = ?"
-            params = (master_id, category, subcategory)
-        else:
-            query = "SELECT id, name, price, duration, description, subcategory FROM services WHERE master_id = ? AND category = ? AND subcategory IS NULL"
-            params = (master_id, category)
-        
-        async with db.execute(query, params) as cursor:
-            return await cursor.fetchall()
+    return (await catalog_cache.get(master_id)).menu.get((category, subcategory or None), [])
 
 async def get_service_info(service_id: int):
     """Returns (name, price, duration, description, category, subcategory)"""
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute(
-            "SELECT name, price, duration, description, category, subcategory FROM services WHERE id = ?",
-            (service_id,)
-        ) as cursor:
-            return await cursor.fetchone()
+    return await catalog_cache.get_service(service_id)
 
 # --- Slot Management ---
-async def add_slot(master_tg_id: int, datetime_str: str):
+async def add_slot(master_tg_id: int, datetime_str: str, slot_dt: Optional[datetime] = None):
+    """Add a free slot. slot_dt pins the exact date; otherwise the year is resolved from datetime_str."""
     master = await get_master_by_tg_id(master_tg_id)
     if not master: return False
     master_id = master[0]
     
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT id FROM slots WHERE master_id = ? AND datetime = ?", (master_id, datetime_str)) as cursor:
-            if await cursor.fetchone():
-                return "duplicate"
-        await db.execute("INSERT INTO slots (master_id, datetime, is_booked) VALUES (?, ?, 0)", (master_id, datetime_str))
-        await db.commit()
+    start = slot_dt or resolve_slot_datetime(datetime_str)
+    if not start: return False
+    start_ts = to_ts(start)
+    
+    async with pool.write() as db:
+        # Store the canonical 'DD.MM HH:MM' form even if the master typed '5.2 9:00'.
+        # The unique (master_id, start_ts) index turns a duplicate into a no-op.
+        cursor = await db.execute(
+            "INSERT OR IGNORE INTO slots (master_id, datetime, is_booked, start_ts, end_ts) VALUES (?, ?, 0, ?, ?)",
+            (master_id, format_slot(start), start_ts, to_ts(slot_end(start)))
+        )
+        if cursor.rowcount == 0:
+            return "duplicate"
+    availability_cache.bump(master_id)
     return True
 
+async def _drop_calendar_events(db, slot_ids: List[int]) -> int:
+    """
+    The bookings are gone: drop their Google Calendar writes still in the outbox
+    and queue deletion of events already created. Returns the number of deletes queued.
+    """
+    await db.executemany(
+        "DELETE FROM calendar_outbox WHERE slot_id = ? AND action != 'delete'", [(slot_id,) for slot_id in slot_ids]
+    )
+    now_ts = to_ts(datetime.now())
+    cursor = await db.executemany(
+        "INSERT INTO calendar_outbox (slot_id, action, calendar_id, event_id, attempts, next_attempt_ts, created_ts) "
+        "SELECT id, 'delete', gcal_calendar_id, gcal_event_id, 0, ?, ? FROM slots WHERE id = ? AND gcal_event_id IS NOT NULL",
+        [(now_ts, now_ts, slot_id) for slot_id in slot_ids]
+    )
+    return max(cursor.rowcount, 0)
+
+async def _queue_calendar_event(db, slot_id: int, master_id: int, start_ts: int, duration_minutes: int,
+                                client_name: str, service_name: str) -> bool:
+    """
+    Queue creation of the booking's event in the master's first (personal) calendar,
+    inside the booking's transaction. Returns False if the master has no calendar.
+    """
+    from utils.google_calendar import build_event_body, split_calendar_ids
+    async with db.execute("SELECT google_calendar_id FROM masters WHERE id = ?", (master_id,)) as cursor:
+        row = await cursor.fetchone()
+    calendar_ids = split_calendar_ids(row[0] if row else None)
+    if not calendar_ids:
+        return False
+    body = build_event_body(from_ts(start_ts), duration_minutes, client_name, service_name)
+    now_ts = to_ts(datetime.now())
+    await db.execute(
+        "INSERT INTO calendar_outbox (slot_id, action, calendar_id, body, attempts, next_attempt_ts, created_ts) "
+        "VALUES (?, 'create', ?, ?, 0, ?, ?)",
+        (slot_id, calendar_ids[0], json.dumps(body, ensure_ascii=False), now_ts, now_ts)
+    )
+    return True
+
+def _wake_calendar_outbox():
+    from utils.calendar_outbox import outbox
+    outbox.wake()
+
 async def delete_slot_db(slot_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT id FROM slots WHERE id = ?", (slot_id,)) as cursor:
-            if not await cursor.fetchone(): return False
+    async with pool.write() as db:
+        async with db.execute("SELECT master_id FROM slots WHERE id = ?", (slot_id,)) as cursor:
+            row = await cursor.fetchone()
+            if not row: return False
+        await db.execute("DELETE FROM reminders WHERE slot_id = ?", (slot_id,))
+        queued = await _drop_calendar_events(db, [slot_id])
         await db.execute("DELETE FROM slots WHERE id = ?", (slot_id,))
-        await db.commit()
-        return True
+    availability_cache.bump(row[0])
+    if queued:
+        _wake_calendar_outbox()
+    return True
 
-async def get_master_slots_with_ids(master_tg_id: int):
-    """Get master slots with booking details: (slot_id, datetime, is_booked, client_id, client_name, client_username, service_name, service_price)"""
-    master = await get_master_by_tg_id(master_tg_id)
-    if not master: return []
-    master_id = master[0]
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute('''
-            SELECT 
-                slots.id, 
-                slots.datetime, 
-                slots.is_booked, 
-                slots.client_id,
-                users.full_name,
-                users.username,
-                services.name,
-                services.price,
-                services.category,
-                services.subcategory
-            FROM slots 
-            LEFT JOIN users ON slots.client_id = users.id
-            LEFT JOIN services ON slots.service_id = services.id
-            WHERE slots.master_id = ? 
-            ORDER BY slots.datetime
-        ''', (master_id,)) as cursor:
+async def clear_master_day(master_id: int, day) -> Tuple[int, List[tuple]]:
+    """
+    Delete the master's remaining slots of one day (date or datetime) in one transaction,
+    together with slots blocked by those bookings and their reminders.
+    Slots that already started are kept as history.
+    Returns (deleted_count, [(slot_id, datetime, client_id), ...] of the cancelled bookings).
+    """
+    day_start = datetime(day.year, day.month, day.day)
+    ts_from = max(to_ts(day_start), to_ts(datetime.now()))
+    ts_to = to_ts(day_start + timedelta(days=1))
+    
+    async with pool.write() as db:
+        async with db.execute(
+            "SELECT id, datetime, is_booked, client_id, blocked_by FROM slots "
+            "WHERE master_id = ? AND start_ts >= ? AND start_ts < ? ORDER BY start_ts",
+            (master_id, ts_from, ts_to)
+        ) as cursor:
+            rows = await cursor.fetchall()
+        if not rows:
+            return 0, []
+        
+        bookings = [(slot_id, dt, client_id) for slot_id, dt, is_booked, client_id, blocked_by in rows
+                    if is_booked and not blocked_by and client_id]
+        
+        await db.executemany("DELETE FROM reminders WHERE slot_id = ?", [(row[0],) for row in rows])
+        queued = await _drop_calendar_events(db, [b[0] for b in bookings])
+        # Slots blocked by these bookings (may reach past midnight), then the rest of the day
+        cursor = await db.executemany("DELETE FROM slots WHERE blocked_by = ?", [(b[0],) for b in bookings])
+        deleted = max(cursor.rowcount, 0)
+        cursor = await db.execute(
+            "DELETE FROM slots WHERE master_id = ? AND start_ts >= ? AND start_ts < ?",
+            (master_id, ts_from, ts_to)
+        )
+        deleted += cursor.rowcount
+    
+    availability_cache.bump(master_id)
+    if queued:
+        _wake_calendar_outbox()
+    return deleted, bookings
+
+# Slot row with booking details, shared by the master schedule queries
+MASTER_SLOT_SELECT = '''
+    SELECT 
+        slots.id, 
+        slots.datetime, 
+        slots.is_booked, 
+        slots.client_id,
+        users.full_name,
+        users.username,
+        services.name,
+        services.price,
+        services.category,
+        services.subcategory
+    FROM slots 
+    LEFT JOIN users ON slots.client_id = users.id
+    LEFT JOIN services ON slots.service_id = services.id
+'''
+
+async def get_master_slots_with_ids(master_tg_id: int, date_from: Optional[datetime] = None, date_to: Optional[datetime] = None):
+    """
+    Get master slots with booking details: (slot_id, datetime, is_booked, client_id, client_name, client_username, service_name, service_price, service_category, service_subcategory)
+    Optionally limited to slots starting in [date_from, date_to).
+    """
+    master_id = await get_master_id_by_tg_id(master_tg_id)
+    if not master_id: return []
+    ts_from = to_ts(date_from) if date_from else 0
+    ts_to = to_ts(date_to) if date_to else 2**62
+    async with pool.read() as db:
+        async with db.execute(
+            MASTER_SLOT_SELECT + "WHERE slots.master_id = ? AND slots.start_ts >= ? AND slots.start_ts < ? ORDER BY slots.start_ts",
+            (master_id, ts_from, ts_to)
+        ) as cursor:
             return await cursor.fetchall()
 
+async def get_master_slots_for_day(master_tg_id: int, day, upcoming_only: bool = False):
+    """
+    Slots of one calendar day (date or datetime), same row format as get_master_slots_with_ids.
+    upcoming_only: skip slots that already started (by start_ts).
+    """
+    day_start = datetime(day.year, day.month, day.day)
+    date_from = max(day_start, datetime.now()) if upcoming_only else day_start
+    return await get_master_slots_with_ids(master_tg_id, date_from=date_from, date_to=day_start + timedelta(days=1))
+
+async def get_master_slot(master_tg_id: int, slot_id: int):
+    """
+    One slot with booking details (same row format as get_master_slots_with_ids).
+    Returns None if the slot doesn't exist or belongs to another master.
+    """
+    master_id = await get_master_id_by_tg_id(master_tg_id)
+    if not master_id: return None
+    async with pool.read() as db:
+        async with db.execute(
+            MASTER_SLOT_SELECT + "WHERE slots.id = ? AND slots.master_id = ?",
+            (slot_id, master_id)
+        ) as cursor:
+            return await cursor.fetchone()
+
 async def get_all_masters():
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT id, name FROM masters") as cursor:
-            return await cursor.fetchall()
+    return [(row[0], row[2]) for row in await identity_cache.all_masters()]
 
-async def get_available_slots(master_id: int, service_duration: int = 30):
-    """Get available slots, respecting minimum booking time and service duration overlaps"""
+async def get_available_slots(master_id: int, service_duration: int = 30,
+                              date_from: Optional[datetime] = None, date_to: Optional[datetime] = None):
+    """
+    Get available slots, respecting minimum booking time and service duration overlaps.
+    date_from/date_to limit the result to slots starting in [date_from, date_to) — the
+    window is applied in SQL and to the Google Calendar request.
+    Returns [(slot_id, datetime_str, start_ts), ...] in chronological order.
+    """
     from database.template_cmds import get_master_settings
-    from datetime import datetime, timedelta
+    
+    now = datetime.now()
+    window_from_ts = to_ts(date_from) if date_from else 0
+    window_to_ts = to_ts(date_to) if date_to else 2**62
+    cache_key = (service_duration, window_from_ts, window_to_ts)
+    cached = availability_cache.get(master_id, cache_key, to_ts(now))
+    if cached is not None:
+        return cached
+    # Captured before reading, so a write that lands mid-computation discards our result
+    version = availability_cache.version(master_id)
     
     min_hours = await get_master_settings(master_id)
     
-    async with aiosqlite.connect(DB_NAME) as db:
-        # Get free slots
-        async with db.execute(
-            "SELECT id, datetime FROM slots WHERE master_id = ? AND is_booked = 0 ORDER BY datetime", 
-            (master_id,)
-        ) as cursor:
-            all_slots = await cursor.fetchall()
-        
-        # Get booked slots (to check overlaps)
+    # Слоты в прошлом и ближе чем min_hours не предлагаем
+    min_start_ts = max(to_ts(now + timedelta(hours=min_hours)), window_from_ts - 1)
+    
+    # One query for both free slots and bookings. A booking's end_ts already
+    # spans its service duration; bookings started up to a day earlier may still overlap,
+    # and a booking starting right after the window can still clash with its last slot.
+    async with pool.read() as db:
         async with db.execute(
-            "SELECT id, datetime, service_id FROM slots WHERE master_id = ? AND is_booked = 1 AND blocked_by IS NULL ORDER BY datetime",
-            (master_id,)
+            "SELECT id, datetime, start_ts, end_ts, is_booked, blocked_by FROM slots "
+            "WHERE master_id = ? AND start_ts > ? AND start_ts < ? ORDER BY start_ts",
+            (master_id, min_start_ts - 86400, window_to_ts + service_duration * 60)
         ) as cursor:
-            booked_slots = await cursor.fetchall()
+            rows = await cursor.fetchall()
     
-    # Parse booked slots with their durations
-    booked_ranges = []
+    free_slots = []
+    busy = []
+    for slot_id, datetime_str, start_ts, end_ts, is_booked, blocked_by in rows:
+        if not is_booked:
+            if min_start_ts < start_ts < window_to_ts:
+                free_slots.append((slot_id, datetime_str, start_ts))
+        elif blocked_by is None:
+            busy.append((start_ts, end_ts or start_ts + SLOT_MINUTES * 60))
     
     # --- Integration with Google Calendar ---
-    google_cal_id = await get_master_google_calendar_id(master_id)
-    if google_cal_id and all_slots:
-        from utils.google_calendar import get_occupied_slots_range
-        
-        # Find the date range of all slots (min and max dates) for a SINGLE API call
-        now = datetime.now()
-        slot_dates = []
-        for _, datetime_str in all_slots:
-            try:
-                day_month = datetime_str.split()[0]
-                day, month = map(int, day_month.split('.'))
-                year = now.year if month >= now.month else now.year + 1
-                slot_dates.append(f"{year}-{month:02d}-{day:02d}")
-            except:
-                continue
+    google_cal_value = await get_master_google_calendar_id(master_id)
+    if google_cal_value and free_slots:
+        from utils.google_calendar import get_busy_intervals, split_calendar_ids
         
-        if slot_dates:
-            date_from = min(slot_dates)
-            date_to = max(slot_dates)
-            
-            # ONE API call for the full range instead of N calls
-            google_occupied = await get_occupied_slots_range(google_cal_id, date_from, date_to)
-            for date_str, start_str, end_str in google_occupied:
-                try:
-                    y, m, d = map(int, date_str.split('-'))
-                    sh, sm = map(int, start_str.split(':'))
-                    eh, em = map(int, end_str.split(':'))
-                    g_start = datetime(y, m, d, sh, sm)
-                    g_end = datetime(y, m, d, eh, em)
-                    booked_ranges.append((g_start, g_end))
-                except:
-                    continue
-
-    for _, booked_dt_str, booked_svc_id in booked_slots:
-        booked_dt = _parse_slot_dt(booked_dt_str)
-        if not booked_dt:
-            continue
-        # Get duration for this booked service
-        if booked_svc_id:
-            async with aiosqlite.connect(DB_NAME) as db:
-                async with db.execute("SELECT duration FROM services WHERE id = ?", (booked_svc_id,)) as cursor:
-                    svc = await cursor.fetchone()
-                    booked_dur = svc[0] if svc and svc[0] else 30
-        else:
-            booked_dur = 30
-        booked_end = booked_dt + timedelta(minutes=booked_dur)
-        booked_ranges.append((booked_dt, booked_end))
-    
-    # Filter slots
-    now = datetime.now()
-    min_booking_time = now + timedelta(hours=min_hours)
+        # Busy periods of all the master's calendars (personal + salon), already merged
+        busy.extend(await get_busy_intervals(
+            split_calendar_ids(google_cal_value), free_slots[0][2], free_slots[-1][2] + service_duration * 60
+        ))
     
-    filtered_slots = []
-    for slot_id, datetime_str in all_slots:
-        try:
-            day_month, time = datetime_str.split()
-            day, month = map(int, day_month.split('.'))
-            hour, minute = map(int, time.split(':'))
-            
-            slot_dt = datetime(now.year, month, day, hour, minute)
-            
-            # Слот в прошлом — пропускаем
-            if slot_dt <= now:
-                continue
-            
-            # Слот должен быть дальше чем min_hours
-            if slot_dt <= min_booking_time:
-                continue
-            
-            # Проверяем что выбранная услуга не перекроет существующую запись
-            slot_end = slot_dt + timedelta(minutes=service_duration)
-            overlap = False
-            for booked_start, booked_end in booked_ranges:
-                # Перекрытие: новая услуга заканчивается после начала существующей
-                # ИЛИ новая услуга начинается до окончания существующей
-                if slot_dt < booked_end and slot_end > booked_start:
-                    overlap = True
-                    break
-            
-            if not overlap:
-                filtered_slots.append((slot_id, datetime_str))
-        except:
-            continue
-    
-    # Sort slots chronologically since SQLite's ORDER BY sorts '01.04' before '25.03' alphabetically
-    filtered_slots.sort(key=lambda x: _parse_slot_dt(x[1]) or datetime.max)
-    
-    return filtered_slots
-
-def _parse_slot_dt(datetime_str: str):
-    """Parse 'DD.MM HH:MM' into datetime object (current year)"""
-    from datetime import datetime
-    try:
-        day_month, time = datetime_str.split()
-        day, month = map(int, day_month.split('.'))
-        hour, minute = map(int, time.split(':'))
-        return datetime(datetime.now().year, month, day, hour, minute)
-    except:
-        return None
+    # Один проход по отсортированным окошкам против слитых занятых интервалов
+    available = fits_between(free_slots, merge_intervals(busy), service_duration * 60)
+    availability_cache.put(master_id, cache_key, version, min_hours, available, uses_calendar=bool(google_cal_value))
+    return available
 
-async def book_slot(slot_id: int, client_id: int, service_id: int = None):
-    """Book a slot and block adjacent slots based on service duration"""
-    from datetime import timedelta
-    
-    async with aiosqlite.connect(DB_NAME) as db:
-        # Check slot is available
-        async with db.execute("SELECT is_booked, datetime, master_id FROM slots WHERE id = ?", (slot_id,)) as cursor:
+async def book_slot(slot_id: int, client_id: int, service_id: int = None,
+                    client_name: str = None, service_name: str = "Услуга"):
+    """
+    Book a slot and block adjacent slots based on service duration.
+    Runs as one BEGIN IMMEDIATE transaction: the slot is claimed with a conditional
+    UPDATE, so of two concurrent bookings only one can succeed.
+    With client_name the Google Calendar event is queued in the same transaction
+    (utils/calendar_outbox.py), so a crash can't leave a booking without it.
+    """
+    if client_name:
+        import utils.google_calendar  # heavy first import, not under the write lock
+    queued = False
+    async with pool.write() as db:
+        duration_minutes = None
+        if service_id:
+            async with db.execute("SELECT duration FROM services WHERE id = ?", (service_id,)) as cursor:
+                svc = await cursor.fetchone()
+                duration_minutes = svc[0] if svc and svc[0] else None
+        duration_sec = (duration_minutes or SLOT_MINUTES) * 60
+        
+        async with db.execute("SELECT start_ts, master_id FROM slots WHERE id = ? AND is_booked = 0", (slot_id,)) as cursor:
             result = await cursor.fetchone()
-            if not result or result[0] == 1: return False
+            if not result: return False
+        start_ts, master_id = result
+        end_ts = start_ts + duration_sec
         
-        slot_datetime_str = result[1]
-        master_id = result[2]
+        # The service must not run into another booking (both could have looked free a moment ago)
+        async with db.execute(
+            "SELECT 1 FROM slots WHERE master_id = ? AND is_booked = 1 AND blocked_by IS NULL "
+            "AND start_ts > ? AND start_ts < ? AND end_ts > ? LIMIT 1",
+            (master_id, start_ts - 86400, end_ts, start_ts)
+        ) as cursor:
+            if await cursor.fetchone(): return False
         
-        # Book the main slot
-        await db.execute("UPDATE slots SET is_booked = 1, client_id = ?, service_id = ? WHERE id = ?", (client_id, service_id, slot_id))
+        # Claim the main slot
+        cursor = await db.execute(
+            "UPDATE slots SET is_booked = 1, client_id = ?, service_id = ?, end_ts = ? WHERE id = ? AND is_booked = 0",
+            (client_id, service_id, end_ts, slot_id)
+        )
+        if cursor.rowcount != 1: return False
         
-        # Block adjacent slots based on service duration
-        if service_id:
-            async with db.execute("SELECT duration FROM services WHERE id = ?", (service_id,)) as cursor:
-                svc = await cursor.fetchone()
-                if svc and svc[0] and svc[0] > 30:
-                    duration_minutes = svc[0]
-                    slot_dt = _parse_slot_dt(slot_datetime_str)
-                    if slot_dt:
-                        end_dt = slot_dt + timedelta(minutes=duration_minutes)
-                        
-                        # Find all slots on the same day that overlap
-                        date_prefix = slot_datetime_str.split()[0]  # 'DD.MM'
-                        async with db.execute(
-                            "SELECT id, datetime FROM slots WHERE master_id = ? AND is_booked = 0 AND datetime LIKE ?",
-                            (master_id, f"{date_prefix}%")
-                        ) as cursor:
-                            day_slots = await cursor.fetchall()
-                        
-                        for other_id, other_dt_str in day_slots:
-                            other_dt = _parse_slot_dt(other_dt_str)
-                            if other_dt and slot_dt < other_dt < end_dt:
-                                await db.execute(
-                                    "UPDATE slots SET is_booked = 1, blocked_by = ? WHERE id = ?",
-                                    (slot_id, other_id)
-                                )
+        # Pending reminders, in the same transaction as the booking
+        now_ts = to_ts(datetime.now())
+        await db.executemany(
+            "INSERT INTO reminders (slot_id, client_id, reminder_type, sent, due_ts) VALUES (?, ?, ?, 0, ?) "
+            "ON CONFLICT (slot_id, reminder_type) DO UPDATE SET "
+            "client_id = excluded.client_id, sent = 0, sent_at = NULL, due_ts = excluded.due_ts",
+            [(slot_id, client_id, reminder_type, start_ts - offset)
+             for reminder_type, offset in REMINDER_OFFSETS.items()
+             if start_ts - offset >= now_ts - REMINDER_GRACE]
+        )
+        
+        # Block adjacent slots that start inside the service duration
+        if duration_minutes and duration_minutes > 30:
+            await db.execute(
+                "UPDATE slots SET is_booked = 1, blocked_by = ? WHERE master_id = ? AND is_booked = 0 AND start_ts > ? AND start_ts < ?",
+                (slot_id, master_id, start_ts, end_ts)
+            )
         
-        await db.commit()
-        return True
+        if client_name:
+            queued = await _queue_calendar_event(
+                db, slot_id, master_id, start_ts, duration_minutes or 60, client_name, service_name
+            )
+    
+    availability_cache.bump(master_id)
+    if queued:
+        _wake_calendar_outbox()
+    return True
 
 async def get_slot_info(slot_id: int):
-    """Returns (datetime, master_id, service_name, price)"""
-    async with aiosqlite.connect(DB_NAME) as db:
+    """Returns (datetime, master_id, service_name, price, start_ts)"""
+    async with pool.read() as db:
         async with db.execute('''
-            SELECT slots.datetime, slots.master_id, services.name, services.price 
+            SELECT slots.datetime, slots.master_id, services.name, services.price, slots.start_ts 
             FROM slots 
             LEFT JOIN services ON slots.service_id = services.id 
             WHERE slots.id = ?
@@ -325,7 +393,7 @@ async def get_slot_info(slot_id: int):
 
 async def get_master_tg_id_by_slot_id(slot_id: int):
     """Returns telegram_id of the master who owns this slot."""
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.read() as db:
         async with db.execute('''
             SELECT masters.telegram_id FROM slots
             JOIN masters ON slots.master_id = masters.id
@@ -337,9 +405,7 @@ async def get_master_tg_id_by_slot_id(slot_id: int):
 
 async def get_client_bookings(client_id: int):
     """Get client bookings with full service details (only future)"""
-    from datetime import datetime
-    
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.read() as db:
         async with db.execute('''
             SELECT 
                 slots.id, 
@@ -352,32 +418,16 @@ async def get_client_bookings(client_id: int):
             FROM slots 
             JOIN masters ON slots.master_id = masters.id 
             LEFT JOIN services ON slots.service_id = services.id
-            WHERE slots.client_id = ? AND slots.is_booked = 1 
-            ORDER BY slots.datetime
-        ''', (client_id,)) as cursor:
-            all_bookings = await cursor.fetchall()
-    
-    # Фильтруем прошедшие записи
-    now = datetime.now()
-    future_bookings = []
-    for booking in all_bookings:
-        datetime_str = booking[1]  # slots.datetime
-        try:
-            day_month, time = datetime_str.split()
-            day, month = map(int, day_month.split('.'))
-            hour, minute = map(int, time.split(':'))
-            slot_dt = datetime(now.year, month, day, hour, minute)
-            if slot_dt > now:
-                future_bookings.append(booking)
-        except:
-            continue
-    
-    return future_bookings
+            WHERE slots.client_id = ? AND slots.is_booked = 1 AND slots.start_ts > ?
+            ORDER BY slots.start_ts
+        ''', (client_id, to_ts(datetime.now()))) as cursor:
+            return await cursor.fetchall()
 
 async def cancel_booking_db(slot_id: int, client_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT id FROM slots WHERE id = ? AND client_id = ? AND is_booked = 1", (slot_id, client_id)) as cursor:
-            if not await cursor.fetchone(): return False
+    async with pool.write() as db:
+        async with db.execute("SELECT master_id FROM slots WHERE id = ? AND client_id = ? AND is_booked = 1", (slot_id, client_id)) as cursor:
+            row = await cursor.fetchone()
+            if not row: return False
         
         # Unblock all slots that were blocked by this booking
         await db.execute(
@@ -385,10 +435,17 @@ async def cancel_booking_db(slot_id: int, client_id: int):
             (slot_id,)
         )
         
+        # The booking is gone: its reminders and calendar event too (the slot may be booked again)
+        await db.execute("DELETE FROM reminders WHERE slot_id = ?", (slot_id,))
+        queued = await _drop_calendar_events(db, [slot_id])
+        
         # Clear the main booking
         await db.execute(
-            "UPDATE slots SET is_booked = 0, client_id = NULL, service_id = NULL WHERE id = ?",
-            (slot_id,)
+            "UPDATE slots SET is_booked = 0, client_id = NULL, service_id = NULL, end_ts = start_ts + ?, "
+            "gcal_calendar_id = NULL, gcal_event_id = NULL WHERE id = ?",
+            (SLOT_MINUTES * 60, slot_id)
         )
-        await db.commit()
-        return True
+    availability_cache.bump(row[0])
+    if queued:
+        _wake_calendar_outbox()
+    return True
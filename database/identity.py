@@ -0,0 +1,129 @@
+"""
+In-process identity cache: who is a master, which master a client is linked to.
+
+Nearly every update starts with get_master_by_tg_id() or add_user(). Both
+tables are small and written only through register_master()/add_user(),
+which update the cache after their transaction commits (write-through), so
+after warm() at startup those lookups never touch SQLite and add_user()
+skips the write for a user that is already stored as is.
+
+The masters table is also edited by hand (google_calendar_id), so it is
+re-read as a whole every IDENTITY_REFRESH_SECONDS. With several worker
+processes a registration is published to the others (database/versions.py),
+which re-read it right away. Users need no such thing: a user's updates
+always go to the same worker, the only one that writes and reads the row.
+"""
+import time
+from typing import Dict, List, Optional
+
+from config import IDENTITY_REFRESH_SECONDS
+from database.setup import pool
+from database.versions import shared_versions
+
+# Column order of the cached master rows (what get_master_by_tg_id() returns)
+MASTER_COLUMNS = "id, telegram_id, name, description, google_calendar_id"
+
+# Shared version key of the masters table
+MASTERS_KEY = "masters"
+
+
+class IdentityCache:
+    def __init__(self, refresh_seconds: float = IDENTITY_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        # Masters rows (MASTER_COLUMNS), by telegram_id and by id
+        self._masters_by_tg: Dict[int, tuple] = {}
+        self._masters_by_id: Dict[int, tuple] = {}
+        self._masters_loaded_at: Optional[float] = None
+        self._masters_writes = 0
+        # user id -> (username, full_name, linked_master_id)
+        self._users: Dict[int, tuple] = {}
+        self._users_loaded = False
+        self.hits = 0
+        self.queries = 0
+        self.skipped_writes = 0
+
+    async def warm(self):
+        """Load both tables (call once at startup)"""
+        await self._load_masters()
+        async with pool.read() as db:
+            async with db.execute("SELECT id, username, full_name, linked_master_id FROM users") as cursor:
+                self._users = {row[0]: tuple(row[1:]) for row in await cursor.fetchall()}
+        self._users_loaded = True
+        self.queries += 1
+
+    # --- Masters ---
+    async def master_by_tg(self, telegram_id: int) -> Optional[tuple]:
+        await self._fresh_masters()
+        return self._masters_by_tg.get(telegram_id)
+
+    async def master_by_id(self, master_id: int) -> Optional[tuple]:
+        await self._fresh_masters()
+        return self._masters_by_id.get(master_id)
+
+    async def all_masters(self) -> List[tuple]:
+        await self._fresh_masters()
+        return [self._masters_by_id[master_id] for master_id in sorted(self._masters_by_id)]
+
+    def master_added(self, row: tuple):
+        """Write-through from register_master()"""
+        self._masters_by_tg[row[1]] = row
+        self._masters_by_id[row[0]] = row
+        self._masters_writes += 1
+        shared_versions.publish(MASTERS_KEY)
+
+    def invalidate_masters(self):
+        """Re-read the masters table on the next lookup (after editing it outside the helpers)"""
+        self._masters_loaded_at = None
+
+    async def _fresh_masters(self):
+        if self._masters_loaded_at is not None and time.monotonic() - self._masters_loaded_at < self.refresh_seconds:
+            self.hits += 1
+            return
+        await self._load_masters()
+
+    async def _load_masters(self):
+        writes = self._masters_writes
+        async with pool.read() as db:
+            async with db.execute(f"SELECT {MASTER_COLUMNS} FROM masters") as cursor:
+                rows = [tuple(row) for row in await cursor.fetchall()]
+        self.queries += 1
+        if writes != self._masters_writes:
+            # A master registered while we were reading: keep the write-through, re-read next time
+            self._masters_loaded_at = None
+            return
+        self._masters_by_tg = {row[1]: row for row in rows}
+        self._masters_by_id = {row[0]: row for row in rows}
+        self._masters_loaded_at = time.monotonic()
+
+    # --- Users ---
+    async def user(self, user_id: int) -> Optional[tuple]:
+        """(username, full_name, linked_master_id) or None if the user isn't stored"""
+        if self._users_loaded or user_id in self._users:
+            self.hits += 1
+            return self._users.get(user_id)
+        async with pool.read() as db:
+            async with db.execute(
+                "SELECT username, full_name, linked_master_id FROM users WHERE id = ?", (user_id,)
+            ) as cursor:
+                row = await cursor.fetchone()
+        self.queries += 1
+        if row:
+            # add_user() may have written through while we were reading
+            return self._users.setdefault(user_id, tuple(row))
+        return self._users.get(user_id)
+
+    def user_written(self, user_id: int, username: str, full_name: str, linked_master_id: Optional[int]):
+        """Write-through from add_user()"""
+        self._users[user_id] = (username, full_name, linked_master_id)
+
+    def stats(self) -> dict:
+        return {
+            "masters": len(self._masters_by_id),
+            "users": len(self._users),
+            "hits": self.hits,
+            "queries": self.queries,
+            "skipped_writes": self.skipped_writes,
+        }
+
+
+identity_cache = IdentityCache()
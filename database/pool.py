@@ -0,0 +1,110 @@
+"""
+Connection pool for SQLite.
+
+One writer connection (serialized by a lock) and a small pool of reader
+connections. Connections are opened once per process and reused, so a query
+costs a queue hop instead of a new worker thread plus a file open.
+
+The writer runs in autocommit mode and every write() block is an explicit
+BEGIN IMMEDIATE transaction: the write lock is taken up front, so a
+read-check-write sequence inside the block can't interleave with another
+process writing the same rows.
+"""
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+import aiosqlite
+
+READER_COUNT = 3
+# Prepared statements kept per connection (sqlite3 default is 128)
+STATEMENT_CACHE_SIZE = 256
+
+
+class ConnectionPool:
+    def __init__(self, path: str, readers: int = READER_COUNT, pragmas: Optional[Dict[str, object]] = None):
+        self.path = path
+        self.readers = readers
+        # Applied to every connection right after it is opened
+        self.pragmas = pragmas or {}
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._write_lock = asyncio.Lock()
+        self._open_lock = asyncio.Lock()
+        self._idle: Optional[asyncio.Queue] = None
+        self._all_readers: List[aiosqlite.Connection] = []
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+
+    async def _connect(self, **kwargs) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.path, cached_statements=STATEMENT_CACHE_SIZE, **kwargs)
+        for name, value in self.pragmas.items():
+            await conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    async def open(self):
+        """Open the writer and reader connections (no-op if already open)."""
+        async with self._open_lock:
+            if self.is_open:
+                return
+            # Autocommit: transactions are opened explicitly in write()
+            self._writer = await self._connect(isolation_level=None)
+            self._idle = asyncio.Queue()
+            for _ in range(self.readers):
+                conn = await self._connect()
+                self._all_readers.append(conn)
+                self._idle.put_nowait(conn)
+            logging.info(f"DB pool: opened '{self.path}' (1 writer, {self.readers} readers)")
+
+    async def close(self):
+        """Close every pooled connection."""
+        async with self._open_lock:
+            if not self.is_open:
+                return
+            async with self._write_lock:
+                for conn in self._all_readers:
+                    await conn.close()
+                await self._writer.close()
+            self._writer = None
+            self._idle = None
+            self._all_readers = []
+            logging.info("DB pool: closed")
+
+    @asynccontextmanager
+    async def read(self):
+        """Borrow a reader connection for SELECTs."""
+        if not self.is_open:
+            await self.open()
+        conn = await self._idle.get()
+        try:
+            yield conn
+        finally:
+            # Never hand out a connection with a dangling read transaction
+            if conn.in_transaction:
+                await conn.rollback()
+            self._idle.put_nowait(conn)
+
+    @asynccontextmanager
+    async def write(self, transaction: bool = True):
+        """
+        Exclusive access to the writer connection inside a BEGIN IMMEDIATE transaction.
+        Commits on normal exit, rolls back if the block raises.
+        transaction=False gives the bare connection for statements that can't run
+        inside a transaction (wal_checkpoint, VACUUM).
+        """
+        if not self.is_open:
+            await self.open()
+        async with self._write_lock:
+            if not transaction:
+                yield self._writer
+                return
+            await self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.rollback()
+                raise
+            else:
+                await self._writer.commit()
@@ -1,9 +1,61 @@
-import aiosqlite
+import logging
+from database.pool import ConnectionPool
+from config import (
+    DB_JOURNAL_MODE, DB_SYNCHRONOUS, DB_BUSY_TIMEOUT_MS,
+    DB_CACHE_SIZE_KB, DB_MMAP_SIZE
+)
 
 DB_NAME = "beautybot.db"
 
+# Performance profile applied to every pooled connection.
+# WAL lets the reminder scan and handler reads run while a booking is being written.
+DB_PRAGMAS = {
+    "journal_mode": DB_JOURNAL_MODE,
+    "synchronous": DB_SYNCHRONOUS,
+    "busy_timeout": DB_BUSY_TIMEOUT_MS,
+    "cache_size": -DB_CACHE_SIZE_KB,  # negative value = size in KiB
+    "mmap_size": DB_MMAP_SIZE,
+    "temp_store": "MEMORY",
+}
+
+# Secondary indexes for every hot lookup (scripts/check_query_plans.py keeps them honest).
+# masters.telegram_id needs none: its UNIQUE constraint already creates one.
+INDEXES = [
+    # Master schedule by time range: calendar month, day view, list view.
+    # UNIQUE: one slot per master per start time, lets slot generation use INSERT OR IGNORE
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_slots_master_start ON slots (master_id, start_ts)",
+    # Free/booked slots of a master; covers the availability queries
+    "CREATE INDEX IF NOT EXISTS idx_slots_master_booked ON slots (master_id, is_booked, start_ts, end_ts, blocked_by, datetime)",
+    # Client's bookings ("Мои записи", booking limit)
+    "CREATE INDEX IF NOT EXISTS idx_slots_client ON slots (client_id, is_booked, start_ts)",
+    # Upcoming bookings across all masters (reminder scan)
+    "CREATE INDEX IF NOT EXISTS idx_slots_booked_start ON slots (is_booked, start_ts)",
+    # Slots blocked by a multi-slot booking (cancel_booking_db)
+    "CREATE INDEX IF NOT EXISTS idx_slots_blocked_by ON slots (blocked_by) WHERE blocked_by IS NOT NULL",
+    # One reminder of each type per slot: sends are idempotent (upsert on this key)
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_reminders_slot_type ON reminders (slot_id, reminder_type)",
+    # Pending reminders by due time (startup reconcile)
+    "CREATE INDEX IF NOT EXISTS idx_reminders_pending ON reminders (sent, due_ts)",
+    "CREATE INDEX IF NOT EXISTS idx_template_master_day ON schedule_template (master_id, day_of_week, time)",
+    "CREATE INDEX IF NOT EXISTS idx_vacation_master_date ON vacation_days (master_id, date)",
+    # Booking menus: categories -> subcategories -> services
+    "CREATE INDEX IF NOT EXISTS idx_services_master_category ON services (master_id, category, subcategory)",
+    # Google Calendar outbox: due jobs (worker), jobs of a booking (cancel)
+    "CREATE INDEX IF NOT EXISTS idx_calendar_outbox_due ON calendar_outbox (next_attempt_ts)",
+    "CREATE INDEX IF NOT EXISTS idx_calendar_outbox_slot ON calendar_outbox (slot_id)",
+]
+
+# Process-wide connection pool, shared by every database helper
+pool = ConnectionPool(DB_NAME, pragmas=DB_PRAGMAS)
+
 async def init_db():
-    async with aiosqlite.connect(DB_NAME) as db:
+    await pool.open()
+    async with pool.read() as db:
+        async with db.execute("PRAGMA journal_mode") as cursor:
+            journal_mode = (await cursor.fetchone())[0]
+    logging.info(f"Database: journal_mode={journal_mode}, synchronous={DB_SYNCHRONOUS}, busy_timeout={DB_BUSY_TIMEOUT_MS}ms")
+
+    async with pool.write() as db:
         # Table: Users (Clients)
         # Added linked_master_id
         await db.execute('''
@@ -72,6 +124,10 @@ async def init_db():
                 client_id INTEGER,
                 service_id INTEGER,
                 blocked_by INTEGER,
+                start_ts INTEGER,
+                end_ts INTEGER,
+                gcal_calendar_id TEXT,
+                gcal_event_id TEXT,
                 FOREIGN KEY(master_id) REFERENCES masters(id),
                 FOREIGN KEY(client_id) REFERENCES users(id),
                 FOREIGN KEY(service_id) REFERENCES services(id),
@@ -88,6 +144,18 @@ async def init_db():
             await db.execute("ALTER TABLE slots ADD COLUMN blocked_by INTEGER")
         except:
             pass
+        try:
+            await db.execute("ALTER TABLE slots ADD COLUMN start_ts INTEGER")
+            await db.execute("ALTER TABLE slots ADD COLUMN end_ts INTEGER")
+        except:
+            pass
+        await _backfill_slot_timestamps(db)
+        # Google Calendar event of the booking, set by utils/calendar_outbox.py
+        try:
+            await db.execute("ALTER TABLE slots ADD COLUMN gcal_calendar_id TEXT")
+            await db.execute("ALTER TABLE slots ADD COLUMN gcal_event_id TEXT")
+        except:
+            pass
         
         # Table: Schedule Template (Weekly recurring slots)
         await db.execute('''
@@ -128,10 +196,182 @@ async def init_db():
                 reminder_type TEXT,
                 sent BOOLEAN DEFAULT 0,
                 sent_at TEXT,
+                due_ts INTEGER,
                 FOREIGN KEY(slot_id) REFERENCES slots(id),
                 FOREIGN KEY(client_id) REFERENCES users(id)
             )
         ''')
+        # Pending reminders (sent = 0) are the persistent job store of reminders/scheduler.py
+        try:
+            await db.execute("ALTER TABLE reminders ADD COLUMN due_ts INTEGER")
+        except:
+            pass
+
+        # Small shared counters, e.g. catalog_version bumped by scripts/load_services.py (database/catalog.py)
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER
+            )
+        ''')
+
+        # Leases (utils/leader.py): which process runs the background jobs, until when
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                holder TEXT,
+                expires_at REAL,
+                term INTEGER
+            )
+        ''')
+
+        # FSM sessions (utils/fsm_storage.py): booking/template flows survive a restart
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS fsm_sessions (
+                key TEXT PRIMARY KEY,
+                state TEXT,
+                data TEXT,
+                updated_ts INTEGER
+            )
+        ''')
+
+        # Google Calendar busy-time cache (utils/calendar_cache.py): sync token and timed events per calendar
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS calendar_sync (
+                calendar_id TEXT PRIMARY KEY,
+                sync_token TEXT,
+                synced_at TEXT
+            )
+        ''')
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS calendar_busy (
+                calendar_id TEXT,
+                event_id TEXT,
+                start_ts INTEGER,
+                end_ts INTEGER,
+                PRIMARY KEY (calendar_id, event_id)
+            )
+        ''')
+
+        # Google Calendar writes waiting for the background worker (utils/calendar_outbox.py)
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS calendar_outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                slot_id INTEGER,
+                action TEXT,
+                calendar_id TEXT,
+                event_id TEXT,
+                body TEXT,
+                attempts INTEGER DEFAULT 0,
+                next_attempt_ts INTEGER,
+                created_ts INTEGER,
+                last_error TEXT
+            )
+        ''')
 
-        await db.commit()
+        await _dedupe_slots(db)
+        await _dedupe_reminders(db)
+        for statement in INDEXES:
+            try:
+                await db.execute(statement)
+            except Exception as e:
+                logging.error(f"Database: cannot create index ({statement}): {e}")
+        # Superseded by uq_slots_master_start / uq_reminders_slot_type
+        await db.execute("DROP INDEX IF EXISTS idx_slots_master_start")
+        await db.execute("DROP INDEX IF EXISTS idx_reminders_slot_type")
     print("Database initialized.")
+
+async def _dedupe_slots(db):
+    """
+    Remove duplicate (master_id, start_ts) slots so the unique index can be built.
+    Keeps the booked copy (a main booking before a blocked neighbour), otherwise the oldest one.
+    Runs only until the index exists.
+    """
+    async with db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'uq_slots_master_start'"
+    ) as cursor:
+        if await cursor.fetchone():
+            return
+    
+    async with db.execute('''
+        SELECT id FROM (
+            SELECT id, ROW_NUMBER() OVER (
+                PARTITION BY master_id, start_ts
+                ORDER BY is_booked DESC, blocked_by IS NOT NULL, id
+            ) AS rn
+            FROM slots
+            WHERE start_ts IS NOT NULL
+        )
+        WHERE rn > 1
+    ''') as cursor:
+        duplicates = [(row[0],) for row in await cursor.fetchall()]
+    
+    if duplicates:
+        await db.executemany("DELETE FROM reminders WHERE slot_id = ?", duplicates)
+        await db.executemany("DELETE FROM slots WHERE id = ?", duplicates)
+        logging.warning(f"Database: removed {len(duplicates)} duplicate slots before adding the unique index")
+
+async def _backfill_slot_timestamps(db):
+    """
+    Fill start_ts/end_ts for slots created before the columns existed.
+    Such a slot was created at most GENERATION_HORIZON_DAYS ahead, so it gets the
+    latest year that keeps it within that: old slots stay in the past.
+    """
+    from datetime import timedelta
+    from utils.slot_time import GENERATION_HORIZON_DAYS, local_now, resolve_slot_datetime, slot_end, to_ts
+    
+    async with db.execute('''
+        SELECT slots.id, slots.datetime, slots.is_booked, slots.blocked_by, services.duration
+        FROM slots
+        LEFT JOIN services ON slots.service_id = services.id
+        WHERE slots.start_ts IS NULL
+    ''') as cursor:
+        rows = await cursor.fetchall()
+    
+    not_after = local_now() + timedelta(days=GENERATION_HORIZON_DAYS)
+    updates = []
+    for slot_id, datetime_str, is_booked, blocked_by, duration in rows:
+        start = resolve_slot_datetime(datetime_str, not_after=not_after)
+        if not start:
+            logging.warning(f"Slot {slot_id}: cannot parse datetime '{datetime_str}', left without start_ts")
+            continue
+        # A booking occupies the whole service duration, anything else is one slot
+        occupied = duration if is_booked and not blocked_by else None
+        updates.append((to_ts(start), to_ts(slot_end(start, occupied)), slot_id))
+    
+    if updates:
+        await db.executemany("UPDATE slots SET start_ts = ?, end_ts = ? WHERE id = ?", updates)
+        logging.info(f"Database: backfilled start_ts for {len(updates)} slots")
+
+async def _dedupe_reminders(db):
+    """Keep one reminder per (slot_id, reminder_type) — the sent one if any — before the unique index"""
+    async with db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'uq_reminders_slot_type'"
+    ) as cursor:
+        if await cursor.fetchone():
+            return
+    
+    cursor = await db.execute('''
+        DELETE FROM reminders WHERE id IN (
+            SELECT id FROM (
+                SELECT id, ROW_NUMBER() OVER (
+                    PARTITION BY slot_id, reminder_type ORDER BY sent DESC, id
+                ) AS rn
+                FROM reminders
+            )
+            WHERE rn > 1
+        )
+    ''')
+    if cursor.rowcount > 0:
+        logging.warning(f"Database: removed {cursor.rowcount} duplicate reminders before adding the unique index")
+
+async def checkpoint_wal():
+    """Fold the WAL file back into the database so it doesn't grow between restarts"""
+    async with pool.write(transaction=False) as db:
+        async with db.execute("PRAGMA wal_checkpoint(TRUNCATE)") as cursor:
+            busy, log_pages, checkpointed = await cursor.fetchone()
+    if busy:
+        logging.info(f"WAL checkpoint incomplete (readers active): {checkpointed}/{log_pages} pages")
+
+async def close_db():
+    await pool.close()
@@ -0,0 +1,135 @@
+"""
+Cross-process cache invalidation between bot processes on one database
+(multi-worker mode in utils/workers.py, or two services on the same file).
+
+Each process keeps its own in-memory caches, so a write in one process has
+to reach the others. Whatever invalidates a cache also publishes a key
+("schedule:<master_id>", "masters", ...). Every WORKER_SYNC_SECONDS a process adds the keys it published to counters in
+the meta table and reads all counters back; keys some other process bumped
+are handed to the subscribed callbacks. A change reaches the others within
+about two sync intervals — bookings themselves are still checked against
+the database, only menus can lag that long.
+
+Scripts don't start the sync, so there publish() does nothing.
+"""
+import asyncio
+import inspect
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import WORKER_SYNC_SECONDS
+from database.setup import pool
+
+# meta keys of the counters; ";" sorts right after ":", so the range is read from the primary key
+KEY_PREFIX = "sync:"
+KEY_END = "sync;"
+
+
+class SharedVersions:
+    def __init__(self, sync_seconds: float = WORKER_SYNC_SECONDS):
+        self.sync_seconds = sync_seconds
+        self.enabled = False
+        self._pending = set()
+        # counter key (without the prefix) -> last value seen
+        self._seen: Dict[str, int] = {}
+        self._subscribers: List[Tuple[str, Callable[[str], Any]]] = []
+        self._task: Optional[asyncio.Task] = None
+        self.syncs = 0
+        self.published = 0
+        self.received = 0
+
+    def subscribe(self, prefix: str, callback: Callable[[str], Any]):
+        """callback(key) for every key starting with prefix that another process bumped; may be async"""
+        self._subscribers.append((prefix, callback))
+
+    def publish(self, key: str):
+        """This process changed what key stands for (call after the write commits)"""
+        if self.enabled:
+            self._pending.add(key)
+
+    async def start(self):
+        """Take the current counters as the baseline and sync every sync_seconds"""
+        self.enabled = True
+        await self.sync(notify=False)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop syncing; what is still pending is published"""
+        if not self.enabled:
+            return
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.sync(notify=False)
+        self.enabled = False
+
+    async def sync(self, notify: bool = True) -> int:
+        """Publish pending keys, then notify about keys bumped elsewhere. Returns the number notified."""
+        keys, self._pending = self._pending, set()
+        if keys:
+            try:
+                async with pool.write() as db:
+                    await db.executemany(
+                        "INSERT INTO meta (key, value) VALUES (?, 1) ON CONFLICT(key) DO UPDATE SET value = value + 1",
+                        [(KEY_PREFIX + key,) for key in sorted(keys)]
+                    )
+            except Exception as e:
+                self._pending |= keys
+                logging.error(f"Shared versions: cannot publish {len(keys)} keys: {e}")
+                keys = set()
+            # Our own bumps are expected; anything beyond them came from another process
+            for key in keys:
+                self._seen[key] = self._seen.get(key, 0) + 1
+            self.published += len(keys)
+
+        async with pool.read() as db:
+            async with db.execute(
+                "SELECT key, value FROM meta WHERE key >= ? AND key < ?", (KEY_PREFIX, KEY_END)
+            ) as cursor:
+                rows = await cursor.fetchall()
+        self.syncs += 1
+
+        changed = []
+        for full_key, value in rows:
+            key = full_key[len(KEY_PREFIX):]
+            if self._seen.get(key) != value:
+                self._seen[key] = value
+                changed.append(key)
+        if not notify:
+            return 0
+        for key in changed:
+            for prefix, callback in self._subscribers:
+                if key.startswith(prefix):
+                    try:
+                        result = callback(key)
+                        if inspect.isawaitable(result):
+                            await result
+                    except Exception as e:
+                        logging.exception(f"Shared versions: '{key}' handler failed: {e}")
+        self.received += len(changed)
+        return len(changed)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sync_seconds)
+            try:
+                await self.sync()
+            except Exception as e:
+                logging.exception(f"Shared versions: sync failed: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "keys": len(self._seen),
+            "syncs": self.syncs,
+            "published": self.published,
+            "received": self.received,
+            "pending": len(self._pending),
+        }
+
+
+shared_versions = SharedVersions()
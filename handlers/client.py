@@ -10,6 +10,12 @@ from database.db_cmds import (
     get_master_tg_id_by_slot_id
 )
 from config import ADMIN_ID
+from utils.slot_time import from_ts, month_bounds, resolve_slot_datetime
+from utils.messenger import messenger, Priority
+from reminders.scheduler import schedule_booking_reminders, unschedule_booking_reminders
+
+# How far ahead the calendar looks for the first month with free slots
+LOOKAHEAD_MONTHS = 6
 
 router = Router()
 
@@ -220,56 +226,37 @@ async def show_slots_logic(message: types.Message, state: FSMContext, edit_messa
     master_id = data.get("master_id")
     service_id = data.get("service_id")
     
-    # Получаем длительность выбранной услуги
-    svc_duration = 30
-    if service_id:
-        svc_info = await get_service_info(service_id)
-        if svc_info and svc_info[2]:
-            svc_duration = svc_info[2]
-    
-    slots = await get_available_slots(master_id, svc_duration)
-    
-    if not slots:
-        text = "Пока нет свободных окошек 🥺\nПопробуйте позже!"
-        if edit_message:
-            await message.edit_text(text)
-        else:
-            await message.answer(text)
-        return
+    # Получаем длительность выбранной услуги (svc_info нужен и для заголовка)
+    svc_info = await get_service_info(service_id) if service_id else None
+    svc_duration = svc_info[2] if svc_info and svc_info[2] else 30
     
-    # Calculate Current Year and Month
-    now = datetime.now()
-    if not year or not month:
-        # Default to first available month with slots, or current month
+    if year and month:
+        month_start, month_end = month_bounds(year, month)
+        slots = await get_available_slots(master_id, svc_duration, date_from=month_start, date_to=month_end)
+    else:
+        # Default to the first month that has free slots — fetched one month at a time
+        now = datetime.now()
         year, month = now.year, now.month
+        slots = []
+        for _ in range(LOOKAHEAD_MONTHS):
+            month_start, month_end = month_bounds(year, month)
+            slots = await get_available_slots(master_id, svc_duration, date_from=month_start, date_to=month_end)
+            if slots:
+                break
+            year, month = month_end.year, month_end.month
         
-        # Simple optimization: if no slots in current month, try next months
-        # (This is basic, assumes slots are sorted and exist)
-        if slots:
-            first_slot_date = slots[0][1].split()[0] # "DD.MM"
-            s_day, s_month = map(int, first_slot_date.split('.'))
-            target_date = datetime(now.year, s_month, s_day)
-            # If the slot is earlier in the year than current month, it's next year (e.g. now=Dec, slot=Jan)
-            if target_date < now and s_month < now.month:
-                year = now.year + 1
-            month = s_month
-    
-    # Filter slots for the selected month and collect free days
-    days_with_free = set()
-    for s_id, s_time in slots:
-        date_part = s_time.split()[0]  # "DD.MM"
-        d, m = map(int, date_part.split('.'))
-        
-        # Determine slot year (heuristic: if month < now.month, it's next year)
-        slot_year = now.year
-        if m < now.month:
-            slot_year += 1
-            
-        if slot_year == year and m == month:
-            days_with_free.add(d)
+        if not slots:
+            text = "Пока нет свободных окошек 🥺\nПопробуйте позже!"
+            if edit_message:
+                await message.edit_text(text)
+            else:
+                await message.answer(text)
+            return
     
-    # Get service info for title
-    svc_info = await get_service_info(service_id)
+    # Slots are already limited to the selected month
+    days_with_free = {from_ts(s_ts).day for s_id, s_time, s_ts in slots}
+    
+    # Service title (svc_info loaded above)
     svc_name, svc_price, svc_dur, svc_desc, svc_cat, svc_subcat = svc_info
     
     # Build full service title
@@ -313,35 +300,42 @@ async def process_client_calendar_ignore(callback: types.CallbackQuery):
 async def show_day_times(callback: types.CallbackQuery, state: FSMContext):
     """Уровень 2: Показ времен для выбранного дня"""
     from datetime import datetime
-    from handlers.master import get_weekday_for_date
+    from handlers.master import WEEKDAYS_SHORT
     
-    date_str = callback.data.split("_")[1]  # "DD.MM"
+    parts = callback.data.split("_")
+    date_str = parts[1]  # "DD.MM"
     
     data = await state.get_data()
     master_id = data.get("master_id")
     service_id = data.get("service_id")
     
-    # Получаем длительность выбранной услуги
-    svc_duration = 30
-    if service_id:
-        svc_info = await get_service_info(service_id)
-        if svc_info and svc_info[2]:
-            svc_duration = svc_info[2]
+    # Получаем длительность выбранной услуги (svc_info нужен и для заголовка)
+    svc_info = await get_service_info(service_id) if service_id else None
+    svc_duration = svc_info[2] if svc_info and svc_info[2] else 30
     
-    slots = await get_available_slots(master_id, svc_duration)
+    from datetime import timedelta
+    # "day_DD.MM_YYYY-MM" like the master calendar; buttons sent before the year was added guess it
+    try:
+        if len(parts) > 2:
+            day, month = map(int, date_str.split("."))
+            day_start = datetime(int(parts[2].split("-")[0]), month, day)
+        else:
+            day_start = resolve_slot_datetime(f"{date_str} 00:00")
+    except ValueError:
+        day_start = None
+    if not day_start:
+        await callback.answer("На этот день нет окошек", show_alert=True)
+        return
+    slots = await get_available_slots(master_id, svc_duration, date_from=day_start, date_to=day_start + timedelta(days=1))
     
-    # Filter slots for this day
-    day_slots = [(s_id, s_time) for s_id, s_time in slots if s_time.startswith(date_str)]
+    # Only this day's slots, already in chronological order
+    day_slots = [(s_id, s_time) for s_id, s_time, s_ts in slots]
     
     if not day_slots:
         await callback.answer("На этот день нет окошек", show_alert=True)
         return
     
-    # Sort by time
-    day_slots.sort(key=lambda x: datetime.strptime(x[1], "%d.%m %H:%M"))
-    
-    # Get service info for title
-    svc_info = await get_service_info(service_id)
+    # Service title (svc_info loaded above)
     svc_name, svc_price, svc_dur, svc_desc, svc_cat, svc_subcat = svc_info
    
     cat_clean = svc_cat.split(' ', 1)[1] if ' ' in svc_cat else svc_cat
@@ -351,7 +345,7 @@ async def show_day_times(callback: types.CallbackQuery, state: FSMContext):
         full_title = f"{cat_clean} • {svc_name}"
     
     # Build message
-    weekday = get_weekday_for_date(date_str)
+    weekday = WEEKDAYS_SHORT[day_start.weekday()]
     title = f"✅ *{full_title}* — {int(svc_price)}₽\n\n"
     title += f"📅 *{weekday} {date_str}*\n\n"
     title += "🕐 Выберите время:"
@@ -466,44 +460,38 @@ async def confirm_booking(callback: types.CallbackQuery, state: FSMContext, bot:
     
     datetime_str = slot_info[0]
     
-    # Проверка времени
+    # Проверка времени: если слот в прошлом - отклонить
     from datetime import datetime
-    try:
-        day_month, time = datetime_str.split()
-        day, month = map(int, day_month.split('.'))
-        hour, minute = map(int, time.split(':'))
-        now = datetime.now()
-        slot_dt = datetime(now.year, month, day, hour, minute)
-        
-        # Если слот в прошлом - отклонить
-        if slot_dt <= now:
-            await callback.message.edit_text(
-                "❌ К сожалению, это время уже прошло.\n"
-                "Пожалуйста, выберите другое окошко."
-            )
-            await state.clear()
-            await callback.answer()
-            return
-    except:
-        pass  # Если не удалось распарсить - продолжить (безопаснее)
+    start_ts = slot_info[4]
+    if start_ts and from_ts(start_ts) <= datetime.now():
+        await callback.message.edit_text(
+            "❌ К сожалению, это время уже прошло.\n"
+            "Пожалуйста, выберите другое окошко."
+        )
+        await state.clear()
+        await callback.answer()
+        return
     
-    success = await book_slot(slot_id, client_id, service_id)
+    svc_info = await get_service_info(service_id) if service_id else None
+    if svc_info:
+        svc_name, svc_price, svc_dur, svc_desc, svc_cat, svc_subcat = svc_info
+        cat_clean = svc_cat.split(' ', 1)[1] if ' ' in svc_cat else svc_cat
+        if svc_subcat:
+            full_svc = f"{cat_clean} ({svc_subcat}) • {svc_name}"
+        else:
+            full_svc = f"{cat_clean} • {svc_name}"
+    else:
+        full_svc = "Услуга"
+    
+    # The Google Calendar event is queued with the booking and written in the background (utils/calendar_outbox.py)
+    client_display = callback.from_user.full_name or callback.from_user.username or "Клиент"
+    success = await book_slot(slot_id, client_id, service_id, client_name=client_display, service_name=full_svc)
     
     if success:
+        await schedule_booking_reminders(slot_id)
         slot_info = await get_slot_info(slot_id)
         datetime_str = slot_info[0]
         
-        svc_info = await get_service_info(service_id) if service_id else None
-        if svc_info:
-            svc_name, svc_price, svc_dur, svc_desc, svc_cat, svc_subcat = svc_info
-            cat_clean = svc_cat.split(' ', 1)[1] if ' ' in svc_cat else svc_cat
-            if svc_subcat:
-                full_svc = f"{cat_clean} ({svc_subcat}) • {svc_name}"
-            else:
-                full_svc = f"{cat_clean} • {svc_name}"
-        else:
-            full_svc = "Услуга"
-        
         from handlers.master import format_slot_with_weekday
         formatted_time = format_slot_with_weekday(datetime_str)
         
@@ -516,51 +504,10 @@ async def confirm_booking(callback: types.CallbackQuery, state: FSMContext, bot:
         
         admin_text = f"🔔 *Новая запись!*\nКлиент: {client_link}\nВремя: {formatted_time}\nУслуга: {full_svc}"
             
-        try:
-            # Notify the master who owns this slot
-            master_tg_id = await get_master_tg_id_by_slot_id(slot_id)
-            if master_tg_id:
-                await bot.send_message(chat_id=master_tg_id, text=admin_text)
-            else:
-                # Fallback to admin
-                await bot.send_message(chat_id=ADMIN_ID, text=admin_text)
-        except: pass
+        # Notify the master who owns this slot (fallback to admin)
+        master_tg_id = await get_master_tg_id_by_slot_id(slot_id)
+        messenger.send(master_tg_id or ADMIN_ID, admin_text, priority=Priority.HIGH)
         
-        # Sync booking to Google Calendar (safe — failure doesn't affect booking)
-        try:
-            from utils.google_calendar import create_calendar_event
-            from database.db_cmds import get_master_google_calendar_id
-            data = await state.get_data()
-            master_id = data.get('master_id')
-            if not master_id:
-                raise Exception("Не найден master_id в FSM context (кто мастер?)")
-            
-            cal_id = await get_master_google_calendar_id(master_id)
-            if not cal_id:
-                raise Exception(f"У мастера ID={master_id} нет Google Calendar в базе.")
-            if not svc_info:
-                raise Exception("Не найдена информация об услуге (svc_info=None).")
-
-            # datetime_str format: 'DD.MM HH:MM'
-            date_part, time_part = datetime_str.split()
-            duration = svc_info[2] if svc_info[2] else 60
-            client_display = callback.from_user.full_name or callback.from_user.username or "Клиент"
-            
-            await create_calendar_event(
-                calendar_id=cal_id,
-                date_str=date_part,
-                time_str=time_part,
-                duration_minutes=duration,
-                client_name=client_display,
-                service_name=full_svc
-            )
-        except Exception as e:
-            import logging
-            logging.warning(f"Google Calendar sync after booking failed (non-critical): {e}")
-            try:
-                from config import ADMIN_ID
-                await bot.send_message(chat_id=ADMIN_ID, text=f"⚠️ Ошибка Google Calendar: {str(e)}")
-            except: pass
     else:
         await callback.message.edit_text("❌ Упс, это окошко уже заняли.")
         
@@ -619,6 +566,7 @@ async def process_cancel(callback: types.CallbackQuery, bot: Bot):
     success = await cancel_booking_db(slot_id, client_id)
     
     if success:
+        unschedule_booking_reminders(slot_id)
         msg = f"🗑 Запись на *{datetime_str}* отменена."
         await callback.message.edit_text(msg)
         
@@ -630,9 +578,7 @@ async def process_cancel(callback: types.CallbackQuery, bot: Bot):
         if svc_name:
              admin_msg += f"\nУслуга: {svc_name}" 
              
-        try:
-             await bot.send_message(chat_id=ADMIN_ID, text=admin_msg)
-        except: pass
+        messenger.send(ADMIN_ID, admin_msg, priority=Priority.HIGH)
     else:
         await callback.answer("Не удалось отменить.")
     await callback.answer()
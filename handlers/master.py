@@ -2,12 +2,18 @@ from aiogram import Router, F, types, Bot
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from database.db_cmds import register_master, get_master_by_tg_id, add_slot, get_master_slots_with_ids, get_master_id_by_tg_id, delete_slot_db
-from keyboards.master import master_panel_kb, cancel_kb
+from database.db_cmds import (
+    register_master, get_master_by_tg_id, add_slot, get_master_slots_with_ids, get_master_id_by_tg_id, delete_slot_db,
+    get_master_slot, get_master_slots_for_day
+)
+from keyboards.master import master_panel_kb
 from keyboards.basic import main_menu_kb
 from config import ADMIN_ID
-from datetime import datetime, timedelta
+from datetime import datetime
 from typing import Optional
+from utils.slot_time import resolve_slot_datetime, month_bounds
+from utils.messenger import messenger, Priority
+from reminders.scheduler import unschedule_booking_reminders
 
 router = Router()
 
@@ -21,13 +27,8 @@ class MasterStates(StatesGroup):
     selecting_time = State()
 
 def parse_slot_datetime(slot_str: str) -> Optional[datetime]:
-    """Parse slot datetime string like '05.02 14:00' to datetime object."""
-    try:
-        current_year = datetime.now().year
-        dt = datetime.strptime(f"{slot_str} {current_year}", "%d.%m %H:%M %Y")
-        return dt
-    except:
-        return None
+    """Parse slot datetime string like '05.02 14:00' to datetime object (year closest to now)."""
+    return resolve_slot_datetime(slot_str)
 
 def is_slot_in_past(slot_str: str) -> bool:
     """Check if slot datetime is in the past."""
@@ -110,13 +111,9 @@ async def process_addslot_calendar(callback: types.CallbackQuery, state: FSMCont
     is_today = selected_date == now.date()
     
     # Получаем уже существующие слоты на эту дату
-    existing_slots = await get_master_slots_with_ids(callback.from_user.id)
+    existing_slots = await get_master_slots_for_day(callback.from_user.id, selected_date)
     date_formatted = selected_date.strftime('%d.%m')
-    existing_times = set()
-    for slot in existing_slots:
-        slot_datetime = slot[1]  # "DD.MM HH:MM"
-        if slot_datetime.startswith(date_formatted):
-            existing_times.add(slot_datetime.split()[1])  # "HH:MM"
+    existing_times = {slot[1].split()[1] for slot in existing_slots}  # "HH:MM"
     
     for hour in range(9, 21):
         for minute in [0, 30]:
@@ -155,8 +152,10 @@ async def process_time_selection(callback: types.CallbackQuery, state: FSMContex
     
     date_obj = datetime.strptime(date_str, "%Y-%m-%d")
     full_datetime = f"{date_obj.strftime('%d.%m')} {time_str}"
+    hour, minute = map(int, time_str.split(':'))
+    slot_dt = date_obj.replace(hour=hour, minute=minute)
     
-    result = await add_slot(callback.fromuser.id if hasattr(callback, "fromuser") else callback.from_user.id, full_datetime)
+    result = await add_slot(callback.from_user.id, full_datetime, slot_dt=slot_dt)
     
     if result == True:
         await callback.answer(f"Окошко {time_str} добавлено!", show_alert=False)
@@ -231,19 +230,17 @@ async def process_manual_slot_time(message: types.Message, state: FSMContext):
 # --- View/Manage Schedule ---
 async def build_schedule_message(user_id: int):
     """Build schedule overview - level 1: grouped by days"""
-    from datetime import datetime
     from collections import defaultdict
     
-    slots = await get_master_slots_with_ids(user_id)
+    # Only future slots, already in chronological order
+    slots = await get_master_slots_with_ids(user_id, date_from=datetime.now())
     
-    # Filter out past slots and group by date
+    # Group by date
     slots_by_date = defaultdict(list)
     for row in slots:
         time_str = row[1]  # datetime is second field
-        if not is_slot_in_past(time_str):
-            # Extract date part (DD.MM)
-            date_part = time_str.split()[0]  # "DD.MM"
-            slots_by_date[date_part].append(row)
+        date_part = time_str.split()[0]  # "DD.MM"
+        slots_by_date[date_part].append(row)
     
     if not slots_by_date:
         return "📅 Расписание пусто.", None
@@ -251,15 +248,16 @@ async def build_schedule_message(user_id: int):
     kb = InlineKeyboardBuilder()
     text = "📅 *Ваше Расписание*\n_Нажмите на день для деталей_\n\n"
     
-    # Create buttons for each day with counters
-    for date_str in sorted(slots_by_date.keys(), key=lambda d: parse_date_for_sort(d)):
+    # Create buttons for each day with counters (dict keeps chronological insertion order)
+    for date_str in slots_by_date:
         day_slots = slots_by_date[date_str]
         total = len(day_slots)
         booked = sum(1 for row in day_slots if row[2] == 1)
         
         # Format: "Пн 05.02 (2/4)" - booked/total
-        weekday = get_weekday_for_date(date_str)
-        kb.button(text=f"{weekday} {date_str} ({booked}/{total})", callback_data=f"schedule_day_{date_str}")
+        day = parse_date_for_sort(date_str)
+        kb.button(text=f"{WEEKDAYS_SHORT[day.weekday()]} {date_str} ({booked}/{total})",
+                  callback_data=f"schedule_day_{date_str}_{day.year}-{day.month:02d}")
     
     kb.adjust(2)  # 2 days per row
     kb.row(types.InlineKeyboardButton(text="📅 К календарю", callback_data="back_to_schedule_overview"))
@@ -267,31 +265,33 @@ async def build_schedule_message(user_id: int):
 
 def parse_date_for_sort(date_str: str):
     """Parse DD.MM to sortable format"""
-    try:
-        from datetime import datetime
-        day, month = map(int, date_str.split('.'))
-        # Assume current year
-        year = datetime.now().year
-        return datetime(year, month, day)
-    except:
-        return datetime.now()
+    dt = resolve_slot_datetime(f"{date_str} 00:00")
+    return dt or datetime.now()
+
+def resolve_day(date_str: str, year_month: Optional[str] = None) -> datetime:
+    """'DD.MM' + 'YYYY-MM' from callback data -> day; without a year the closest one"""
+    if year_month:
+        try:
+            return datetime.strptime(f"{date_str}.{year_month.split('-')[0]}", "%d.%m.%Y")
+        except ValueError:
+            pass
+    return parse_date_for_sort(date_str)
+
+def parse_day_callback(data: str, prefix: str):
+    """'<prefix>DD.MM[_YYYY-MM]' -> ("DD.MM", "YYYY-MM" or None)"""
+    parts = data[len(prefix):].split("_")
+    return parts[0], parts[1] if len(parts) > 1 else None
 
 def get_weekday_for_date(date_str: str):
     """Get weekday name for DD.MM date"""
-    try:
-        from datetime import datetime
-        day, month = map(int, date_str.split('.'))
-        year = datetime.now().year
-        dt = datetime(year, month, day)
-        return WEEKDAYS_SHORT[dt.weekday()]
-    except:
-        return ""
+    dt = resolve_slot_datetime(f"{date_str} 00:00")
+    return WEEKDAYS_SHORT[dt.weekday()] if dt else ""
 
 async def build_calendar_data(user_id: int, year: int, month: int):
     """Get sets of days with free/booked slots for a given month"""
-    from collections import defaultdict
-    
-    slots = await get_master_slots_with_ids(user_id)
+    month_start, month_end = month_bounds(year, month)
+    # Past slots of the month are not shown
+    slots = await get_master_slots_with_ids(user_id, date_from=max(month_start, datetime.now()), date_to=month_end)
     
     days_with_free = set()
     days_with_booked = set()
@@ -299,20 +299,11 @@ async def build_calendar_data(user_id: int, year: int, month: int):
     for row in slots:
         time_str = row[1]  # "DD.MM HH:MM"
         is_booked = row[2]
-        
-        if is_slot_in_past(time_str):
-            continue
-        
-        try:
-            date_part = time_str.split()[0]  # "DD.MM"
-            day, mon = map(int, date_part.split('.'))
-            if mon == month:
-                if is_booked == 1:
-                    days_with_booked.add(day)
-                else:
-                    days_with_free.add(day)
-        except:
-            continue
+        day = int(time_str.split()[0].split('.')[0])
+        if is_booked == 1:
+            days_with_booked.add(day)
+        else:
+            days_with_free.add(day)
     
     return days_with_free, days_with_booked
 
@@ -355,22 +346,17 @@ async def calendar_next_month(callback: types.CallbackQuery):
 @router.callback_query(F.data.startswith("cal_day_"))
 async def calendar_day_click(callback: types.CallbackQuery, state: FSMContext):
     """Calendar day clicked - show day schedule"""
-    parts = callback.data.split("_")
-    date_str = parts[2]  # "DD.MM"
-    year_month = parts[3] if len(parts) > 3 else f"{datetime.now().year}-{datetime.now().month:02d}"
-    
-    slots = await get_master_slots_with_ids(callback.from_user.id)
-    
-    slots_for_day = []
-    for row in slots:
-        time_str = row[1]
-        if not is_slot_in_past(time_str):
-            if time_str.split()[0] == date_str:
-                slots_for_day.append(row)
+    date_str, year_month = parse_day_callback(callback.data, "cal_day_")
+    await show_master_day(callback, state, date_str, year_month)
+
+async def show_master_day(callback: types.CallbackQuery, state: Optional[FSMContext], date_str: str,
+                          year_month: Optional[str] = None):
+    """Day schedule of the master ("DD.MM"; year_month - calendar page, also gives the year)"""
+    day = resolve_day(date_str, year_month)
+    year_month = year_month or f"{day.year}-{day.month:02d}"
+    full_date_str = day.strftime("%Y-%m-%d")
     
-    day, current_month = date_str.split(".")
-    year = year_month.split("-")[0]
-    full_date_str = f"{year}-{current_month}-{day}"
+    slots_for_day = await get_master_slots_for_day(callback.from_user.id, day, upcoming_only=True)
     
     if not slots_for_day:
         kb = InlineKeyboardBuilder()
@@ -378,15 +364,14 @@ async def calendar_day_click(callback: types.CallbackQuery, state: FSMContext):
         kb.button(text="⬅️ К календарю", callback_data=f"back_to_calendar_{year_month}")
         kb.adjust(1)
         
-        text = f"📅 *{get_weekday_for_date(date_str)} {date_str}*\n\nНа этот день нет окошек. Хотите добавить?"
+        text = f"📅 *{WEEKDAYS_SHORT[day.weekday()]} {date_str}*\n\nНа этот день нет окошек. Хотите добавить?"
         await callback.message.edit_text(text, reply_markup=kb.as_markup())
         await callback.answer()
         return
     
     kb = InlineKeyboardBuilder()
-    slots_for_day.sort(key=lambda x: datetime.strptime(x[1], "%d.%m %H:%M"))
     
-    text = f"📅 *{get_weekday_for_date(date_str)} {date_str}*\n_(Нажмите на слот для деталей)_\n\n"
+    text = f"📅 *{WEEKDAYS_SHORT[day.weekday()]} {date_str}*\n_(Нажмите на слот для деталей)_\n\n"
     
     for row in slots_for_day:
         slot_id, time_str, is_booked = row[0], row[1], row[2]
@@ -396,7 +381,7 @@ async def calendar_day_click(callback: types.CallbackQuery, state: FSMContext):
         kb.button(text=f"{emoji} {time_only} — {status_text}", callback_data=f"view_slot_{slot_id}")
     
     kb.button(text="🕒 Добавить время", callback_data=f"addslot_{full_date_str}_{year_month}")
-    kb.button(text=f"🗑 Удалить день ({pluralize_slots(len(slots_for_day))})", callback_data=f"clear_day_{date_str}")
+    kb.button(text=f"🗑 Удалить день ({pluralize_slots(len(slots_for_day))})", callback_data=f"clear_day_{date_str}_{year_month}")
     kb.button(text="⬅️ К календарю", callback_data=f"back_to_calendar_{year_month}")
     kb.adjust(1)
     
@@ -405,10 +390,9 @@ async def calendar_day_click(callback: types.CallbackQuery, state: FSMContext):
 
 @router.callback_query(F.data.startswith("schedule_day_"))
 async def view_day_schedule(callback: types.CallbackQuery, state: FSMContext):
-    """Legacy: redirect to calendar day view"""
-    date_str = callback.data.split("_")[2]
-    callback.data = f"cal_day_{date_str}"
-    await calendar_day_click(callback, state)
+    """Day from the schedule list - same view as a calendar day"""
+    date_str, year_month = parse_day_callback(callback.data, "schedule_day_")
+    await show_master_day(callback, state, date_str, year_month)
 
 @router.callback_query(F.data == "schedule_list_view")
 async def schedule_list_view(callback: types.CallbackQuery):
@@ -444,18 +428,12 @@ async def back_to_schedule_overview(callback: types.CallbackQuery):
 @router.callback_query(F.data.startswith("clear_day_"))
 async def clear_day_confirm(callback: types.CallbackQuery):
     """Handle clear day request - ask for confirmation if has booked slots"""
-    from datetime import datetime
-    
-    date_str = callback.data.split("_")[2]  # "DD.MM"
+    date_str, year_month = parse_day_callback(callback.data, "clear_day_")
+    day = resolve_day(date_str, year_month)
+    year_month = year_month or f"{day.year}-{day.month:02d}"
     
-    # Get slots for this day
-    slots = await get_master_slots_with_ids(callback.from_user.id)
-    slots_for_day = []
-    for row in slots:
-        time_str = row[1]
-        if not is_slot_in_past(time_str):
-            if time_str.split()[0] == date_str:
-                slots_for_day.append(row)
+    # Get upcoming slots for this day
+    slots_for_day = await get_master_slots_for_day(callback.from_user.id, day, upcoming_only=True)
     
     if not slots_for_day:
         await callback.answer("Нет окошек для удаления", show_alert=True)
@@ -467,8 +445,8 @@ async def clear_day_confirm(callback: types.CallbackQuery):
     if booked_slots:
         # Need confirmation
         kb = InlineKeyboardBuilder()
-        kb.button(text="✅ Да, очистить", callback_data=f"confirm_clear_day_{date_str}")
-        kb.button(text="❌ Отмена", callback_data=f"schedule_day_{date_str}")
+        kb.button(text="✅ Да, очистить", callback_data=f"confirm_clear_day_{date_str}_{year_month}")
+        kb.button(text="❌ Отмена", callback_data=f"cal_day_{date_str}_{year_month}")
         kb.adjust(1)
         
         text = f"⚠️ *Подтверждение*\n\n"
@@ -481,82 +459,56 @@ async def clear_day_confirm(callback: types.CallbackQuery):
         await callback.answer()
     else:
         # No booked slots - delete immediately without confirmation
-        await confirm_clear_day(callback, bot=callback.bot)
+        await clear_day(callback, day)
 
 @router.callback_query(F.data.startswith("confirm_clear_day_"))
 async def confirm_clear_day(callback: types.CallbackQuery, bot: Bot = None):
+    """Confirmed: clear all slots for the day"""
+    date_str, year_month = parse_day_callback(callback.data, "confirm_clear_day_")
+    await clear_day(callback, resolve_day(date_str, year_month))
+
+async def clear_day(callback: types.CallbackQuery, day: datetime):
     """Actually clear all slots for the day"""
-    from database.db_cmds import delete_slot_db, get_slot_info
+    from database.db_cmds import clear_master_day
     
-    # Handle both "clear_day_DD.MM" (direct call) and "confirm_clear_day_DD.MM" (button click)
-    parts = callback.data.split("_")
-    date_str = parts[3] if parts[0] == "confirm" else parts[2]
+    master_id = await get_master_id_by_tg_id(callback.from_user.id)
+    deleted_count, bookings = await clear_master_day(master_id, day) if master_id else (0, [])
     
-    # Get slots for this day
-    slots = await get_master_slots_with_ids(callback.from_user.id)
-    slots_for_day = []
-    for row in slots:
-        time_str = row[1]
-        if not is_slot_in_past(time_str):
-            if time_str.split()[0] == date_str:
-                slots_for_day.append(row)
-    
-    deleted_count = 0
-    notified_clients = []
-    
-    for row in slots_for_day:
-        slot_id, time_str, is_booked, client_id = row[0], row[1], row[2], row[3]
-        
-        # Delete slot
-        await delete_slot_db(slot_id)
-        deleted_count += 1
-        
-        # Notify client if booked
-        if is_booked and client_id and bot:
-            try:
-                await bot.send_message(
-                    client_id,
-                    f"⚠️ Ваша запись отменена мастером\n\n"
-                    f"📅 {format_slot_with_weekday(time_str)}\n\n"
-                    f"Приносим извинения за неудобства."
-                )
-                notified_clients.append(client_id)
-            except:
-                pass
+    # Notices are queued, so the master gets the answer right away
+    for slot_id, time_str, client_id in bookings:
+        unschedule_booking_reminders(slot_id)
+        notify_booking_cancelled(client_id, time_str)
     
     # Return to calendar view
     from keyboards.calendar import build_month_calendar
-    now = datetime.now()
-    year, month = now.year, now.month
-    
-    parts = date_str.split(".")
-    if len(parts) == 2:
-        month = int(parts[1])
+    year, month = day.year, day.month
     
     days_free, days_booked = await build_calendar_data(callback.from_user.id, year, month)
     markup = build_month_calendar(year, month, days_free, days_booked)
     
     await callback.message.edit_text(
         f"✅ День очищен! Удалено: {pluralize_slots(deleted_count)}\n"
-        f"📩 Уведомлено клиентов: {len(set(notified_clients))}\n\n"
+        f"📩 Уведомляем клиентов: {len({client_id for _, _, client_id in bookings})}\n\n"
         "📅 *Ваше расписание*\n🟢 свободные  🔴 все заняты  📍 сегодня",
         reply_markup=markup
     )
     
     await callback.answer("День очищен!")
 
+def notify_booking_cancelled(client_id: int, slot_str: str):
+    """Queue the 'cancelled by master' notice for a client"""
+    messenger.send(
+        client_id,
+        f"⚠️ *Ваша запись отменена мастером*\n\n📅 {format_slot_with_weekday(slot_str)}\n\nПриносим извинения за неудобства.",
+        priority=Priority.HIGH
+    )
+
 @router.callback_query(F.data.startswith("view_slot_"))
 async def view_slot_details(callback: types.CallbackQuery, bot: Bot):
     """Show slot details with action buttons"""
     slot_id = int(callback.data.split("_")[-1])
     
-    # Get all slots to find this one
-    slots = await get_master_slots_with_ids(callback.from_user.id)
-    slot_data = None
-    for row in slots:
-        if row[0] == slot_id:
-            slot_data = row
-            break
+    slot_data = await get_master_slot(callback.from_user.id, slot_id)
     
     if not slot_data:
         await callback.answer("Слот не найден.")
@@ -616,12 +568,7 @@ async def cancel_client_booking(callback: types.CallbackQuery, bot: Bot):
     slot_id = int(callback.data.split("_")[-1])
     
     # Get slot info before canceling
-    slots = await get_master_slots_with_ids(callback.from_user.id)
-    slot_data = None
-    for row in slots:
-        if row[0] == slot_id:
-            slot_data = row
-            break
+    slot_data = await get_master_slot(callback.from_user.id, slot_id)
     
     if not slot_data:
         await callback.answer("Ошибка: слот не найден.")
@@ -634,61 +581,37 @@ async def cancel_client_booking(callback: types.CallbackQuery, bot: Bot):
     success = await cancel_booking_db(slot_id, client_id)
     
     if success:
-        # Notify client
-        formatted_time = format_slot_with_weekday(datetime_str)
-        try:
-            await bot.send_message(
-                chat_id=client_id,
-                text=f"⚠️ *Ваша запись отменена мастером*\n\n📅 {formatted_time}\n\nПриносим извинения за неудобства."
-            )
-        except: pass
+        unschedule_booking_reminders(slot_id)
+        notify_booking_cancelled(client_id, datetime_str)
         
         # Return to schedule
-        date_str_short = datetime_str.split()[0]
-        year_month = f"{datetime.now().year}-{datetime.now().month:02d}"
-        callback.data = f"cal_day_{date_str_short}_{year_month}"
-        await calendar_day_click(callback, state)
+        await show_master_day(callback, None, datetime_str.split()[0])
     else:
         await callback.answer("Ошибка отмены.")
-    
-    await callback.answer()
 
 @router.callback_query(F.data.startswith("force_delete_slot_"))
 async def force_delete_slot(callback: types.CallbackQuery, bot: Bot):
     """Delete slot entirely (with or without booking)"""
     slot_id = int(callback.data.split("_")[-1])
     
-    # Get slot info to notify client if booked
-    slots = await get_master_slots_with_ids(callback.from_user.id)
-    slot_data = None
-    for row in slots:
-        if row[0] == slot_id:
-            slot_data = row
-            break
+    # Get slot info to notify client if booked (and make sure the slot is this master's)
+    slot_data = await get_master_slot(callback.from_user.id, slot_id)
+    if not slot_data:
+        await callback.answer("Слот не найден.")
+        return
     
-    if slot_data:
-        slot_id, datetime_str, is_booked, client_id, client_name, client_username, svc_name, svc_price, svc_cat, svc_subcat = slot_data
-        
-        # If booked, notify client
-        if is_booked and client_id:
-            formatted_time = format_slot_with_weekday(datetime_str)
-            try:
-                await bot.send_message(
-                    chat_id=client_id,
-                    text=f"⚠️ *Ваша запись отменена мастером*\n\n📅 {formatted_time}\n\nПриносим извинения за неудобства."
-                )
-            except: pass
+    slot_id, datetime_str, is_booked, client_id, client_name, client_username, svc_name, svc_price, svc_cat, svc_subcat = slot_data
+    
+    # If booked, notify client
+    if is_booked and client_id:
+        notify_booking_cancelled(client_id, datetime_str)
     
     success = await delete_slot_db(slot_id)
     if success:
-        date_str_short = datetime_str.split()[0] if slot_data else datetime.now().strftime('%d.%m')
-        year_month = f"{datetime.now().year}-{datetime.now().month:02d}"
-        callback.data = f"cal_day_{date_str_short}_{year_month}"
-        await calendar_day_click(callback, state=None)
+        unschedule_booking_reminders(slot_id)
+        await show_master_day(callback, None, datetime_str.split()[0])
     else:
         await callback.answer("Ошибка удаления.")
-    
-    await callback.answer()
 
 @router.callback_query(F.data == "back_to_schedule")
 async def back_to_schedule(callback: types.CallbackQuery):
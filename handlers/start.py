@@ -1,5 +1,5 @@
 from aiogram import Router, types
-from aiogram.filters import CommandObject, CommandStart
+from aiogram.filters import Command, CommandObject, CommandStart
 from database.db_cmds import add_user, get_master_by_tg_id
 from keyboards.basic import main_menu_kb
 from config import ADMIN_ID
@@ -42,3 +42,44 @@ async def cmd_start(message: types.Message, command: CommandObject):
         msg += "\nВы успешно подключились к мастеру! Нажмите «Записаться»."
     
     await message.answer(msg, reply_markup=main_menu_kb(is_master))
+
+
+def _format_stats(title: str, stats: dict) -> str:
+    return f"{title}\n" + "\n".join(f"  {key}: {value}" for key, value in stats.items())
+
+@router.message(Command("stats"))
+async def cmd_stats(message: types.Message):
+    """Admin only: queues and caches of the running bot"""
+    if str(message.from_user.id) != str(ADMIN_ID):
+        return
+
+    from database.cache import availability_cache
+    from database.catalog import catalog_cache
+    from database.identity import identity_cache
+    from utils.messenger import messenger
+    from utils.calendar_cache import busy_cache
+    from utils.calendar_outbox import outbox
+    from utils.fsm_storage import fsm_storage
+    from utils.google_calendar import calendar_read_stats
+    from utils import webhook
+    from database.versions import shared_versions
+    from utils.leader import leader
+    from config import BOT_WORKERS, WORKER_INDEX
+
+    sections = [
+        _format_stats("👑 Фоновые задачи (lease)", leader.stats()),
+        _format_stats("📨 Очередь сообщений", messenger.stats()),
+        _format_stats("💬 Сессии (FSM)", fsm_storage.stats()),
+        _format_stats("📅 Google Calendar: запись", await outbox.stats()),
+        _format_stats("🗓 Google Calendar: кэш", busy_cache.stats()),
+        _format_stats("🛡 Google Calendar: чтение", calendar_read_stats()),
+        _format_stats("⚡️ Кэш окошек", availability_cache.stats()),
+        _format_stats("📋 Каталог услуг", catalog_cache.stats()),
+        _format_stats("👤 Пользователи и мастера", identity_cache.stats()),
+    ]
+    if webhook.request_handler:
+        sections.insert(0, _format_stats("🌐 Webhook", webhook.request_handler.stats()))
+    if shared_versions.enabled:
+        sections.insert(0, _format_stats(f"🔀 Воркер {WORKER_INDEX} из {BOT_WORKERS}", shared_versions.stats()))
+    # Plain text: the keys contain underscores, which Markdown would eat
+    await message.answer("\n\n".join(sections), parse_mode=None)
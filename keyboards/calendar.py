@@ -157,7 +157,7 @@ def build_client_month_calendar(year: int, month: int, days_with_free: set) -> t
                     kb.button(text=f"{day}", callback_data="cal_ignore")
                 elif has_free:
                     # Has free slots - clickable
-                    kb.button(text=f"🟢 {day}", callback_data=f"day_{date_str}")
+                    kb.button(text=f"🟢 {day}", callback_data=f"day_{date_str}_{year}-{month:02d}")
                 else:
                     # No free slots - unclickable
                     kb.button(text=f"{day}", callback_data="cal_ignore")
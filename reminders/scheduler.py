@@ -1,77 +1,86 @@
 """
 Система напоминаний для BeautyBot
 Отправляет уведомления клиентам за 24 часа и за 3 часа до записи
+
+Напоминания событийные: book_slot сохраняет строки в reminders (sent = 0,
+due_ts = время отправки), а здесь на каждую ставится date-задача APScheduler.
+Таблица reminders — постоянное хранилище задач: при старте
+reconcile_reminders() сверяет её с записями и заново ставит задачи.
+
+Если на одной базе работает несколько процессов (воркеры utils/workers.py,
+второй сервис), планировщик запущен только у держателя lease
+(utils/leader.py), и каждая задача перед запуском проверяет lease. Запись,
+сделанная в другом процессе, публикует ключ "reminders"
+(database/versions.py), и pickup_reminders() ставит задачи на новые строки.
 """
 import asyncio
-from datetime import datetime, timedelta
+import logging
+import time
+from datetime import datetime
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from aiogram import Bot
-import aiosqlite
-from database.setup import DB_NAME
+from database.setup import pool, checkpoint_wal
+from database.versions import shared_versions
+from database.db_cmds import REMINDER_OFFSETS, REMINDER_GRACE
+from config import DB_CHECKPOINT_MINUTES, REMINDER_SWEEP_MINUTES
+from utils.slot_time import to_ts, from_ts
+from utils.messenger import messenger, Priority
+from utils.leader import leader
 
-async def get_upcoming_bookings(hours_ahead: int):
-    """Получить записи на ближайшие N часов"""
-    async with aiosqlite.connect(DB_NAME) as db:
-        query = '''
-            SELECT 
-                slots.id,
-                slots.client_id,
-                slots.datetime,
-                services.name,
-                services.category,
-                services.subcategory
-            FROM slots
-            JOIN services ON slots.service_id = services.id
-            WHERE slots.is_booked = 1
-        '''
-        async with db.execute(query) as cursor:
-            return await cursor.fetchall()
+# Напоминание должно было уйти хотя бы столько назад, прежде чем его подберёт сверка
+# (обычно его уже отправила задача, ставшая в момент записи)
+SWEEP_LAG = 600
+
+def _due_reminders_query(now_ts: int):
+    """Запрос по окну на каждый тип напоминания: только наступившие и ещё не отправленные"""
+    part = '''
+        SELECT 
+            slots.id,
+            slots.client_id,
+            slots.datetime,
+            ? AS reminder_type,
+            services.name,
+            services.category,
+            services.subcategory
+        FROM slots
+        LEFT JOIN reminders ON reminders.slot_id = slots.id AND reminders.reminder_type = ? AND reminders.sent = 1
+        LEFT JOIN services ON slots.service_id = services.id
+        WHERE slots.is_booked = 1 AND slots.start_ts > ? AND slots.start_ts <= ?
+          AND slots.blocked_by IS NULL AND slots.client_id IS NOT NULL
+          AND reminders.id IS NULL
+    '''
+    params = []
+    for reminder_type, offset in REMINDER_OFFSETS.items():
+        # due_ts = start_ts - offset должно попасть в [now - REMINDER_GRACE, now - SWEEP_LAG]
+        params += [reminder_type, reminder_type, now_ts + offset - REMINDER_GRACE, now_ts + offset - SWEEP_LAG]
+    return " UNION ALL ".join([part] * len(REMINDER_OFFSETS)), params
 
-def parse_slot_datetime(datetime_str: str) -> datetime:
+async def get_due_reminders():
     """
-    Парсит строку типа "10.02 14:00" в datetime объект
-    Предполагаем текущий год
+    Наступившие неотправленные напоминания:
+    [(slot_id, client_id, datetime, reminder_type, service_name, category, subcategory), ...]
     """
-    try:
-        day_month, time = datetime_str.split()
-        day, month = map(int, day_month.split('.'))
-        hour, minute = map(int, time.split(':'))
-        
-        # Используем текущий год, но если месяц уже прошел, берем следующий год
-        current_year = datetime.now().year
-        slot_dt = datetime(current_year, month, day, hour, minute)
-        
-        # Если дата в прошлом, предполагаем следующий год
-        if slot_dt < datetime.now():
-            slot_dt = datetime(current_year + 1, month, day, hour, minute)
-        
-        return slot_dt
-    except Exception as e:
-        print(f"Ошибка парсинга даты {datetime_str}: {e}")
-        return None
+    query, params = _due_reminders_query(to_ts(datetime.now()))
+    async with pool.read() as db:
+        async with db.execute(query, params) as cursor:
+            return await cursor.fetchall()
 
-async def check_if_reminder_sent(slot_id: int, reminder_type: str) -> bool:
-    """Проверить, было ли отправлено напоминание"""
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute(
-            "SELECT id FROM reminders WHERE slot_id = ? AND reminder_type = ? AND sent = 1",
-            (slot_id, reminder_type)
-        ) as cursor:
-            result = await cursor.fetchone()
-            return result is not None
-
-async def mark_reminder_sent(slot_id: int, client_id: int, reminder_type: str):
-    """Отметить напоминание как отправленное"""
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute(
-            '''INSERT INTO reminders (slot_id, client_id, reminder_type, sent, sent_at)
-               VALUES (?, ?, ?, 1, ?)''',
-            (slot_id, client_id, reminder_type, datetime.now().isoformat())
-        )
-        await db.commit()
-
-async def send_reminder(bot: Bot, client_id: int, datetime_str: str, full_service: str, reminder_type: str):
-    """Отправить напоминание клиенту"""
+MARK_SENT_SQL = '''
+    INSERT INTO reminders (slot_id, client_id, reminder_type, sent, sent_at)
+    VALUES (?, ?, ?, 1, ?)
+    ON CONFLICT (slot_id, reminder_type) DO UPDATE SET sent = 1, sent_at = excluded.sent_at
+'''
+
+async def mark_reminders_sent(reminders: list):
+    """Отметить пачку напоминаний [(slot_id, client_id, reminder_type), ...] одной транзакцией"""
+    if not reminders:
+        return
+    sent_at = datetime.now().isoformat()
+    async with pool.write() as db:
+        await db.executemany(MARK_SENT_SQL, [(*reminder, sent_at) for reminder in reminders])
+
+async def send_reminder(bot: Bot, client_id: int, datetime_str: str, full_service: str, reminder_type: str) -> bool:
+    """Отправить напоминание клиенту (через очередь messenger). True если доставлено."""
     try:
         if reminder_type == '24h':
             text = (
@@ -88,77 +97,225 @@ async def send_reminder(bot: Bot, client_id: int, datetime_str: str, full_servic
                 f"До встречи! ✨"
             )
         
-        await bot.send_message(client_id, text, parse_mode='HTML')
-        print(f"✅ Напоминание {reminder_type} отправлено клиенту {client_id}")
+        delivered = await messenger.send(client_id, text, priority=Priority.NORMAL, parse_mode='HTML')
+        if delivered:
+            print(f"✅ Напоминание {reminder_type} отправлено клиенту {client_id}")
+        else:
+            print(f"❌ Напоминание {reminder_type} клиенту {client_id} не доставлено")
+        return delivered
     except Exception as e:
         print(f"❌ Ошибка отправки напоминания клиенту {client_id}: {e}")
+        return False
 
 async def check_and_send_reminders(bot: Bot):
     """
-    Основная функция проверки и отправки напоминаний
-    Вызывается периодически (каждые 30 минут)
+    Страховочная сверка: отправить напоминания, которые наступили, но не ушли
+    (задача потерялась, доставка не удалась). Основной путь — задачи на момент отправки.
     """
-    print("🔍 Проверка напоминаний...")
-    now = datetime.now()
+    started = time.perf_counter()
+    due = await get_due_reminders()
+    query_ms = (time.perf_counter() - started) * 1000
     
-    # Получаем все активные записи
-    bookings = await get_upcoming_bookings(48)
+    # Напоминания уходят через очередь параллельно, отмечаем только доставленные
+    results = await asyncio.gather(*(
+        send_reminder(bot, client_id, datetime_str, _full_service_name(service_name, svc_cat, svc_subcat), reminder_type)
+        for slot_id, client_id, datetime_str, reminder_type, service_name, svc_cat, svc_subcat in due
+    ))
+    delivered = [(row[0], row[1], row[3]) for row, ok in zip(due, results) if ok]
+    await mark_reminders_sent(delivered)
     
-    for booking in bookings:
-        slot_id, client_id, datetime_str, service_name, svc_cat, svc_subcat = booking
-        
-        # Собираем полное название услуги
-        cat_clean = svc_cat.split(' ', 1)[1] if svc_cat and ' ' in svc_cat else (svc_cat or "")
-        if svc_subcat:
-            full_service = f"{cat_clean} ({svc_subcat}) • {service_name}"
-        else:
-            full_service = f"{cat_clean} • {service_name}" if cat_clean else service_name
-        
-        # Парсим дату записи
-        slot_dt = parse_slot_datetime(datetime_str)
-        if not slot_dt:
-            continue
-        
-        # Разница во времени
-        time_diff = slot_dt - now
-        
-        # Напоминание за 24 часа (в диапазоне 23-24.5 часов)
-        if timedelta(hours=23) <= time_diff < timedelta(hours=24, minutes=30):
-            if not await check_if_reminder_sent(slot_id, '24h'):
-                await send_reminder(bot, client_id, datetime_str, full_service, '24h')
-                await mark_reminder_sent(slot_id, client_id, '24h')
-        
-        # Напоминание за 3 часа (в диапазоне 2.5-3.5 часов)
-        if timedelta(hours=2, minutes=30) <= time_diff < timedelta(hours=3, minutes=30):
-            if not await check_if_reminder_sent(slot_id, '3h'):
-                await send_reminder(bot, client_id, datetime_str, full_service, '3h')
-                await mark_reminder_sent(slot_id, client_id, '3h')
+    logging.info(
+        f"Reminder sweep: {len(due)} due rows (query {query_ms:.1f} ms), {len(delivered)} sent, "
+        f"total {(time.perf_counter() - started) * 1000:.1f} ms"
+    )
+
+# --- Событийные напоминания ---
+_scheduler: AsyncIOScheduler = None
+_bot: Bot = None
+# Последняя строка reminders, прочитанная reconcile/pickup: строки других процессов идут после неё
+_last_reminder_id = 0
+
+# Ключ общей версии: в другом процессе появились напоминания
+REMINDERS_KEY = "reminders"
+
+def _job_id(slot_id: int, reminder_type: str) -> str:
+    return f"reminder_{slot_id}_{reminder_type}"
+
+def _schedule_job(reminder_id: int, slot_id: int, reminder_type: str, due_ts: int):
+    """Поставить date-задачу на момент due_ts (просроченные — сразу)"""
+    if _scheduler is None:
+        return  # планировщик не запущен (скрипты) — задачу поставит reconcile при старте бота
+    run_date = max(from_ts(due_ts), datetime.now())
+    _scheduler.add_job(
+        leader.guard(deliver_reminder),
+        'date',
+        run_date=run_date,
+        args=[reminder_id],
+        id=_job_id(slot_id, reminder_type),
+        replace_existing=True,
+        misfire_grace_time=REMINDER_GRACE
+    )
+
+async def schedule_booking_reminders(slot_id: int):
+    """Поставить задачи для напоминаний новой записи (строки создал book_slot)"""
+    if _scheduler is None:
+        # Планировщик в другом процессе — он подберёт строки сам
+        shared_versions.publish(REMINDERS_KEY)
+        return
+    async with pool.read() as db:
+        async with db.execute(
+            "SELECT id, reminder_type, due_ts FROM reminders WHERE slot_id = ? AND sent = 0",
+            (slot_id,)
+        ) as cursor:
+            rows = await cursor.fetchall()
+    for reminder_id, reminder_type, due_ts in rows:
+        _schedule_job(reminder_id, slot_id, reminder_type, due_ts)
+
+def unschedule_booking_reminders(slot_id: int):
+    """Снять задачи отменённой записи (строки удаляет cancel_booking_db / delete_slot_db / clear_master_day)"""
+    if _scheduler is None:
+        return
+    for reminder_type in REMINDER_OFFSETS:
+        job = _scheduler.get_job(_job_id(slot_id, reminder_type))
+        if job:
+            job.remove()
+
+async def deliver_reminder(reminder_id: int):
+    """Задача APScheduler: отправить одно напоминание, если запись ещё в силе"""
+    async with pool.read() as db:
+        async with db.execute('''
+            SELECT 
+                reminders.slot_id,
+                reminders.client_id,
+                reminders.reminder_type,
+                slots.datetime,
+                services.name,
+                services.category,
+                services.subcategory
+            FROM reminders
+            JOIN slots ON slots.id = reminders.slot_id AND slots.is_booked = 1 AND slots.client_id = reminders.client_id
+            LEFT JOIN services ON slots.service_id = services.id
+            WHERE reminders.id = ? AND reminders.sent = 0
+        ''', (reminder_id,)) as cursor:
+            row = await cursor.fetchone()
+    if not row:
+        return  # запись отменена или напоминание уже ушло
+    
+    slot_id, client_id, reminder_type, datetime_str, service_name, svc_cat, svc_subcat = row
+    if await send_reminder(_bot, client_id, datetime_str, _full_service_name(service_name, svc_cat, svc_subcat), reminder_type):
+        async with pool.write() as db:
+            await db.execute(
+                "UPDATE reminders SET sent = 1, sent_at = ? WHERE id = ?",
+                (datetime.now().isoformat(), reminder_id)
+            )
+
+async def reconcile_reminders():
+    """
+    Сверка хранилища с записями при старте:
+    удалить напоминания отменённых записей и безнадёжно просроченные,
+    создать недостающие для будущих записей, поставить задачи на все ожидающие.
+    """
+    now_ts = to_ts(datetime.now())
+    async with pool.write() as db:
+        await db.execute('''
+            DELETE FROM reminders WHERE sent = 0 AND (
+                due_ts IS NULL OR due_ts < ? OR NOT EXISTS (
+                    SELECT 1 FROM slots
+                    WHERE slots.id = reminders.slot_id AND slots.is_booked = 1 AND slots.client_id = reminders.client_id
+                )
+            )
+        ''', (now_ts - REMINDER_GRACE,))
+        for reminder_type, offset in REMINDER_OFFSETS.items():
+            await db.execute('''
+                INSERT INTO reminders (slot_id, client_id, reminder_type, sent, due_ts)
+                SELECT slots.id, slots.client_id, ?, 0, slots.start_ts - ?
+                FROM slots
+                WHERE slots.is_booked = 1 AND slots.start_ts >= ?
+                  AND slots.blocked_by IS NULL AND slots.client_id IS NOT NULL
+                  AND NOT EXISTS (
+                      SELECT 1 FROM reminders
+                      WHERE reminders.slot_id = slots.id AND reminders.reminder_type = ?
+                  )
+            ''', (reminder_type, offset, now_ts - REMINDER_GRACE + offset, reminder_type))
+    
+    async with pool.read() as db:
+        async with db.execute(
+            "SELECT id, slot_id, reminder_type, due_ts FROM reminders WHERE sent = 0 AND due_ts >= ?",
+            (now_ts - REMINDER_GRACE,)
+        ) as cursor:
+            pending = await cursor.fetchall()
+    _schedule_rows(pending)
+    print(f"🔔 Напоминаний в очереди: {len(pending)}")
+
+async def pickup_reminders(_key: str = None):
+    """Поставить задачи на напоминания, созданные другими процессами после последней поставленной"""
+    if _scheduler is None:
+        return  # планировщик у другого процесса
+    async with pool.read() as db:
+        async with db.execute(
+            "SELECT id, slot_id, reminder_type, due_ts FROM reminders WHERE id > ? AND sent = 0 AND due_ts >= ?",
+            (_last_reminder_id, to_ts(datetime.now()) - REMINDER_GRACE)
+        ) as cursor:
+            rows = await cursor.fetchall()
+    _schedule_rows(rows)
+
+def _schedule_rows(rows):
+    """Задачи на строки (id, slot_id, reminder_type, due_ts); id растут в порядке коммитов"""
+    global _last_reminder_id
+    for reminder_id, slot_id, reminder_type, due_ts in rows:
+        _schedule_job(reminder_id, slot_id, reminder_type, due_ts)
+        _last_reminder_id = max(_last_reminder_id, reminder_id)
+
+def _full_service_name(service_name, svc_cat, svc_subcat) -> str:
+    cat_clean = svc_cat.split(' ', 1)[1] if svc_cat and ' ' in svc_cat else (svc_cat or "")
+    if svc_subcat:
+        return f"{cat_clean} ({svc_subcat}) • {service_name}"
+    return f"{cat_clean} • {service_name}" if cat_clean else (service_name or "")
 
 def start_reminder_scheduler(bot: Bot):
     """
     Запустить планировщик напоминаний
-    Проверка каждые 30 минут
+    Задачи ставятся при записи; при старте — сверка с базой
     """
-    scheduler = AsyncIOScheduler()
+    global _scheduler, _bot
+    _bot = bot
+    scheduler = _scheduler = AsyncIOScheduler()
+    
+    # Сверка хранилища напоминаний с записями сразу после старта
+    scheduler.add_job(
+        leader.guard(reconcile_reminders),
+        'date',
+        run_date=datetime.now(),
+        id='reminder_reconcile'
+    )
     
-    # Добавляем задачу проверки напоминаний каждые 30 минут
+    # Страховочная проверка пропущенных напоминаний (первый запуск — через интервал)
     scheduler.add_job(
-        check_and_send_reminders,
+        leader.guard(check_and_send_reminders),
         'interval',
-        minutes=30,
+        minutes=REMINDER_SWEEP_MINUTES,
         args=[bot],
         id='reminder_check',
         replace_existing=True
     )
     
-    # Также делаем первую проверку сразу при запуске (через 1 минуту)
+    # Периодический checkpoint WAL-журнала SQLite
     scheduler.add_job(
-        check_and_send_reminders,
-        'date',
-        run_date=datetime.now() + timedelta(minutes=1),
-        args=[bot],
-        id='initial_reminder_check'
+        leader.guard(checkpoint_wal),
+        'interval',
+        minutes=DB_CHECKPOINT_MINUTES,
+        id='wal_checkpoint',
+        replace_existing=True
     )
     
     scheduler.start()
-    print("✅ Планировщик напоминаний запущен (проверка каждые 30 минут)")
+    print("✅ Планировщик напоминаний запущен")
+
+def stop_reminder_scheduler():
+    """Остановить планировщик (lease ушёл другому процессу или бот завершается); задачи поставит reconcile нового лидера"""
+    global _scheduler
+    if _scheduler is None:
+        return
+    _scheduler.shutdown(wait=False)
+    _scheduler = None
+    print("⏹ Планировщик напоминаний остановлен")
@@ -0,0 +1,112 @@
+"""
+Benchmark: get_available_slots for a master with 5,000 slots and 1,000 bookings.
+
+Prints the end-to-end time of get_available_slots without the availability
+cache (query + sweep-line, the cache is invalidated before every call), the
+time of a cache hit, and, for reference, the old O(free x booked) overlap
+filter against the sweep-line pass on the same data.
+
+Usage: python scripts/bench_availability.py [repeats]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database.setup import pool, init_db, close_db
+from database.cache import availability_cache
+from database.db_cmds import get_available_slots
+from utils.availability import merge_intervals, fits_between
+from utils.slot_time import format_slot, to_ts
+
+SLOTS = 5000
+BOOKINGS = 1000
+DURATIONS = [30, 60, 90, 120]
+
+
+async def _seed():
+    random.seed(42)
+    async with pool.write() as db:
+        await db.execute("INSERT INTO masters (id, telegram_id, name) VALUES (1, 1000, 'Bench')")
+        await db.executemany(
+            "INSERT INTO services (id, master_id, category, name, price, duration) VALUES (?, 1, 'Bench', ?, 1000, ?)",
+            [(i + 1, f"Service {i}", d) for i, d in enumerate(DURATIONS)]
+        )
+        start = datetime.now().replace(hour=9, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        rows = []
+        day = 0
+        while len(rows) < SLOTS:
+            for k in range(24):  # 09:00–20:30
+                slot = start + timedelta(days=day, minutes=30 * k)
+                rows.append((format_slot(slot), to_ts(slot), to_ts(slot + timedelta(minutes=30))))
+            day += 1
+        await db.executemany(
+            "INSERT INTO slots (master_id, datetime, is_booked, start_ts, end_ts) VALUES (1, ?, 0, ?, ?)",
+            rows[:SLOTS]
+        )
+        for slot_id in random.sample(range(1, SLOTS + 1), BOOKINGS):
+            service_id = random.randint(1, len(DURATIONS))
+            await db.execute(
+                "UPDATE slots SET is_booked = 1, client_id = 5, service_id = ?, end_ts = start_ts + ? WHERE id = ?",
+                (service_id, DURATIONS[service_id - 1] * 60, slot_id)
+            )
+
+
+def _legacy_filter(free, booked, duration_sec):
+    """The previous implementation: every free slot against every booking"""
+    result = []
+    for slot in free:
+        start, end = slot[2], slot[2] + duration_sec
+        if not any(start < b_end and end > b_start for b_start, b_end in booked):
+            result.append(slot)
+    return result
+
+
+async def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    pool.path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    await init_db()
+    await _seed()
+
+    async with pool.read() as db:
+        async with db.execute("SELECT id, datetime, start_ts FROM slots WHERE is_booked = 0 ORDER BY start_ts") as cursor:
+            free = await cursor.fetchall()
+        async with db.execute("SELECT start_ts, end_ts FROM slots WHERE is_booked = 1") as cursor:
+            booked = await cursor.fetchall()
+
+    t0 = time.perf_counter()
+    legacy = _legacy_filter(free, booked, 90 * 60)
+    legacy_ms = (time.perf_counter() - t0) * 1000
+
+    t0 = time.perf_counter()
+    sweep = fits_between(free, merge_intervals(booked), 90 * 60)
+    sweep_ms = (time.perf_counter() - t0) * 1000
+    assert sweep == legacy, "sweep-line result differs from the reference filter"
+
+    await get_available_slots(1, 90)  # warm up connections and the catalog
+    uncached = 0.0
+    for _ in range(repeats):
+        availability_cache.invalidate(1)
+        t0 = time.perf_counter()
+        slots = await get_available_slots(1, 90)
+        uncached += time.perf_counter() - t0
+    uncached_ms = uncached * 1000 / repeats
+
+    t0 = time.perf_counter()
+    for _ in range(repeats):
+        cached = await get_available_slots(1, 90)
+    cached_ms = (time.perf_counter() - t0) * 1000 / repeats
+    assert cached == slots, "cached result differs from the uncached one"
+
+    print(f"{SLOTS} slots, {BOOKINGS} bookings, 90-minute service -> {len(slots)} available")
+    print(f"overlap filter: legacy {legacy_ms:8.1f} ms   sweep-line {sweep_ms:6.1f} ms")
+    print(f"get_available_slots end-to-end, uncached: {uncached_ms:.1f} ms   cache hit: {cached_ms:.3f} ms (avg of {repeats})")
+    await close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,193 @@
+"""
+Benchmark and check: slot browsing for a master with a linked Google Calendar.
+
+Uses the in-process fake Calendar service (scripts/fake_calendar.py) with a
+simulated network round trip. Compares one events.list per request (what
+every calendar/day view used to cost) with get_available_slots served from
+the synced busy-time cache, then checks that the cache follows the calendar:
+incremental sync picks up new and deleted events, an expired sync token
+falls back to a full resync, and a restarted cache loads its state from
+SQLite. Finally a second, free/busy-only salon calendar is linked: it is
+answered through one freeBusy request and merged with the personal one.
+
+Usage: python scripts/bench_calendar_cache.py [requests] [latency_ms]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Same local time as the bot (bot.py): slot times are Moscow wall-clock time
+os.environ['TZ'] = 'Europe/Moscow'
+if hasattr(time, 'tzset'):
+    time.tzset()
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database.setup import pool, init_db, close_db
+from database.cache import availability_cache
+from database.identity import identity_cache
+from database.db_cmds import get_available_slots
+from utils import google_calendar
+from utils.calendar_cache import CalendarBusyCache, busy_cache
+from utils.slot_time import format_slot, to_ts
+from scripts.fake_calendar import FakeCalendarService
+
+CALENDAR_ID = "master@example.com"
+SALON_ID = "salon@example.com"
+DAYS = 30
+
+
+async def _seed(service: FakeCalendarService):
+    start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    rows = []
+    for day in range(DAYS):
+        for k in range(18):  # 10:00 – 18:30
+            slot = start + timedelta(days=day, hours=10, minutes=30 * k)
+            rows.append((format_slot(slot), to_ts(slot), to_ts(slot + timedelta(minutes=30))))
+        # A couple of personal events a day, plus the odd all-day one
+        service.add(CALENDAR_ID, start + timedelta(days=day, hours=12), 60)
+        service.add(CALENDAR_ID, start + timedelta(days=day, hours=16, minutes=30), 30)
+        if day % 7 == 0:
+            service.add(CALENDAR_ID, start + timedelta(days=day), 0, all_day=True)
+    async with pool.write() as db:
+        await db.execute(
+            "INSERT INTO masters (id, telegram_id, name, google_calendar_id) VALUES (1, 1000, 'Bench', ?)", (CALENDAR_ID,)
+        )
+        await db.executemany(
+            "INSERT INTO slots (master_id, datetime, is_booked, start_ts, end_ts) VALUES (1, ?, 0, ?, ?)", rows
+        )
+    return start
+
+
+async def _slots(day: datetime):
+    """Free 60-minute slots of one day, bypassing the availability cache"""
+    availability_cache.bump(1)
+    return await get_available_slots(1, 60, date_from=day, date_to=day + timedelta(days=1))
+
+
+async def _settle(cache):
+    """Wait for background refreshes to finish"""
+    while cache.stats()["refreshing"]:
+        await asyncio.sleep(0.01)
+
+
+def _starts(slots):
+    return {datetime.fromtimestamp(s[2]).strftime("%H:%M") for s in slots}
+
+
+async def main() -> int:
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    latency = (int(sys.argv[2]) if len(sys.argv) > 2 else 150) / 1000
+
+    pool.path = os.path.join(tempfile.mkdtemp(), "calendar.db")
+    await init_db()
+    service = FakeCalendarService(latency=latency)
+    first_day = await _seed(service)
+
+    async def get_service():
+        return service
+
+    google_calendar._service_cache = service
+    busy_cache.refresh_seconds = 3600
+    errors = []
+
+    # --- Latency: one events.list per request vs the cache ---
+    time_min = first_day.strftime("%Y-%m-%dT00:00:00+03:00")
+    time_max = (first_day + timedelta(days=DAYS)).strftime("%Y-%m-%dT00:00:00+03:00")
+    t0 = time.perf_counter()
+    for _ in range(requests):
+        await asyncio.to_thread(
+            service.events().list(calendarId=CALENDAR_ID, timeMin=time_min, timeMax=time_max, singleEvents=True).execute
+        )
+    direct = (time.perf_counter() - t0) / requests
+
+    t0 = time.perf_counter()
+    await _slots(first_day)
+    cold = time.perf_counter() - t0
+    while not busy_cache.is_warm(CALENDAR_ID):
+        await asyncio.sleep(0.01)
+
+    calls_before = service.calls
+    t0 = time.perf_counter()
+    for i in range(requests):
+        await _slots(first_day + timedelta(days=i % DAYS))
+    warm = (time.perf_counter() - t0) / requests
+    if service.calls != calls_before:
+        errors.append(f"warm requests made {service.calls - calls_before} API calls")
+
+    print(f"events.list per request: {direct * 1000:.1f} ms")
+    print(f"first request (freeBusy, cache syncs in the background): {cold * 1000:.1f} ms")
+    print(f"cache, warm get_available_slots for one day: {warm * 1000:.2f} ms ({direct / warm:.0f}x faster)")
+
+    # --- Correctness ---
+    day = first_day + timedelta(days=3)
+    if not {"12:00", "11:30", "16:30", "16:00"}.isdisjoint(_starts(await _slots(day))):
+        errors.append("slots overlapping calendar events were offered")
+    if "10:00" not in _starts(await _slots(day)):
+        errors.append("a free slot is missing")
+
+    event_id = service.add(CALENDAR_ID, day + timedelta(hours=10), 60)
+    await busy_cache.refresh(CALENDAR_ID)
+    if "10:00" in _starts(await _slots(day)):
+        errors.append("incremental sync missed a new event")
+    service.remove(event_id)
+    await busy_cache.refresh(CALENDAR_ID)
+    if "10:00" not in _starts(await _slots(day)):
+        errors.append("incremental sync missed a deleted event")
+
+    service.expire_tokens()
+    service.add(CALENDAR_ID, day + timedelta(hours=14), 30)
+    await busy_cache.refresh(CALENDAR_ID)
+    if "14:00" in _starts(await _slots(day)):
+        errors.append("full resync after 410 missed an event")
+
+    stats = busy_cache.stats()
+    print(f"stats: {stats}")
+    if stats["full_syncs"] != 2 or stats["incremental_syncs"] != 2:
+        errors.append("expected 2 full and 2 incremental syncs")
+
+    # Restart: state comes from SQLite, the next refresh is incremental
+    expected = await busy_cache.get_busy(CALENDAR_ID, to_ts(day), to_ts(day + timedelta(days=1)))
+    restarted = CalendarBusyCache(refresh_seconds=3600, get_service=get_service)
+    calls_before = service.calls
+    if await restarted.get_busy(CALENDAR_ID, to_ts(day), to_ts(day + timedelta(days=1))) != expected:
+        errors.append("restarted cache returned different busy intervals")
+    await _settle(restarted)
+    if restarted.full_syncs or service.calls - calls_before != 1:
+        errors.append("restarted cache didn't resume with the stored sync token")
+
+    async def broken_service():
+        raise ConnectionError("calendar unreachable")
+
+    offline = CalendarBusyCache(refresh_seconds=0, get_service=broken_service)
+    if await offline.get_busy(CALENDAR_ID, to_ts(day), to_ts(day + timedelta(days=1))) != expected:
+        errors.append("cache without API access didn't serve the stored intervals")
+    await _settle(offline)
+
+    # Personal + salon calendar; the salon one only shares free/busy
+    service.freebusy_only.add(SALON_ID)
+    salon_day = first_day + timedelta(days=5)
+    service.add(SALON_ID, salon_day + timedelta(hours=10), 60)
+    async with pool.write() as db:
+        await db.execute("UPDATE masters SET google_calendar_id = ? WHERE id = 1", (f"{CALENDAR_ID}, {SALON_ID}",))
+    identity_cache.invalidate_masters()  # a hand edit is otherwise picked up after IDENTITY_REFRESH_SECONDS
+    freebusy_before = service.freebusy_calls
+    starts = _starts(await _slots(salon_day))
+    if "10:00" in starts or "12:00" in starts:
+        errors.append(f"busy time of both calendars not merged: {sorted(starts)}")
+    if service.freebusy_calls - freebusy_before != 1:
+        errors.append("the cold salon calendar wasn't answered with one freeBusy request")
+    await _settle(busy_cache)  # background events.list of the salon calendar -> 403
+
+    await close_db()
+    for error in errors:
+        print(f"❌ {error}")
+    if not errors:
+        print("✅ Cache follows the calendar")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
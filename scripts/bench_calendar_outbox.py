@@ -0,0 +1,161 @@
+"""
+Benchmark and check: Google Calendar writes through the outbox.
+
+Uses the in-process fake Calendar service (scripts/fake_calendar.py) with a
+simulated network round trip. Compares what confirm_booking used to wait
+for (one events.insert) with queueing the job, then checks that the job
+is committed together with the booking (book_slot) and the worker:
+  * every booking gets its event and the event ID lands on the slot,
+  * jobs go out in batches (one round trip per CALENDAR_OUTBOX_BATCH jobs),
+  * cancelling a booking removes its event; cancelling before the event
+    was written never creates it,
+  * server errors are retried with backoff, a calendar that doesn't exist
+    is parked after the last attempt.
+
+Usage: python scripts/bench_calendar_outbox.py [bookings] [latency_ms]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+os.environ['TZ'] = 'Europe/Moscow'
+if hasattr(time, 'tzset'):
+    time.tzset()
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database.setup import pool, init_db, close_db
+from database.db_cmds import book_slot, cancel_booking_db
+from utils import google_calendar
+from utils.calendar_outbox import CalendarOutbox
+from utils import calendar_outbox
+from utils.slot_time import format_slot, to_ts
+from scripts.fake_calendar import FakeCalendarService
+
+CALENDAR_ID = "master@example.com"
+
+
+async def _seed(count: int):
+    start = datetime.now().replace(hour=10, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    rows = []
+    for k in range(count):
+        slot = start + timedelta(days=k // 16, minutes=30 * (k % 16))
+        rows.append((format_slot(slot), to_ts(slot), to_ts(slot + timedelta(minutes=30))))
+    async with pool.write() as db:
+        await db.executemany(
+            "INSERT INTO masters (id, telegram_id, name, google_calendar_id) VALUES (?, ?, ?, ?)",
+            [(1, 1000, "Bench", CALENDAR_ID), (2, 1001, "Gone", "gone@example.com")]
+        )
+        await db.executemany(
+            "INSERT INTO slots (master_id, datetime, is_booked, start_ts, end_ts) VALUES (1, ?, 0, ?, ?)", rows
+        )
+
+
+async def _book(slot_id: int):
+    await book_slot(slot_id, 5000 + slot_id, client_name=f"Client {slot_id}", service_name="Маникюр")
+
+
+async def _event_ids(slot_ids) -> dict:
+    async with pool.read() as db:
+        async with db.execute(
+            f"SELECT id, gcal_event_id FROM slots WHERE id IN ({','.join('?' * len(slot_ids))})", list(slot_ids)
+        ) as cursor:
+            return dict(await cursor.fetchall())
+
+
+async def _drain(worker: CalendarOutbox, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if not (await worker.stats())["pending"]:
+            return True
+        await asyncio.sleep(0.05)
+    return False
+
+
+async def main() -> int:
+    bookings = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    latency = (int(sys.argv[2]) if len(sys.argv) > 2 else 200) / 1000
+
+    pool.path = os.path.join(tempfile.mkdtemp(), "outbox.db")
+    await init_db()
+    await _seed(bookings + 10)
+    service = FakeCalendarService(latency=latency)
+    google_calendar._service_cache = service
+    errors = []
+
+    # --- What the client waits for ---
+    t0 = time.perf_counter()
+    await google_calendar.create_calendar_event(CALENDAR_ID, datetime.now() + timedelta(days=30), 30, "Probe", "Probe")
+    inline = time.perf_counter() - t0
+    service.events_by_id.clear()
+
+    worker = CalendarOutbox(batch_size=20, poll_seconds=0.2, retry_seconds=1, max_attempts=3)
+    calendar_outbox.outbox = worker  # book_slot wakes this worker
+    t0 = time.perf_counter()
+    await asyncio.gather(*(_book(slot_id) for slot_id in range(1, bookings + 1)))
+    queued = (time.perf_counter() - t0) / bookings
+    print(f"confirm_booking waited for events.insert: {inline * 1000:.1f} ms; booking with the job: {queued * 1000:.2f} ms")
+    if (await worker.stats())["pending"] != bookings:
+        errors.append("bookings committed without their calendar job")
+
+    # --- Worker: batches, event IDs on slots ---
+    worker.start()
+    t0 = time.perf_counter()
+    if not await _drain(worker):
+        errors.append("outbox didn't drain")
+    drained = time.perf_counter() - t0
+    ids = await _event_ids(range(1, bookings + 1))
+    if len(service.live_events(CALENDAR_ID)) != bookings or not all(ids.values()):
+        errors.append(f"{sum(1 for v in ids.values() if not v)} bookings without an event")
+    expected_batches = -(-bookings // worker.batch_size)
+    print(f"{bookings} events written in {drained:.2f}s with {service.batches} batch requests "
+          f"(expected {expected_batches})")
+    if service.batches != expected_batches:
+        errors.append("jobs weren't batched")
+
+    # --- Cancel: event removed; cancel before the write: never created ---
+    await asyncio.gather(*(cancel_booking_db(slot_id, 5000 + slot_id) for slot_id in range(1, bookings // 2 + 1)))
+    await worker.stop()
+    early = bookings + 1
+    await _book(early)
+    await cancel_booking_db(early, 5000 + early)
+    worker.start()
+    await _drain(worker)
+    if len(service.live_events(CALENDAR_ID)) != bookings - bookings // 2:
+        errors.append(f"{len(service.live_events(CALENDAR_ID))} events left after cancelling half")
+    if any((await _event_ids(range(1, bookings // 2 + 1))).values()):
+        errors.append("cancelled slots still point to events")
+
+    # --- Retries and parking ---
+    service.fail_next = 2
+    await _book(bookings + 2)
+    service.missing.add("gone@example.com")
+    async with pool.write() as db:
+        await db.execute("UPDATE slots SET master_id = 2 WHERE id = ?", (bookings + 3,))
+    await _book(bookings + 3)
+    t0 = time.perf_counter()
+    while (await worker.stats())["parked"] == 0 and time.perf_counter() - t0 < 30:
+        await asyncio.sleep(0.1)
+    await _drain(worker)
+    if not (await _event_ids([bookings + 2]))[bookings + 2]:
+        errors.append("event not written after transient errors")
+    stats = await worker.stats()
+    print(f"stats: {stats}")
+    if stats["parked"] != 1 or stats["failed"] != 1:
+        errors.append("job for a missing calendar wasn't parked")
+    if stats["retried"] < 2:
+        errors.append("transient errors weren't retried")
+
+    await worker.stop()
+    await close_db()
+    for error in errors:
+        print(f"❌ {error}")
+    if not errors:
+        print("✅ Outbox keeps the calendar in step with bookings")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,169 @@
+"""
+Check: client-facing latency stays bounded while Google Calendar is slow or down.
+
+Uses the in-process fake Calendar service (scripts/fake_calendar.py). With a
+short read deadline and a small breaker threshold it checks that
+  * a warm calendar keeps answering from memory while Google hangs, with a
+    single background refresh in flight,
+  * a cold calendar waits no longer than the read deadline,
+  * repeated timeouts open the circuit breaker, after which reads don't
+    touch Google at all, and one trial call closes it again once Google
+    is back,
+  * errors about the request itself (403 on a free/busy-only calendar)
+    don't open the breaker,
+  * a first sync slower than the read deadline still completes (its own
+    per-page deadline), and a sync that times out doesn't count toward
+    the breaker.
+
+Usage: python scripts/bench_calendar_resilience.py [concurrent_requests]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+os.environ['TZ'] = 'Europe/Moscow'
+if hasattr(time, 'tzset'):
+    time.tzset()
+# Short deadline / breaker settings for the run (read by config.py on import)
+os.environ.setdefault("CALENDAR_READ_TIMEOUT", "0.3")
+os.environ.setdefault("CALENDAR_BREAKER_FAILURES", "3")
+os.environ.setdefault("CALENDAR_BREAKER_RESET_SECONDS", "1")
+os.environ.setdefault("CALENDAR_SYNC_TIMEOUT", "1")
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database.setup import pool, init_db, close_db
+from database.cache import availability_cache
+from database.db_cmds import get_available_slots
+from utils import google_calendar
+from utils.calendar_cache import busy_cache
+from utils.slot_time import format_slot, to_ts
+from scripts.fake_calendar import FakeCalendarService
+
+SLOW_SECONDS = 2.0
+
+
+async def _seed(service: FakeCalendarService):
+    start = datetime.now().replace(hour=10, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    rows = []
+    for master_id in (1, 2, 3):
+        for k in range(16):
+            slot = start + timedelta(minutes=30 * k)
+            rows.append((master_id, format_slot(slot), to_ts(slot), to_ts(slot + timedelta(minutes=30))))
+    async with pool.write() as db:
+        await db.executemany(
+            "INSERT INTO masters (id, telegram_id, name, google_calendar_id) VALUES (?, ?, ?, ?)",
+            [(1, 1001, "Warm", "warm@example.com"), (2, 1002, "Cold", "cold@example.com"),
+             (3, 1003, "Shared", "shared@example.com")]
+        )
+        await db.executemany(
+            "INSERT INTO slots (master_id, datetime, is_booked, start_ts, end_ts) VALUES (?, ?, 0, ?, ?)", rows
+        )
+    service.add("warm@example.com", start + timedelta(hours=2), 60)
+    return start
+
+
+async def _timed_slots(master_id: int, day: datetime):
+    availability_cache.bump(master_id)
+    t0 = time.perf_counter()
+    slots = await get_available_slots(master_id, 30, date_from=day, date_to=day + timedelta(days=1))
+    return time.perf_counter() - t0, slots
+
+
+async def main() -> int:
+    concurrent = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+    pool.path = os.path.join(tempfile.mkdtemp(), "resilience.db")
+    await init_db()
+    service = FakeCalendarService()
+    google_calendar._service_cache = service
+    breaker = google_calendar.read_breaker
+    day = (await _seed(service)).replace(hour=0)
+    errors = []
+
+    # Warm the first master's calendar while Google is healthy
+    await _timed_slots(1, day)
+    await busy_cache.refresh("warm@example.com")
+    busy_cache.refresh_seconds = 0  # every read finds the data stale
+
+    # --- Google hangs: warm reads stay fast, one refresh in flight ---
+    service.latency = SLOW_SECONDS
+    calls_before = service.calls
+    results = await asyncio.gather(*(_timed_slots(1, day) for _ in range(concurrent)))
+    worst = max(elapsed for elapsed, _ in results)
+    print(f"warm calendar, Google hanging: {concurrent} requests, slowest {worst * 1000:.1f} ms, "
+          f"{service.calls - calls_before} API call(s)")
+    if worst > 0.1:
+        errors.append("warm reads waited for Google")
+    if service.calls - calls_before != 1:
+        errors.append("more than one background refresh per calendar")
+    if any("12:00" in s[1] for _, slots in results for s in slots):
+        errors.append("stale data lost the calendar event")
+
+    # --- Cold calendar: bounded by the deadline ---
+    elapsed, _ = await _timed_slots(2, day)
+    print(f"cold calendar, Google hanging: {elapsed * 1000:.0f} ms (deadline {google_calendar.CALENDAR_READ_TIMEOUT:g}s)")
+    if elapsed > google_calendar.CALENDAR_READ_TIMEOUT + 0.2:
+        errors.append("cold read exceeded the deadline")
+
+    # --- Breaker opens after repeated timeouts ---
+    for _ in range(breaker.failure_threshold):
+        await _timed_slots(2, day)
+    if breaker.state != "open":
+        errors.append(f"breaker is {breaker.state} after repeated timeouts")
+    calls_before = service.calls
+    elapsed, _ = await _timed_slots(2, day)
+    print(f"breaker {breaker.state}: cold read in {elapsed * 1000:.1f} ms, {service.calls - calls_before} API call(s)")
+    if service.calls != calls_before:
+        errors.append("open breaker still let calls through")
+
+    # --- Google is back: one trial call closes the breaker ---
+    service.latency = 0
+    # Calls already hanging hold the read threads until they return (the HTTP timeout in production)
+    await asyncio.sleep(max(breaker.reset_seconds, SLOW_SECONDS))
+    await _timed_slots(2, day)
+    if breaker.state != "closed":
+        errors.append(f"breaker is {breaker.state} after Google recovered")
+
+    # --- Request errors don't count as outages ---
+    service.freebusy_only.add("shared@example.com")
+    for _ in range(breaker.failure_threshold + 1):
+        await busy_cache.refresh("shared@example.com")
+    if breaker.state != "closed":
+        errors.append("403 on a free/busy-only calendar opened the breaker")
+
+    # --- Background syncs: own deadline, no say in the breaker ---
+    for k in range(600):
+        service.add("big@example.com", day + timedelta(days=2 + k // 10, hours=10), 30)
+    service.latency = google_calendar.CALENDAR_READ_TIMEOUT * 1.5
+    t0 = time.perf_counter()
+    await busy_cache.refresh("big@example.com")
+    elapsed = time.perf_counter() - t0
+    events = len(busy_cache._calendars["big@example.com"].events)
+    print(f"first sync of {events} events, {service.latency:g}s per page: {elapsed:.1f}s, breaker {breaker.state}")
+    if events != 600:
+        errors.append("a sync slower than the read deadline didn't complete")
+    service.latency = google_calendar.CALENDAR_SYNC_TIMEOUT * 1.5
+    failures = breaker.failures
+    for _ in range(breaker.failure_threshold + 1):
+        await busy_cache.refresh("big@example.com")
+    if breaker.state != "closed" or breaker.failures != failures:
+        errors.append("sync timeouts counted toward the breaker")
+    service.latency = 0
+
+    while busy_cache.stats()["refreshing"]:
+        await asyncio.sleep(0.01)
+    print(f"read stats: {google_calendar.calendar_read_stats()}")
+    print(f"cache stats: {busy_cache.stats()}")
+    await close_db()
+    for error in errors:
+        print(f"❌ {error}")
+    if not errors:
+        print("✅ Latency bounded while Google is unhealthy")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,134 @@
+"""
+Benchmark and check: booking menus served from the in-memory service catalog.
+
+Imports services_template.csv with scripts/load_services.py, then walks the
+whole menu (categories -> subcategories -> services -> service info) the way
+the client handlers do. Compares the per-query SQL the helpers used to run
+with the catalog, and checks that
+  * a warm menu walk doesn't touch SQLite at all,
+  * the catalog matches what the old queries returned,
+  * re-running the importer is picked up on the next version check.
+
+Usage: python scripts/bench_catalog.py [walks]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+from database.setup import pool, init_db, close_db
+from database.catalog import catalog_cache, bump_catalog_version, CATEGORY_ORDER
+from database.db_cmds import (
+    get_service_categories, get_subcategories, get_services_in_category, get_service_info
+)
+from scripts import load_services
+
+
+async def _legacy_walk(master_id: int):
+    """The menu queries as the helpers ran them before the catalog"""
+    seen = []
+    async with pool.read() as db:
+        async with db.execute("SELECT DISTINCT category FROM services WHERE master_id = ?", (master_id,)) as cursor:
+            categories = sorted([r[0] for r in await cursor.fetchall()],
+                                key=lambda x: CATEGORY_ORDER.index(x) if x in CATEGORY_ORDER else 999)
+    for category in categories:
+        async with pool.read() as db:
+            async with db.execute(
+                "SELECT DISTINCT subcategory FROM services WHERE master_id = ? AND category = ? "
+                "AND subcategory IS NOT NULL ORDER BY subcategory", (master_id, category)
+            ) as cursor:
+                subcategories = [r[0] for r in await cursor.fetchall()]
+        for subcategory in subcategories or [None]:
+            async with pool.read() as db:
+                if subcategory:
+                    query = ("SELECT id, name, price, duration, description, subcategory FROM services "
+                             "WHERE master_id = ? AND category = ? AND subcategory = ?")
+                    params = (master_id, category, subcategory)
+                else:
+                    query = ("SELECT id, name, price, duration, description, subcategory FROM services "
+                             "WHERE master_id = ? AND category = ? AND subcategory IS NULL")
+                    params = (master_id, category)
+                async with db.execute(query, params) as cursor:
+                    services = await cursor.fetchall()
+            for service in services:
+                async with pool.read() as db:
+                    async with db.execute(
+                        "SELECT name, price, duration, description, category, subcategory FROM services WHERE id = ?",
+                        (service[0],)
+                    ) as cursor:
+                        seen.append((category, subcategory, tuple(service), tuple(await cursor.fetchone())))
+    return seen
+
+
+async def _walk(master_id: int):
+    seen = []
+    for category in await get_service_categories(master_id):
+        for subcategory in await get_subcategories(master_id, category) or [None]:
+            for service in await get_services_in_category(master_id, category, subcategory):
+                seen.append((category, subcategory, tuple(service), tuple(await get_service_info(service[0]))))
+    return seen
+
+
+async def main() -> int:
+    walks = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    errors = []
+
+    pool.path = os.path.join(tempfile.mkdtemp(), "catalog.db")
+    await init_db()
+    async with pool.write() as db:
+        await db.execute("INSERT INTO masters (id, telegram_id, name) VALUES (1, 1000, 'Bench')")
+    os.chdir(ROOT)  # the importer reads services_template.csv from the working directory
+    await load_services.import_services()
+
+    expected = await _legacy_walk(1)
+    t0 = time.perf_counter()
+    for _ in range(walks):
+        await _legacy_walk(1)
+    legacy = (time.perf_counter() - t0) / walks
+
+    if await _walk(1) != expected:
+        errors.append("catalog differs from the old queries")
+    statements = []
+    connections = [pool._writer, *pool._all_readers]
+    for conn in connections:
+        await conn.set_trace_callback(statements.append)
+    t0 = time.perf_counter()
+    for _ in range(walks):
+        await _walk(1)
+    cached = (time.perf_counter() - t0) / walks
+    for conn in connections:
+        await conn.set_trace_callback(None)
+    print(f"menu walk over {len(expected)} services: SQL {legacy * 1000:.2f} ms, catalog {cached * 1000:.3f} ms "
+          f"({len(statements)} statements in {walks} warm walks)")
+    # At most the throttled version check
+    if len(statements) > 1:
+        errors.append(f"warm menu walks ran {len(statements)} SQL statements")
+
+    # --- Importer runs again with a changed price ---
+    async with pool.read() as db:
+        async with db.execute("SELECT name FROM services ORDER BY id LIMIT 1") as cursor:
+            first_name = (await cursor.fetchone())[0]
+    await load_services.import_services()
+    async with pool.write() as db:
+        await db.execute("UPDATE services SET price = 1 WHERE name = ?", (first_name,))
+        await bump_catalog_version(db)
+    catalog_cache._checked_at = None  # don't wait CATALOG_CHECK_SECONDS
+    categories = await get_service_categories(1)
+    services = await get_services_in_category(1, categories[0], (await get_subcategories(1, categories[0]) or [None])[0])
+    if not any(s[1] == first_name and s[2] == 1 for s in services):
+        errors.append("reloaded catalog not picked up")
+    print(f"stats: {catalog_cache.stats()}")
+
+    await close_db()
+    for error in errors:
+        print(f"❌ {error}")
+    if not errors:
+        print("✅ Booking menus served from memory")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,104 @@
+"""
+Benchmark: concurrent read/write throughput of the SQLite profile.
+
+Compares the old defaults (rollback journal, synchronous=FULL) with the
+profile applied by init_db (WAL, synchronous=NORMAL, busy_timeout, ...).
+Writers book/cancel slots while readers run the "free slots" query, each on
+its own connection — the same contention the reminder scan and a master
+clearing a day used to produce.
+
+Usage: python scripts/bench_db_profile.py [seconds]
+"""
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+import aiosqlite
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database.setup import DB_PRAGMAS
+
+WRITERS = 2
+READERS = 4
+SLOTS = 2000
+
+# What aiosqlite.connect() gave us before (sqlite3 already waits up to 5s on locks)
+LEGACY_PRAGMAS = {"journal_mode": "DELETE", "synchronous": "FULL"}
+
+
+async def _connect(path: str, pragmas: dict) -> aiosqlite.Connection:
+    conn = await aiosqlite.connect(path)
+    for name, value in pragmas.items():
+        await conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+
+async def _prepare(path: str, pragmas: dict):
+    conn = await _connect(path, pragmas)
+    await conn.execute(
+        "CREATE TABLE slots (id INTEGER PRIMARY KEY, master_id INTEGER, datetime TEXT, "
+        "is_booked BOOLEAN DEFAULT 0, client_id INTEGER)"
+    )
+    await conn.executemany(
+        "INSERT INTO slots (master_id, datetime) VALUES (1, ?)",
+        [(f"{d % 28 + 1:02d}.03 {h:02d}:00",) for d in range(SLOTS // 10) for h in range(10, 20)]
+    )
+    await conn.commit()
+    await conn.close()
+
+
+async def _writer(path: str, pragmas: dict, deadline: float, stats: dict):
+    conn = await _connect(path, pragmas)
+    while time.perf_counter() < deadline:
+        slot_id = random.randint(1, SLOTS)
+        try:
+            await conn.execute("UPDATE slots SET is_booked = 1 - is_booked, client_id = 5 WHERE id = ?", (slot_id,))
+            await conn.commit()
+            stats["writes"] += 1
+        except sqlite3.OperationalError:
+            await conn.rollback()
+            stats["errors"] += 1
+    await conn.close()
+
+
+async def _reader(path: str, pragmas: dict, deadline: float, stats: dict):
+    conn = await _connect(path, pragmas)
+    while time.perf_counter() < deadline:
+        try:
+            async with conn.execute("SELECT id, datetime FROM slots WHERE master_id = 1 AND is_booked = 0") as cursor:
+                await cursor.fetchall()
+            stats["reads"] += 1
+        except sqlite3.OperationalError:
+            stats["errors"] += 1
+    await conn.close()
+
+
+async def run_profile(name: str, pragmas: dict, seconds: float):
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    await _prepare(path, pragmas)
+    stats = {"reads": 0, "writes": 0, "errors": 0}
+    deadline = time.perf_counter() + seconds
+    await asyncio.gather(
+        *[_writer(path, pragmas, deadline, stats) for _ in range(WRITERS)],
+        *[_reader(path, pragmas, deadline, stats) for _ in range(READERS)],
+    )
+    print(
+        f"{name:>8}: {stats['reads'] / seconds:8.0f} reads/s  "
+        f"{stats['writes'] / seconds:8.0f} writes/s  "
+        f"{stats['errors']:5d} 'database is locked' errors"
+    )
+
+
+async def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print(f"{WRITERS} writers + {READERS} readers, {seconds:.0f}s per profile")
+    await run_profile("legacy", LEGACY_PRAGMAS, seconds)
+    await run_profile("tuned", DB_PRAGMAS, seconds)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
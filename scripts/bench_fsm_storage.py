@@ -0,0 +1,168 @@
+"""
+Benchmark and check: FSM sessions in SQLite behind a write-back memory tier.
+
+Feeds synthetic updates through a real Dispatcher wired like bot.py
+(SQLiteStorage + FSMFlushMiddleware). Each update runs a handler that reads
+and updates the FSM data several times, like the booking menus do. Checks
+that
+  * every update costs at most one write transaction, however many
+    update_data() calls it makes,
+  * reads come from memory (no SELECT after warm-up),
+  * a "restart" (new storage, warm()) restores state and data,
+  * state.clear() removes the row,
+  * idle sessions expire after their state group's TTL and leave memory,
+    while a session touched meanwhile stays.
+
+Usage: python scripts/bench_fsm_storage.py [users]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from aiogram import Bot, Dispatcher, F, Router
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import Chat, Message, Update, User
+
+from database.setup import pool, init_db, close_db
+from utils.fsm_storage import SQLiteStorage, FSMFlushMiddleware
+
+UPDATES_PER_USER = 5
+
+
+class Flow(StatesGroup):
+    step = State()
+
+
+def _dispatcher(storage) -> Dispatcher:
+    router = Router()
+
+    @router.message(F.text == "clear")
+    async def clear(message: Message, state: FSMContext):
+        await state.clear()
+
+    @router.message()
+    async def step(message: Message, state: FSMContext):
+        data = await state.get_data()
+        await state.update_data(master_id=1)
+        await state.update_data(category="💅 Маникюр", subcategory=None)
+        await state.update_data(steps=data.get("steps", 0) + 1)
+        await state.set_state(Flow.step)
+
+    dp = Dispatcher(storage=storage)
+    if isinstance(storage, SQLiteStorage):
+        dp.update.outer_middleware(FSMFlushMiddleware(storage))
+    dp.include_router(router)
+    return dp
+
+
+def _update(update_id: int, user_id: int, text: str = "next") -> Update:
+    user = User(id=user_id, is_bot=False, first_name="Client")
+    return Update(update_id=update_id, message=Message(
+        message_id=update_id, date=datetime.now(), chat=Chat(id=user_id, type="private"), from_user=user, text=text
+    ))
+
+
+async def _feed(dp: Dispatcher, bot: Bot, users: int, first_id: int) -> int:
+    """UPDATES_PER_USER rounds of one update per user; returns the last update_id"""
+    update_id = first_id
+    for _ in range(UPDATES_PER_USER):
+        updates = []
+        for user_id in range(1, users + 1):
+            update_id += 1
+            updates.append(_update(update_id, user_id))
+        await asyncio.gather(*(dp.feed_update(bot, u) for u in updates))
+    return update_id
+
+
+async def main() -> int:
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    errors = []
+
+    pool.path = os.path.join(tempfile.mkdtemp(), "fsm.db")
+    await init_db()
+    bot = Bot(token="42:BENCH")
+    storage = SQLiteStorage()
+    await storage.warm()
+    dp = _dispatcher(storage)
+    total = users * UPDATES_PER_USER
+
+    t0 = time.perf_counter()
+    await _feed(_dispatcher(MemoryStorage()), bot, users, 0)
+    baseline = (time.perf_counter() - t0) / total
+
+    statements = []
+    connections = [pool._writer, *pool._all_readers]
+    for conn in connections:
+        await conn.set_trace_callback(statements.append)
+    t0 = time.perf_counter()
+    update_id = await _feed(dp, bot, users, 0)
+    elapsed = time.perf_counter() - t0
+    for conn in connections:
+        await conn.set_trace_callback(None)
+
+    commits = sum(1 for sql in statements if sql.strip().upper().startswith("COMMIT"))
+    selects = sum(1 for sql in statements if sql.lstrip().upper().startswith("SELECT"))
+    print(f"{total} updates, 3 update_data + set_state each: MemoryStorage {baseline * 1000:.2f} ms/update, "
+          f"SQLiteStorage {elapsed / total * 1000:.2f} ms/update with {commits} write transactions, {selects} SELECTs")
+    if commits > total:
+        errors.append("more than one write per update")
+    if selects:
+        errors.append("FSM reads went to SQLite")
+
+    # --- Restart ---
+    await storage.close()
+    restarted = SQLiteStorage()
+    await restarted.warm()
+    dp = _dispatcher(restarted)
+    update_id += 1
+    await dp.feed_update(bot, _update(update_id, 1))
+    key = StorageKey(bot_id=bot.id, chat_id=1, user_id=1)
+    state, data = await restarted.get_state(key), await restarted.get_data(key)
+    print(f"after restart: state={state} data={data}")
+    if state != Flow.step.state or data.get("steps") != UPDATES_PER_USER + 1:
+        errors.append("session not restored after restart")
+
+    # --- clear() deletes the row ---
+    update_id += 1
+    await dp.feed_update(bot, _update(update_id, 1, "clear"))
+    async with pool.read() as db:
+        async with db.execute("SELECT COUNT(*) FROM fsm_sessions") as cursor:
+            rows = (await cursor.fetchone())[0]
+    if rows != users - 1:
+        errors.append(f"{rows} rows after clearing one of {users} sessions")
+    print(f"stats: {restarted.stats()}")
+
+    # --- Idle sessions expire (Flow TTL 0.6 s), an active one stays ---
+    restarted.state_ttls = {"Flow": 0.01}
+    await asyncio.sleep(0.4)
+    update_id += 1
+    await dp.feed_update(bot, _update(update_id, 2))
+    await asyncio.sleep(0.4)
+    expired = await restarted.sweep()
+    async with pool.read() as db:
+        async with db.execute("SELECT COUNT(*) FROM fsm_sessions") as cursor:
+            rows = (await cursor.fetchone())[0]
+    stats = restarted.stats()
+    print(f"after the TTL: {expired} sessions expired, {rows} row(s) left, stats: {stats}")
+    if expired != users - 2 or rows != 1 or stats["sessions"] != 1 or len(restarted._sessions) != 1:
+        errors.append("idle sessions not expired")
+
+    await restarted.close()
+    await bot.session.close()
+    await close_db()
+    for error in errors:
+        print(f"❌ {error}")
+    if not errors:
+        print("✅ FSM sessions survive restarts, one write per update")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
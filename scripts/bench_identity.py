@@ -0,0 +1,113 @@
+"""
+Benchmark and check: identity lookups served from memory.
+
+Seeds masters and users, warms the identity cache like bot.py does, then
+runs the lookups of a "💅 Записаться" press (add_user, get_master_by_tg_id,
+get_user_master, get_master_name_by_id) for many users. Checks that
+  * returning users cause no SQL at all (no write, no fsync),
+  * a new user and a changed deep link are written and then served from memory,
+  * a master registered at runtime is visible immediately.
+
+Usage: python scripts/bench_identity.py [users]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database.setup import pool, init_db, close_db
+from database.identity import identity_cache
+from database.db_cmds import (
+    add_user, get_master_by_tg_id, get_user_master, get_master_name_by_id, register_master
+)
+
+
+async def _press(user_id: int):
+    """Identity lookups of start_booking"""
+    await add_user(user_id, f"user{user_id}", f"User {user_id}")
+    if not await get_master_by_tg_id(user_id):
+        master_id = await get_user_master(user_id)
+        if master_id:
+            await get_master_name_by_id(master_id)
+
+
+async def _legacy_press(user_id: int):
+    """The same lookups as separate queries, as before the cache"""
+    async with pool.write() as db:
+        await db.execute("INSERT OR IGNORE INTO users (id, username, full_name) VALUES (?, ?, ?)",
+                         (user_id, f"user{user_id}", f"User {user_id}"))
+    async with pool.read() as db:
+        async with db.execute("SELECT * FROM masters WHERE telegram_id = ?", (user_id,)) as cursor:
+            master = await cursor.fetchone()
+    if not master:
+        async with pool.read() as db:
+            async with db.execute("SELECT linked_master_id FROM users WHERE id = ?", (user_id,)) as cursor:
+                master_id = (await cursor.fetchone())[0]
+        if master_id:
+            async with pool.read() as db:
+                async with db.execute("SELECT name FROM masters WHERE id = ?", (master_id,)) as cursor:
+                    await cursor.fetchone()
+
+
+async def main() -> int:
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    errors = []
+
+    pool.path = os.path.join(tempfile.mkdtemp(), "identity.db")
+    await init_db()
+    async with pool.write() as db:
+        await db.executemany("INSERT INTO masters (telegram_id, name) VALUES (?, ?)",
+                             [(100 + k, f"Master {k}") for k in range(3)])
+        await db.executemany("INSERT INTO users (id, username, full_name, linked_master_id) VALUES (?, ?, ?, ?)",
+                             [(5000 + k, f"user{5000 + k}", f"User {5000 + k}", 1 + k % 3) for k in range(users)])
+    await identity_cache.warm()
+    user_ids = [5000 + k for k in range(users)]
+
+    t0 = time.perf_counter()
+    for user_id in user_ids:
+        await _legacy_press(user_id)
+    legacy = (time.perf_counter() - t0) / users
+
+    statements = []
+    connections = [pool._writer, *pool._all_readers]
+    for conn in connections:
+        await conn.set_trace_callback(statements.append)
+    t0 = time.perf_counter()
+    for user_id in user_ids:
+        await _press(user_id)
+    cached = (time.perf_counter() - t0) / users
+    for conn in connections:
+        await conn.set_trace_callback(None)
+    print(f"identity lookups per press: SQL {legacy * 1000:.3f} ms, cache {cached * 1000:.4f} ms "
+          f"({len(statements)} statements for {users} returning users)")
+    if statements:
+        errors.append(f"returning users ran {len(statements)} SQL statements")
+
+    # --- New user, then a deep link to another master ---
+    await add_user(9999, "new", "New User")
+    await add_user(9999, "new", "New User", deep_link_master=2)
+    async with pool.read() as db:
+        async with db.execute("SELECT linked_master_id FROM users WHERE id = 9999") as cursor:
+            stored = (await cursor.fetchone())[0]
+    if stored != 2 or await get_user_master(9999) != 2:
+        errors.append("deep link not written through")
+
+    # --- Master registered at runtime ---
+    await register_master(9999, "New Master")
+    master = await get_master_by_tg_id(9999)
+    if not master or await get_master_name_by_id(master[0]) != "New Master":
+        errors.append("new master not visible")
+
+    print(f"stats: {identity_cache.stats()}")
+    await close_db()
+    for error in errors:
+        print(f"❌ {error}")
+    if not errors:
+        print("✅ Identity lookups served from memory")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
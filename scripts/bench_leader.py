@@ -0,0 +1,190 @@
+"""
+Benchmark and check: one leader per database for background jobs (utils/leader.py).
+
+Starts NODES processes (this script with --node) on one scratch database.
+Each runs a LeaderLease and, while it holds the lease, an APScheduler
+interval job (through leader.guard, like reminders/scheduler.py) that
+records every run in a table. Then it
+  * lets them settle: exactly one node runs the job,
+  * kills the leader (SIGKILL): another takes over within lease + heartbeat,
+  * stops the new leader (SIGTERM): the lease is handed over within a heartbeat,
+  * freezes the next leader (SIGSTOP) past its lease, then resumes it: it
+    must not run the job again next to its successor,
+and checks that runs of different nodes never interleave.
+
+Usage: python scripts/bench_leader.py [nodes]
+"""
+import asyncio
+import os
+import signal
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database.setup import pool, init_db, close_db
+
+LEASE_SECONDS = 1.0
+HEARTBEAT_SECONDS = 0.25
+JOB_SECONDS = 0.05
+SETTLE_SECONDS = 2.0
+
+
+# --- Node process ---
+async def node_main(name: str):
+    from apscheduler.schedulers.asyncio import AsyncIOScheduler
+    from utils.leader import LeaderLease
+
+    pool.path = os.environ["BENCH_DB"]
+    lease = LeaderLease(lease_seconds=LEASE_SECONDS, heartbeat_seconds=HEARTBEAT_SECONDS, holder=name)
+    scheduler = None
+
+    async def job():
+        async with pool.write() as db:
+            await db.execute("INSERT INTO job_runs (ts, node) VALUES (?, ?)", (time.time(), name))
+
+    async def start_jobs():
+        nonlocal scheduler
+        scheduler = AsyncIOScheduler()
+        scheduler.add_job(lease.guard(job), "interval", seconds=JOB_SECONDS, misfire_grace_time=60, coalesce=True)
+        scheduler.start()
+
+    async def stop_jobs():
+        nonlocal scheduler
+        scheduler.shutdown(wait=False)
+        scheduler = None
+
+    lease.on_acquired(start_jobs)
+    lease.on_lost(stop_jobs)
+    await lease.start()
+    stop = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+    await stop.wait()
+    await lease.stop()
+    await close_db()
+
+
+# --- Bench ---
+async def _runs(since: float = 0.0) -> list:
+    async with pool.read() as db:
+        async with db.execute("SELECT ts, node FROM job_runs WHERE ts >= ? ORDER BY ts", (since,)) as cursor:
+            return await cursor.fetchall()
+
+
+async def _leader(since: float, timeout: float = LEASE_SECONDS * 5) -> str:
+    """Node that ran the job last (after since), waiting for one"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        runs = await _runs(since)
+        if runs:
+            return runs[-1][1]
+        await asyncio.sleep(JOB_SECONDS)
+    return ""
+
+
+async def _failover(since: float, previous: str) -> float:
+    """Seconds from since until another node's first run"""
+    deadline = since + LEASE_SECONDS * 5
+    while time.time() < deadline:
+        runs = [run for run in await _runs(since) if run[1] != previous]
+        if runs:
+            return runs[0][0] - since
+        await asyncio.sleep(JOB_SECONDS / 2)
+    return float("inf")
+
+
+async def main() -> int:
+    nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    errors = []
+
+    path = os.path.join(tempfile.mkdtemp(), "leader.db")
+    pool.path = path
+    await init_db()
+    async with pool.write() as db:
+        await db.execute("CREATE TABLE job_runs (ts REAL, node TEXT)")
+    env = dict(os.environ, BENCH_DB=path)
+    processes = {}
+    for index in range(nodes):
+        name = f"node{index}"
+        processes[name] = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.abspath(__file__), "--node", name, env=env
+        )
+
+    # --- Settle: one node runs the job ---
+    if not await _leader(0.0, timeout=30):
+        print("❌ no node started the job")
+        return 1
+    t0 = time.time()
+    await asyncio.sleep(SETTLE_SECONDS)
+    runners = {node for _, node in await _runs(t0)}
+    print(f"{nodes} nodes, {SETTLE_SECONDS:g}s: job ran on {sorted(runners)}")
+    if len(runners) != 1:
+        errors.append(f"job ran on {len(runners)} nodes at once")
+    current = await _leader(t0)
+
+    # --- Crash ---
+    processes[current].send_signal(signal.SIGKILL)
+    await processes.pop(current).wait()
+    t0 = time.time()
+    elapsed = await _failover(t0, current)
+    print(f"leader {current} killed: job back on another node after {elapsed:.2f}s "
+          f"(lease {LEASE_SECONDS:g}s + heartbeat {HEARTBEAT_SECONDS:g}s)")
+    if elapsed > LEASE_SECONDS + HEARTBEAT_SECONDS * 2 + JOB_SECONDS:
+        errors.append("slow failover after a crash")
+
+    # --- Clean stop ---
+    current = await _leader(t0)
+    processes[current].send_signal(signal.SIGTERM)
+    await processes.pop(current).wait()
+    t0 = time.time()
+    elapsed = await _failover(t0, current)
+    print(f"leader {current} stopped: job back on another node after {elapsed:.2f}s")
+    if elapsed > HEARTBEAT_SECONDS * 2 + JOB_SECONDS:
+        errors.append("lease not handed over on a clean stop")
+
+    # --- Frozen leader comes back ---
+    frozen = await _leader(t0)
+    if len(processes) > 1:
+        processes[frozen].send_signal(signal.SIGSTOP)
+        t0 = time.time()
+        await asyncio.sleep(LEASE_SECONDS * 3)
+        processes[frozen].send_signal(signal.SIGCONT)
+        resumed = time.time()
+        await asyncio.sleep(LEASE_SECONDS)
+        late = [run for run in await _runs(resumed) if run[1] == frozen]
+        successor = {node for _, node in await _runs(t0 + LEASE_SECONDS + HEARTBEAT_SECONDS)} - {frozen}
+        print(f"leader {frozen} frozen for {LEASE_SECONDS * 3:g}s: {sorted(successor)} took over, "
+              f"{len(late)} run(s) by {frozen} after it resumed")
+        if not successor:
+            errors.append("nobody took over from a frozen leader")
+        if late:
+            errors.append("a frozen leader ran the job after losing the lease")
+
+    for process in processes.values():
+        process.send_signal(signal.SIGTERM)
+    for process in processes.values():
+        await process.wait()
+
+    # --- Runs never interleave: once the job moves to another node, the previous one is done ---
+    runs = await _runs()
+    order = []
+    for _, node in runs:
+        if not order or order[-1] != node:
+            order.append(node)
+    print(f"{len(runs)} runs in total, leaders in turn: {' -> '.join(order)}")
+    if len(order) != len(set(order)):
+        errors.append("two nodes ran the job in turns (overlap)")
+
+    await close_db()
+    for error in errors:
+        print(f"❌ {error}")
+    if not errors:
+        print("✅ One node runs the jobs; crash, stop and stall hand them over without overlap")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    if "--node" in sys.argv:
+        asyncio.run(node_main(sys.argv[sys.argv.index("--node") + 1]))
+    else:
+        sys.exit(asyncio.run(main()))
@@ -0,0 +1,76 @@
+"""
+Benchmark: fan-out through the outbound message queue against a fake Bot.
+
+The fake bot takes ~50 ms per request, answers one request with a 429 and
+records when each chat received a message. The run checks that nothing was
+lost, that no chat got more than the burst within one per-chat window, and
+prints the achieved throughput next to the configured global rate.
+
+Usage: python scripts/bench_messenger.py [messages] [chats]
+"""
+import asyncio
+import os
+import sys
+import time
+from collections import defaultdict
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+from utils.messenger import Messenger, Priority
+
+
+class FakeBot:
+    def __init__(self):
+        self.received = defaultdict(list)
+        self.calls = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls += 1
+        call = self.calls
+        await asyncio.sleep(0.05)
+        if call == 20:
+            raise TelegramRetryAfter(method=SendMessage(chat_id=chat_id, text=text), message="Too Many Requests", retry_after=1)
+        self.received[chat_id].append(time.monotonic())
+
+
+async def main() -> int:
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    chats = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    bot = FakeBot()
+    messenger = Messenger()
+    messenger.start(bot)
+
+    t0 = time.perf_counter()
+    futures = [
+        messenger.send(1000 + i % chats, f"message {i}", priority=Priority.HIGH if i % 10 == 0 else Priority.NORMAL)
+        for i in range(total)
+    ]
+    results = await asyncio.gather(*futures)
+    elapsed = time.perf_counter() - t0
+    await messenger.stop()
+
+    errors = []
+    if not all(results) or sum(len(v) for v in bot.received.values()) != total:
+        errors.append(f"lost messages: {results.count(False)} not delivered")
+    window = 1 / messenger.chat_rate
+    for chat_id, stamps in bot.received.items():
+        for i in range(len(stamps) - messenger.chat_burst):
+            # burst + 1 messages must span at least one refill interval
+            if stamps[i + messenger.chat_burst] - stamps[i] < window * 0.9:
+                errors.append(f"chat {chat_id} exceeded the per-chat limit")
+                break
+
+    print(f"{total} messages to {chats} chats in {elapsed:.2f}s: {total / elapsed:.1f} msg/s "
+          f"(global limit {messenger._global.rate:g} msg/s, includes one 1s flood-control pause)")
+    print(f"stats: {messenger.stats()}")
+    for error in errors:
+        print(f"❌ {error}")
+    if not errors:
+        print("✅ All delivered within limits")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,159 @@
+"""
+Benchmark and check: webhook mode (utils/webhook.py).
+
+Serves the webhook app on a local port with a test router whose handler
+takes HANDLER_SECONDS (a slow database or API call), then POSTs a burst of
+updates the way Telegram does. Checks that
+  * Telegram gets its answer without waiting for the handler,
+  * no more than max_in_flight updates run at once, the rest wait for a slot,
+  * every update is handled exactly once,
+  * a burst from one chat behind a slow handler is handled in order without
+    taking the slots of other chats,
+  * a wrong or missing secret token gets 401,
+  * shutdown lets updates in flight finish.
+
+Usage: python scripts/bench_webhook.py [updates] [max_in_flight]
+"""
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import aiohttp
+from aiogram import Bot, Dispatcher, Router
+from aiogram.types import Message
+from aiohttp import web
+
+from config import WEBHOOK_PATH
+from utils import webhook
+
+HANDLER_SECONDS = 0.2
+SECRET = "bench-secret"
+PORT = 18080
+SEQUENTIAL = 20
+# One chat's burst runs under a small limit so the check takes seconds, not minutes
+CHAT_LIMIT = 4
+CHAT_BURST = 3 * CHAT_LIMIT
+BUSY_CHAT = 999999
+
+
+def _update(update_id: int, chat_id: int = None) -> dict:
+    user = {"id": chat_id or 1000 + update_id, "is_bot": False, "first_name": "Client"}
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": int(datetime.now().timestamp()),
+        "chat": {"id": user["id"], "type": "private"}, "from": user, "text": "hi",
+    }}
+
+
+async def main() -> int:
+    updates = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    max_in_flight = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    errors = []
+
+    handled = []
+    handled_at = {}
+    running = 0
+    peak = 0
+    router = Router()
+
+    @router.message()
+    async def slow(message: Message):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(HANDLER_SECONDS)
+        handled.append(message.message_id)
+        handled_at[message.message_id] = time.perf_counter()
+        running -= 1
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    bot = Bot(token="42:BENCH")
+    app = webhook.build_app(dp, bot, SECRET)
+    handler = webhook.request_handler
+    handler.max_in_flight = max_in_flight
+    handler._slots = asyncio.Semaphore(max_in_flight)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+    url = f"http://127.0.0.1:{PORT}{WEBHOOK_PATH}"
+
+    async with aiohttp.ClientSession() as session:
+        async def post(update_id: int, secret: str = SECRET, chat_id: int = None):
+            t0 = time.perf_counter()
+            async with session.post(url, json=_update(update_id, chat_id),
+                                    headers={"X-Telegram-Bot-Api-Secret-Token": secret}) as response:
+                return response.status, time.perf_counter() - t0
+
+        # --- One update at a time: the answer doesn't wait for the handler ---
+        await post(0)  # the first update builds aiogram's models
+        await asyncio.sleep(HANDLER_SECONDS)
+        sequential = sorted([(await post(i))[1] for i in range(1, SEQUENTIAL)])
+        print(f"{len(sequential)} updates one by one: answer p50 {sequential[len(sequential) // 2] * 1000:.1f} ms, "
+              f"slowest {sequential[-1] * 1000:.1f} ms (handler takes {HANDLER_SECONDS * 1000:.0f} ms)")
+        if sequential[-1] >= HANDLER_SECONDS / 4:
+            errors.append("Telegram waited for the handler")
+        await asyncio.sleep(HANDLER_SECONDS * 2)  # all slots free again
+
+        # --- A burst within the limit (for reference: client and server share this event loop,
+        # so connection setup on the client side is part of the numbers) ---
+        results = await asyncio.gather(*(post(i) for i in range(SEQUENTIAL, SEQUENTIAL + max_in_flight)))
+        latencies = sorted(latency for _, latency in results)
+        print(f"{max_in_flight} updates at once: answer p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+              f"slowest {latencies[-1] * 1000:.1f} ms")
+
+        # --- A burst over the limit: bounded, back-pressure on the answers ---
+        t0 = time.perf_counter()
+        results = await asyncio.gather(*(post(i) for i in range(SEQUENTIAL + max_in_flight, updates)))
+        elapsed = time.perf_counter() - t0
+        statuses = {status for status, _ in results}
+        print(f"{len(results)} more updates: answered in {elapsed:.2f}s, statuses {statuses}")
+        if statuses != {200}:
+            errors.append(f"unexpected statuses {statuses}")
+
+        # --- One chat's burst waits for its own order, not for slots ---
+        await asyncio.sleep(HANDLER_SECONDS * 2)
+        handler._slots = asyncio.Semaphore(CHAT_LIMIT)
+        burst_ids = list(range(updates + 10, updates + 10 + CHAT_BURST))
+        t0 = time.perf_counter()
+        burst_answers = [(await post(i, chat_id=BUSY_CHAT))[1] for i in burst_ids]
+        other = updates + 3
+        other_answer = (await post(other))[1]
+        await asyncio.sleep(HANDLER_SECONDS * 2)
+        other_done = handled_at.get(other, float("inf")) - t0
+        print(f"{CHAT_BURST} updates from one chat (limit {CHAT_LIMIT}): slowest answer {max(burst_answers) * 1000:.1f} ms; "
+              f"another chat answered in {other_answer * 1000:.1f} ms, handled after {other_done:.2f}s")
+        if other_done > HANDLER_SECONDS * 2:
+            errors.append("one chat's burst held the slots of other chats")
+        while len([i for i in burst_ids if i in handled_at]) < CHAT_BURST and time.perf_counter() - t0 < 30:
+            await asyncio.sleep(HANDLER_SECONDS)
+        if [i for i in handled if i in burst_ids] != burst_ids:
+            errors.append("one chat's updates handled out of order")
+
+        # --- Secret token ---
+        bad = [(await post(updates + 1, "wrong"))[0], (await post(updates + 2, ""))[0]]
+        if bad != [401, 401]:
+            errors.append(f"wrong/missing secret answered {bad}")
+
+    # --- Shutdown waits for updates in flight ---
+    await runner.cleanup()
+    print(f"handled {len(handled)} updates, at most {peak} at once (limit {max_in_flight})")
+    print(f"stats: {handler.stats()}")
+    if peak > max_in_flight:
+        errors.append("in-flight limit exceeded")
+    if sorted(handled) != sorted([*range(updates), updates + 3, *burst_ids]):
+        errors.append(f"{updates - len(set(handled))} updates lost or handled twice")
+    if handler.stats()["unauthorized"] != 2:
+        errors.append("unauthorized requests not counted")
+
+    for error in errors:
+        print(f"❌ {error}")
+    if not errors:
+        print("✅ Webhook answers at once, handles updates concurrently within the limit")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
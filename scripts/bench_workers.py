@@ -0,0 +1,208 @@
+"""
+Benchmark and check: multi-worker mode (utils/workers.py, database/versions.py).
+
+1. Cache invalidation across processes: a schedule change, a new master and
+   a new reminder published by one SharedVersions reach another one (as in
+   a second worker) within a couple of sync intervals.
+2. The front process: starts real worker processes (this script with
+   --worker: a webhook-mode dispatcher whose handler burns CPU_MS of pure
+   Python, like availability or keyboard building), feeds them synthetic
+   updates from CHATS chats and checks that
+     * every update is handled exactly once,
+     * each chat stays on one worker, the one worker_for() picks,
+     * a chat's updates are handled in the order they came in,
+   and compares throughput with 1 and with N workers (it only scales with
+   free cores).
+
+Usage: python scripts/bench_workers.py [updates] [workers]
+"""
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CPU_MS = 5
+CHATS = 40
+SYNC_SECONDS = 0.1
+BASE_PORT = 18200
+
+
+def _update(update_id: int, chat_id: int) -> dict:
+    user = {"id": chat_id, "is_bot": False, "first_name": "Client"}
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": int(datetime.now().timestamp()),
+        "chat": {"id": chat_id, "type": "private"}, "from": user, "text": "hi",
+    }}
+
+
+# --- Worker process ---
+async def worker_main():
+    from aiogram import Bot, Dispatcher, Router
+    from aiogram.types import Message
+    from config import WORKER_INDEX, WORKER_SECRET, WORKER_BASE_PORT
+    from utils.webhook import run_webhook
+
+    handled = []
+    router = Router()
+
+    @router.message()
+    async def busy(message: Message):
+        # Some I/O, then Python work that holds the core
+        await asyncio.sleep(random.uniform(0, 0.005))
+        deadline = time.perf_counter() + CPU_MS / 1000
+        while time.perf_counter() < deadline:
+            pass
+        handled.append((message.chat.id, message.message_id, time.time()))
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    bot = Bot(token="42:BENCH")
+    await run_webhook(dp, bot, "127.0.0.1", WORKER_BASE_PORT + WORKER_INDEX, WORKER_SECRET, register=False)
+    with open(os.path.join(os.environ["BENCH_RESULTS"], f"worker{WORKER_INDEX}.json"), "w") as f:
+        json.dump(handled, f)
+
+
+# --- Cache invalidation ---
+async def _shared_versions(errors: list):
+    from database.setup import pool, init_db, close_db
+    from database.cache import availability_cache, AvailabilityCache, SCHEDULE_KEY
+    from database.identity import MASTERS_KEY, IdentityCache
+    from database.versions import shared_versions, SharedVersions
+    from reminders.scheduler import REMINDERS_KEY
+
+    pool.path = os.path.join(tempfile.mkdtemp(), "workers.db")
+    await init_db()
+
+    # "This" worker uses the module singletons, the "other" one its own instances
+    other = SharedVersions(sync_seconds=SYNC_SECONDS)
+    other_cache = AvailabilityCache()
+    other_identity = IdentityCache()
+    received = []
+    prefix = SCHEDULE_KEY.format("")
+    other.subscribe(prefix, lambda key: other_cache.invalidate(int(key[len(prefix):])))
+    other.subscribe(MASTERS_KEY, lambda key: other_identity.invalidate_masters())
+    other.subscribe("", received.append)
+    shared_versions.sync_seconds = SYNC_SECONDS
+    await shared_versions.start()
+    await other.start()
+
+    other_cache.put(1, ("params",), other_cache.version(1), 0, [(1, "slot", 0)], uses_calendar=False)
+    await other_identity.warm()
+    t0 = time.perf_counter()
+    availability_cache.bump(1)
+    shared_versions.publish(MASTERS_KEY)
+    shared_versions.publish(REMINDERS_KEY)
+    while len(received) < 3 and time.perf_counter() - t0 < SYNC_SECONDS * 10:
+        await asyncio.sleep(SYNC_SECONDS / 10)
+    elapsed = time.perf_counter() - t0
+    print(f"cross-process invalidation: {sorted(received)} arrived in {elapsed * 1000:.0f} ms "
+          f"(sync every {SYNC_SECONDS * 1000:.0f} ms)")
+    if sorted(received) != sorted([SCHEDULE_KEY.format(1), MASTERS_KEY, REMINDERS_KEY]):
+        errors.append(f"other worker received {received}")
+    if other_cache.get(1, ("params",), 0) is not None:
+        errors.append("availability entry survived a schedule change in another worker")
+    if other_identity._masters_loaded_at is not None:
+        errors.append("masters not re-read after a registration in another worker")
+
+    # Own bumps don't come back as changes
+    own = len(received)
+    other_cache.bump(2)  # publishes through the singleton, i.e. as "this" worker again
+    await asyncio.sleep(SYNC_SECONDS * 3)
+    if shared_versions.received:
+        errors.append("a worker was notified of its own bump")
+    print(f"stats: this {shared_versions.stats()}, other {other.stats()}")
+    if len(received) != own + 1:
+        errors.append("second bump not received")
+
+    await other.stop()
+    await shared_versions.stop()
+    await close_db()
+
+
+# --- Front and workers ---
+async def _run_front(workers: int, updates: int, results_dir: str):
+    from utils.workers import Front
+
+    for name in os.listdir(results_dir):
+        os.remove(os.path.join(results_dir, name))
+    front = Front(workers=workers, base_port=BASE_PORT, command=[sys.executable, os.path.abspath(__file__), "--worker"])
+    front.start()
+    # Warm-up: one update per worker, so the timing below doesn't include process startup
+    warmed = set()
+    chat = 10 ** 6
+    while len(warmed) < workers:
+        chat += 1
+        if chat % workers not in warmed:
+            warmed.add(chat % workers)
+            await front.dispatch(_update(-len(warmed), chat))
+    await asyncio.gather(*(queue.join() for queue in front._queues))
+    await asyncio.sleep(0.5)
+
+    t0 = time.time()
+    for update_id in range(1, updates + 1):
+        await front.dispatch(_update(update_id, update_id % CHATS + 1))
+    await front.stop()
+
+    handled = []
+    for index in range(workers):
+        with open(os.path.join(results_dir, f"worker{index}.json")) as f:
+            handled += [(chat_id, message_id, finished, index) for chat_id, message_id, finished in json.load(f)]
+    handled = [row for row in handled if row[1] > 0]
+    elapsed = max(row[2] for row in handled) - t0 if handled else 0.0
+    return handled, elapsed, front.stats()
+
+
+async def _front(errors: list, updates: int, workers: int):
+    from utils.workers import worker_for
+
+    results_dir = tempfile.mkdtemp()
+    os.environ["BENCH_RESULTS"] = results_dir
+    rates = {}
+    for count in sorted({1, workers}):
+        handled, elapsed, stats = await _run_front(count, updates, results_dir)
+        rates[count] = len(handled) / elapsed if elapsed else 0.0
+        print(f"{count} worker(s): {len(handled)} updates in {elapsed:.2f}s = {rates[count]:.0f} updates/s; front {stats}")
+
+        if sorted(row[1] for row in handled) != list(range(1, updates + 1)):
+            errors.append(f"{count} workers: {updates - len(set(row[1] for row in handled))} updates lost or handled twice")
+        by_chat = {}
+        for chat_id, message_id, finished, index in sorted(handled, key=lambda row: row[2]):
+            by_chat.setdefault(chat_id, []).append((message_id, index))
+        for chat_id, rows in by_chat.items():
+            expected = worker_for(_update(0, chat_id), count)
+            if {index for _, index in rows} != {expected}:
+                errors.append(f"{count} workers: chat {chat_id} handled by workers {sorted({i for _, i in rows})}")
+            ids = [message_id for message_id, _ in rows]
+            if ids != sorted(ids):
+                errors.append(f"{count} workers: chat {chat_id} handled out of order")
+
+    if workers > 1:
+        print(f"{workers} workers vs 1: x{rates[workers] / rates[1]:.2f} on {os.cpu_count()} core(s) "
+              f"(handler: {CPU_MS} ms of Python each)")
+
+
+async def main() -> int:
+    updates = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else max(2, min(4, os.cpu_count() or 1))
+    errors = []
+    await _shared_versions(errors)
+    await _front(errors, updates, workers)
+
+    for error in errors[:20]:
+        print(f"❌ {error}")
+    if not errors:
+        print("✅ Chats stick to their worker and stay in order, caches follow changes made by other workers")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    if "--worker" in sys.argv:
+        asyncio.run(worker_main())
+    else:
+        sys.exit(asyncio.run(main()))
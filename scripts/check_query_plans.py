@@ -0,0 +1,270 @@
+"""
+Query plan regression check.
+
+Runs every database helper against a scratch database, records the SQL it
+executes and fails if EXPLAIN QUERY PLAN shows a full table SCAN for any of
+it. A helper that is not listed in CALLS also fails the check, so new queries
+can't slip in without an index.
+
+Usage: python scripts/check_query_plans.py
+"""
+import asyncio
+import inspect
+import os
+import re
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database.setup import pool, init_db, close_db
+from database import db_cmds, template_cmds, catalog
+from database.identity import IdentityCache
+from database.versions import SharedVersions
+from reminders import scheduler
+from utils import slot_generator
+from utils.messenger import messenger
+from utils import calendar_outbox
+from utils.calendar_cache import CalendarBusyCache
+from utils.fsm_storage import SQLiteStorage
+from utils.leader import LeaderLease
+from aiogram.fsm.storage.base import StorageKey
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from scripts.fake_calendar import FakeCalendarService
+
+MODULES = [db_cmds, template_cmds, catalog, scheduler, slot_generator, calendar_outbox]
+
+MASTER_TG = 1000
+CLIENT = 2000
+
+# Statements that read a whole (tiny) table on purpose
+ALLOWED_SCANS = [
+    # Identity cache: whole masters table on refresh, whole users table at startup
+    re.compile(r"^SELECT id, telegram_id, name, description, google_calendar_id FROM masters$"),
+    re.compile(r"^SELECT id, username, full_name, linked_master_id FROM users$"),
+    # FSM sessions restored at startup
+    re.compile(r"^SELECT key, state, data, updated_ts FROM fsm_sessions$"),
+    # Batch slot generation reads every template and vacation day once
+    re.compile(r"^SELECT master_id, day_of_week, time FROM schedule_template$"),
+    re.compile(r"^SELECT master_id, date FROM vacation_days$"),
+]
+
+# Helpers without SQL of their own
+SKIP = {"get_master_id_by_tg_id", "send_reminder", "start_reminder_scheduler"}
+
+
+class FakeBot:
+    async def send_message(self, *args, **kwargs):
+        pass
+
+
+async def _calendar_sync():
+    """Full sync, incremental sync with a deleted event, reload after restart"""
+    service = FakeCalendarService()
+    event_id = service.add("calendar", datetime.now() + timedelta(days=2), 60)
+
+    async def get_service():
+        return service
+
+    cache = CalendarBusyCache(get_service=get_service)
+    await cache.get_busy("calendar", 0, 2**40)
+    service.remove(event_id)
+    await cache.refresh("calendar")
+    await CalendarBusyCache(get_service=get_service).refresh("calendar")
+
+
+async def _book_with_calendar():
+    """Booking of a master with a calendar: the event job is queued in the same transaction"""
+    async with pool.write() as db:
+        await db.execute("UPDATE masters SET google_calendar_id = 'calendar' WHERE id = 1")
+    await db_cmds.book_slot(1, CLIENT, 1, client_name="Client", service_name="Service")
+
+
+async def _outbox_worker():
+    """One batch of due jobs, then the queue depth/lag query"""
+    service = FakeCalendarService()
+
+    async def get_service():
+        return service
+
+    worker = calendar_outbox.CalendarOutbox(get_service=get_service)
+    await worker.process_due()
+    await worker.stats()
+
+
+async def _service_catalog():
+    """Cold lookup of a service by id, then a reload after the importer bumped the version"""
+    cache = catalog.CatalogCache(check_seconds=0)
+    await cache.get_service(1)
+    async with pool.write() as db:
+        await catalog.bump_catalog_version(db)
+    await cache.get(1)
+
+
+async def _identity():
+    """Startup warm-up, then a cold cache that looks a user up by id"""
+    await IdentityCache().warm()
+    await IdentityCache().user(CLIENT)
+
+
+async def _fsm_sessions():
+    """Startup restore, lazy load of one session, write-back of a change, expiry of an idle session"""
+    await SQLiteStorage().warm()
+    storage = SQLiteStorage(ttl_minutes=0.001)
+    key = StorageKey(bot_id=1, chat_id=CLIENT, user_id=CLIENT)
+    await storage.update_data(key, {"master_id": 1})
+    await storage.flush()
+    await asyncio.sleep(0.1)
+    await storage.sweep()
+
+
+async def _shared_versions():
+    """Baseline at startup, then a sync that publishes a key and reads the others"""
+    versions = SharedVersions()
+    await versions.start()
+    versions.publish("schedule:1")
+    await versions.sync()
+    await versions.stop()
+
+
+async def _leader_lease():
+    """First claim, renewal, a second process that finds it taken, release"""
+    lease = LeaderLease(holder="a")
+    await lease.start()
+    await lease.heartbeat()
+    await LeaderLease(holder="b").heartbeat()
+    await lease.stop()
+
+
+def _calls():
+    """helper name -> coroutine factory, run in this order"""
+    in_2_days = datetime.now() + timedelta(days=2)
+    return {
+        "register_master": lambda: db_cmds.register_master(MASTER_TG, "Master"),
+        "add_user": lambda: db_cmds.add_user(CLIENT, "client", "Client", deep_link_master=1),
+        "get_user_master": lambda: db_cmds.get_user_master(CLIENT),
+        "get_master_by_tg_id": lambda: db_cmds.get_master_by_tg_id(MASTER_TG),
+        "get_master_name_by_id": lambda: db_cmds.get_master_name_by_id(1),
+        "get_master_google_calendar_id": lambda: db_cmds.get_master_google_calendar_id(1),
+        "get_all_masters": lambda: db_cmds.get_all_masters(),
+        "identity_cache": _identity,
+        "get_service_categories": lambda: db_cmds.get_service_categories(1),
+        "get_subcategories": lambda: db_cmds.get_subcategories(1, "💅 Маникюр"),
+        "get_services_in_category": lambda: db_cmds.get_services_in_category(1, "💅 Маникюр", "Короткие"),
+        "get_service_info": lambda: db_cmds.get_service_info(1),
+        "bump_catalog_version": _service_catalog,
+        "add_template_time": lambda: template_cmds.add_template_time(1, in_2_days.weekday(), "10:00"),
+        "get_template_times": lambda: template_cmds.get_template_times(1, in_2_days.weekday()),
+        "get_all_template_times": lambda: template_cmds.get_all_template_times(1),
+        "add_vacation_day": lambda: template_cmds.add_vacation_day(1, "01.01.2030"),
+        "get_vacation_days": lambda: template_cmds.get_vacation_days(1),
+        "is_vacation_day": lambda: template_cmds.is_vacation_day(1, "01.01.2030"),
+        "set_min_booking_hours": lambda: template_cmds.set_min_booking_hours(1, 0),
+        "get_master_settings": lambda: template_cmds.get_master_settings(1),
+        "generate_slots_from_template": lambda: slot_generator.generate_slots_from_template(MASTER_TG, 14),
+        "generate_slots_for_all_masters": lambda: slot_generator.generate_slots_for_all_masters(14),
+        "add_slot": lambda: db_cmds.add_slot(MASTER_TG, in_2_days.strftime("%d.%m 11:00")),
+        "get_master_slots_with_ids": lambda: db_cmds.get_master_slots_with_ids(MASTER_TG, date_from=datetime.now()),
+        "get_master_slots_for_day": lambda: db_cmds.get_master_slots_for_day(MASTER_TG, in_2_days),
+        "get_master_slot": lambda: db_cmds.get_master_slot(MASTER_TG, 1),
+        "get_available_slots": lambda: db_cmds.get_available_slots(
+            1, 60, date_from=in_2_days.replace(hour=0, minute=0), date_to=in_2_days + timedelta(days=1)),
+        "book_slot": _book_with_calendar,
+        "schedule_booking_reminders": lambda: scheduler.schedule_booking_reminders(1),
+        "calendar_outbox_worker": _outbox_worker,
+        "reconcile_reminders": lambda: scheduler.reconcile_reminders(),
+        "pickup_reminders": lambda: scheduler.pickup_reminders(),
+        "deliver_reminder": lambda: scheduler.deliver_reminder(1),
+        "get_slot_info": lambda: db_cmds.get_slot_info(1),
+        "get_master_tg_id_by_slot_id": lambda: db_cmds.get_master_tg_id_by_slot_id(1),
+        "get_client_bookings": lambda: db_cmds.get_client_bookings(CLIENT),
+        "get_due_reminders": lambda: scheduler.get_due_reminders(),
+        "mark_reminders_sent": lambda: scheduler.mark_reminders_sent([(1, CLIENT, "3h")]),
+        "check_and_send_reminders": lambda: scheduler.check_and_send_reminders(FakeBot()),
+        "cancel_booking_db": lambda: db_cmds.cancel_booking_db(1, CLIENT),
+        "delete_template_time": lambda: template_cmds.delete_template_time(1),
+        "delete_vacation_day": lambda: template_cmds.delete_vacation_day(1),
+        "delete_slot_db": lambda: db_cmds.delete_slot_db(2),
+        "clear_master_day": lambda: db_cmds.clear_master_day(1, in_2_days),
+        "calendar_busy_cache": _calendar_sync,
+        "fsm_sessions": _fsm_sessions,
+        "shared_versions": _shared_versions,
+        "leader_lease": _leader_lease,
+    }
+
+
+def _helpers():
+    names = set()
+    for module in MODULES:
+        for name, func in inspect.getmembers(module, inspect.iscoroutinefunction):
+            if func.__module__ == module.__name__ and not name.startswith("_"):
+                names.add(name)
+    return names - SKIP
+
+
+async def _seed():
+    async with pool.write() as db:
+        await db.executemany(
+            "INSERT INTO services (master_id, category, subcategory, name, price, duration) VALUES (1, ?, ?, ?, 1000, ?)",
+            [("💅 Маникюр", "Короткие", f"Service {i}", 30 + 30 * (i % 3)) for i in range(20)]
+        )
+
+
+async def _plan(sql: str):
+    async with pool.read() as db:
+        async with db.execute(f"EXPLAIN QUERY PLAN {sql}") as cursor:
+            return [row[3] for row in await cursor.fetchall()]
+
+
+def _needs_plan(sql: str) -> bool:
+    keyword = sql.lstrip().split(None, 1)[0].upper()
+    return keyword in ("SELECT", "UPDATE", "DELETE", "WITH")
+
+
+async def main() -> int:
+    pool.path = os.path.join(tempfile.mkdtemp(), "plans.db")
+    await init_db()
+    await _seed()
+
+    messenger.start(FakeBot())
+    # Not started: reminder jobs are only recorded, so the scheduling queries run as in the bot
+    scheduler._scheduler = AsyncIOScheduler()
+    calls = _calls()
+    missing = _helpers() - set(calls)
+    if missing:
+        print(f"❌ Helpers not covered by this check: {', '.join(sorted(missing))}")
+        return 1
+
+    captured = []
+    connections = [pool._writer, *pool._all_readers]
+    for conn in connections:
+        await conn.set_trace_callback(lambda sql: captured.append(sql))
+
+    statements = {}
+    for name, factory in calls.items():
+        captured.clear()
+        await factory()
+        for sql in captured:
+            if _needs_plan(sql):
+                statements.setdefault(" ".join(sql.split()), name)
+
+    for conn in connections:
+        await conn.set_trace_callback(None)
+
+    failures = 0
+    for sql, name in statements.items():
+        if any(pattern.match(sql) for pattern in ALLOWED_SCANS):
+            continue
+        scans = [step for step in await _plan(sql) if step.startswith("SCAN") and step != "SCAN CONSTANT ROW"]
+        if scans:
+            failures += 1
+            print(f"❌ {name}: {'; '.join(scans)}\n   {sql}")
+
+    await messenger.stop()
+    await close_db()
+    print(f"Checked {len(statements)} statements from {len(calls)} helpers: {failures} full scans")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
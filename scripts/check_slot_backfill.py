@@ -0,0 +1,115 @@
+"""
+Check: start_ts backfill of slots created before the column existed (database/setup.py).
+
+Builds a scratch database with the old slots table (year-less 'DD.MM HH:MM'
+only), past-dated rows included, runs init_db and checks that
+  * past slots stay in the past, even half a year or more back,
+  * upcoming slots (within the generation horizon) land in the coming days,
+  * an old booking is not counted as an active one and gets no reminders.
+
+Usage: python scripts/check_slot_backfill.py
+"""
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database.setup import pool, init_db, close_db
+from database.db_cmds import get_client_bookings
+from reminders.scheduler import reconcile_reminders
+from utils.slot_time import format_slot, from_ts, resolve_slot_datetime
+
+CLIENT = 2000
+
+
+def _resolve_cases(errors: list):
+    not_after = datetime(2026, 11, 17)
+    cases = {
+        "25.03 14:00": datetime(2026, 3, 25, 14, 0),   # 7 months back, not next March
+        "16.11 10:00": datetime(2026, 11, 16, 10, 0),  # within the horizon
+        "20.11 10:00": datetime(2025, 11, 20, 10, 0),  # past the horizon -> a year back
+        "29.02 12:00": datetime(2024, 2, 29, 12, 0),
+    }
+    for text, expected in cases.items():
+        got = resolve_slot_datetime(text, not_after=not_after)
+        if got != expected:
+            errors.append(f"resolve_slot_datetime('{text}', not_after=2026-11-17) = {got}, expected {expected}")
+    # Without not_after: still the closest year (handlers typing a date)
+    if resolve_slot_datetime("05.01 10:00", now=datetime(2026, 12, 28)) != datetime(2027, 1, 5, 10, 0):
+        errors.append("closest-year resolution changed")
+
+
+async def main() -> int:
+    errors = []
+    _resolve_cases(errors)
+
+    now = datetime.now().replace(second=0, microsecond=0)
+    rows = {
+        "booked 7 months ago": (now - timedelta(days=210), 1),
+        "free 7 months ago": (now - timedelta(days=212), 0),
+        "booked 3 days ago": (now - timedelta(days=3), 1),
+        "booked in 10 days": (now + timedelta(days=10), 1),
+        "free in 25 days": (now + timedelta(days=25), 0),
+    }
+
+    pool.path = os.path.join(tempfile.mkdtemp(), "backfill.db")
+    legacy = sqlite3.connect(pool.path)
+    legacy.execute("CREATE TABLE masters (id INTEGER PRIMARY KEY AUTOINCREMENT, telegram_id INTEGER UNIQUE, name TEXT)")
+    legacy.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT, full_name TEXT)")
+    legacy.execute('''
+        CREATE TABLE slots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            master_id INTEGER,
+            datetime TEXT,
+            is_booked BOOLEAN DEFAULT 0,
+            client_id INTEGER
+        )
+    ''')
+    legacy.execute("INSERT INTO masters (telegram_id, name) VALUES (1000, 'Master')")
+    legacy.execute("INSERT INTO users (id, username, full_name) VALUES (?, 'client', 'Client')", (CLIENT,))
+    ids = {}
+    for label, (dt, is_booked) in rows.items():
+        cursor = legacy.execute(
+            "INSERT INTO slots (master_id, datetime, is_booked, client_id) VALUES (1, ?, ?, ?)",
+            (format_slot(dt), is_booked, CLIENT if is_booked else None)
+        )
+        ids[label] = cursor.lastrowid
+    legacy.commit()
+    legacy.close()
+
+    await init_db()
+    async with pool.read() as db:
+        async with db.execute("SELECT id, start_ts FROM slots") as cursor:
+            start_ts = dict(await cursor.fetchall())
+
+    for label, (dt, _) in rows.items():
+        got = from_ts(start_ts[ids[label]]) if start_ts.get(ids[label]) else None
+        print(f"{label:>20}: '{format_slot(dt)}' -> {got}")
+        if got != dt:
+            errors.append(f"{label}: backfilled as {got}, expected {dt}")
+
+    bookings = {row[0] for row in await get_client_bookings(CLIENT)}
+    expected = {ids["booked in 10 days"]}
+    if bookings != expected:
+        errors.append(f"active bookings {sorted(bookings)}, expected {sorted(expected)}")
+
+    await reconcile_reminders()
+    async with pool.read() as db:
+        async with db.execute("SELECT DISTINCT slot_id FROM reminders") as cursor:
+            reminded = {row[0] for row in await cursor.fetchall()}
+    if reminded - expected:
+        errors.append(f"reminders created for past bookings {sorted(reminded - expected)}")
+
+    await close_db()
+    for error in errors:
+        print(f"❌ {error}")
+    if not errors:
+        print("✅ Past slots stay in the past, upcoming ones keep their dates")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
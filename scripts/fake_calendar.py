@@ -0,0 +1,220 @@
+"""
+In-process stand-in for the Google Calendar API service object.
+
+Implements the subset the bot uses: events().list() with timeMin/timeMax,
+pageToken and syncToken (returning nextSyncToken and cancelled tombstones
+for deleted events, 410 Gone for an expired token), events().insert(),
+events().patch(), events().delete(), freebusy().query() and batch requests
+(new_batch_http_request: one round trip for all requests added). Calendars
+listed in `freebusy_only` answer events.list with 403, like a calendar
+shared with "see only free/busy" access; calendars in `missing` answer
+everything with 404; `fail_next` makes the next N requests fail with a 500.
+Every round trip sleeps `latency` seconds to mimic the network.
+"""
+import itertools
+import time
+from datetime import datetime, timedelta, timezone
+
+MOSCOW_TZ = timezone(timedelta(hours=3))
+
+
+class FakeHttpError(Exception):
+    """Shaped like googleapiclient.errors.HttpError"""
+    def __init__(self, status: int, message: str):
+        super().__init__(f"{status} {message}")
+        self.resp = type("Resp", (), {"status": status})()
+
+
+class _Request:
+    def __init__(self, service, func):
+        self._service = service
+        self._func = func
+
+    def execute(self):
+        time.sleep(self._service.latency)
+        return self.run()
+
+    def run(self):
+        if self._service.fail_next > 0:
+            self._service.fail_next -= 1
+            raise FakeHttpError(500, "Backend Error")
+        return self._func()
+
+
+class _Batch:
+    def __init__(self, service, callback):
+        self._service = service
+        self._callback = callback
+        self._requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self._requests.append((request, callback or self._callback, request_id or str(len(self._requests) + 1)))
+
+    def execute(self):
+        self._service.batches += 1
+        time.sleep(self._service.latency)
+        for request, callback, request_id in self._requests:
+            try:
+                response, exception = request.run(), None
+            except Exception as e:
+                response, exception = None, e
+            callback(request_id, response, exception)
+
+
+class FakeCalendarService:
+    def __init__(self, latency: float = 0.0, page_size: int = 250):
+        self.latency = latency
+        self.page_size = page_size
+        self.events_by_id = {}     # event_id -> (seq, calendar_id, event dict)
+        self.freebusy_only = set()
+        self.missing = set()
+        self.fail_next = 0
+        self.calls = 0
+        self.freebusy_calls = 0
+        self.batches = 0
+        self._seq = itertools.count(1)
+        self._ids = itertools.count(1)
+        self._min_valid_token = 0  # tokens below this answer 410
+
+    # --- test helpers ---
+
+    def add(self, calendar_id: str, start: datetime, minutes: int, all_day: bool = False) -> str:
+        event_id = f"ev{next(self._ids)}"
+        if all_day:
+            event = {"id": event_id, "status": "confirmed",
+                     "start": {"date": start.strftime("%Y-%m-%d")}, "end": {"date": start.strftime("%Y-%m-%d")}}
+        else:
+            event = {"id": event_id, "status": "confirmed",
+                     "start": {"dateTime": start.replace(tzinfo=MOSCOW_TZ).isoformat()},
+                     "end": {"dateTime": (start + timedelta(minutes=minutes)).replace(tzinfo=MOSCOW_TZ).isoformat()}}
+        self.events_by_id[event_id] = (next(self._seq), calendar_id, event)
+        return event_id
+
+    def remove(self, event_id: str):
+        _, calendar_id, _ = self.events_by_id[event_id]
+        self.events_by_id[event_id] = (next(self._seq), calendar_id, {"id": event_id, "status": "cancelled"})
+
+    def expire_tokens(self):
+        self._min_valid_token = next(self._seq)
+
+    # --- API surface ---
+
+    def events(self):
+        return self
+
+    def new_batch_http_request(self, callback=None):
+        return _Batch(self, callback)
+
+    def freebusy(self):
+        return _FreeBusy(self)
+
+    def list(self, calendarId, timeMin=None, timeMax=None, syncToken=None, pageToken=None, **kwargs):
+        self.calls += 1
+
+        def run():
+            if calendarId in self.freebusy_only:
+                raise FakeHttpError(403, "Forbidden: only free/busy information is shared")
+            head = next(self._seq)
+            if syncToken is not None:
+                since = int(syncToken)
+                if since < self._min_valid_token:
+                    raise FakeHttpError(410, "Gone: sync token is no longer valid")
+                items = [e for seq, cal, e in self.events_by_id.values() if cal == calendarId and seq > since]
+            else:
+                items = self._confirmed(calendarId, timeMin, timeMax)
+            offset = int(pageToken or 0)
+            page = items[offset:offset + self.page_size]
+            result = {"items": page}
+            if offset + self.page_size < len(items):
+                result["nextPageToken"] = str(offset + self.page_size)
+            else:
+                result["nextSyncToken"] = str(head)
+            return result
+
+        return _Request(self, run)
+
+    def insert(self, calendarId, body):
+        self.calls += 1
+
+        def run():
+            self._check_calendar(calendarId)
+            event_id = f"ev{next(self._ids)}"
+            self.events_by_id[event_id] = (next(self._seq), calendarId, dict(body, id=event_id, status="confirmed"))
+            return {"id": event_id}
+
+        return _Request(self, run)
+
+    def patch(self, calendarId, eventId, body):
+        self.calls += 1
+
+        def run():
+            event = self._live_event(calendarId, eventId)
+            event.update(body)
+            self.events_by_id[eventId] = (next(self._seq), calendarId, event)
+            return event
+
+        return _Request(self, run)
+
+    def delete(self, calendarId, eventId):
+        self.calls += 1
+
+        def run():
+            self._live_event(calendarId, eventId)
+            self.remove(eventId)
+            return ""
+
+        return _Request(self, run)
+
+    def live_events(self, calendar_id: str) -> list:
+        return [e for _, cal, e in self.events_by_id.values() if cal == calendar_id and e["status"] == "confirmed"]
+
+    def _check_calendar(self, calendar_id):
+        if calendar_id in self.missing:
+            raise FakeHttpError(404, "Not Found")
+
+    def _live_event(self, calendar_id, event_id) -> dict:
+        self._check_calendar(calendar_id)
+        if event_id not in self.events_by_id:
+            raise FakeHttpError(404, "Not Found")
+        _, cal, event = self.events_by_id[event_id]
+        if cal != calendar_id:
+            raise FakeHttpError(404, "Not Found")
+        if event["status"] == "cancelled":
+            raise FakeHttpError(410, "Resource has been deleted")
+        return dict(event)
+
+    def _confirmed(self, calendar_id, time_min, time_max) -> list:
+        lo = datetime.fromisoformat(time_min).timestamp() if time_min else float("-inf")
+        hi = datetime.fromisoformat(time_max).timestamp() if time_max else float("inf")
+        return [e for _, cal, e in self.events_by_id.values()
+                if cal == calendar_id and e["status"] == "confirmed" and self._overlaps(e, lo, hi)]
+
+    @staticmethod
+    def _overlaps(event, lo, hi) -> bool:
+        if "dateTime" not in event["start"]:
+            return True
+        start = datetime.fromisoformat(event["start"]["dateTime"]).timestamp()
+        end = datetime.fromisoformat(event["end"]["dateTime"]).timestamp()
+        return start < hi and end > lo
+
+
+class _FreeBusy:
+    def __init__(self, service: FakeCalendarService):
+        self._service = service
+
+    def query(self, body):
+        service = self._service
+        service.calls += 1
+        service.freebusy_calls += 1
+
+        def run():
+            calendars = {}
+            for item in body["items"]:
+                events = service._confirmed(item["id"], body["timeMin"], body["timeMax"])
+                calendars[item["id"]] = {"busy": [
+                    {"start": e["start"]["dateTime"], "end": e["end"]["dateTime"]}
+                    for e in events if "dateTime" in e["start"]
+                ]}
+            return {"calendars": calendars}
+
+        return _Request(service, run)
@@ -0,0 +1,29 @@
+"""
+Generate slots from weekly templates for every master (e.g. nightly from cron).
+
+Usage: python scripts/generate_slots.py [days_ahead]
+"""
+import asyncio
+import sys
+import os
+
+# Add parent directory to path to import database.setup
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config  # pins TZ=Europe/Moscow before anything computes slot timestamps
+from database.setup import init_db, close_db
+from utils.slot_generator import generate_slots_for_all_masters
+
+async def main():
+    days_ahead = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    await init_db()
+    try:
+        results = await generate_slots_for_all_masters(days_ahead)
+        for master_id, result in sorted(results.items()):
+            errors = f", errors: {'; '.join(result['errors'])}" if result['errors'] else ""
+            print(f"Master {master_id}: created {result['created']}, skipped {result['skipped']}{errors}")
+        print(f"✅ Generated {sum(r['created'] for r in results.values())} slots for {len(results)} masters")
+    finally:
+        await close_db()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,12 +1,12 @@
 import csv
 import asyncio
-import aiosqlite
 import sys
 import os
 
 # Add parent directory to path to import database.setup
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from database.setup import DB_NAME, init_db
+from database.setup import pool, init_db, close_db
+from database.catalog import bump_catalog_version
 
 CSV_FILE = "services_template.csv"
 
@@ -29,10 +29,7 @@ async def import_services():
         print("No services found in CSV.")
         return
 
-    async with aiosqlite.connect(DB_NAME) as db:
-        # Clear existing services (Full Refresh Strategy)
-        await db.execute("DELETE FROM services")
-        
+    async with pool.write() as db:
         # Get Admin Master ID (Assumption: We attach to the first master found or ID 1)
         # For SaaS, we would look up by some identifier. Here we just assign to all masters or specific one.
         # Let's assign to ALL existing masters for now (since we only have 1 active master usually).
@@ -43,6 +40,9 @@ async def import_services():
             print("No masters found in DB! Please register a master first (run bot).")
             return
 
+        # Clear existing services (Full Refresh Strategy)
+        await db.execute("DELETE FROM services")
+        
         print(f"Found {len(masters)} masters. Importing {len(services)} services for each...")
 
         count = 0
@@ -62,9 +62,17 @@ async def import_services():
                     VALUES (?, ?, ?, ?, ?, ?, ?)
                 ''', (master_id, category, subcategory, name, price, duration, description))
                 count += 1
+
+        # Running bots drop their cached menus on the next version check
+        await bump_catalog_version(db)
         
-        await db.commit()
-        print(f"✅ Successfully imported {count} services!")
+    print(f"✅ Successfully imported {count} services!")
+
+async def main():
+    try:
+        await import_services()
+    finally:
+        await close_db()
 
 if __name__ == "__main__":
-    asyncio.run(import_services())
+    asyncio.run(main())
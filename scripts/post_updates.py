@@ -0,0 +1,65 @@
+"""
+POST recorded Telegram updates to a bot running in webhook mode.
+
+Start the bot locally with BOT_MODE=webhook, WEBHOOK_SECRET set and
+WEBHOOK_URL empty (nothing is registered with Telegram), then feed it
+updates saved from the Bot API (one JSON object per line, or a JSON array).
+Without a file a single "/start" message from ADMIN_ID is sent.
+
+Usage: python scripts/post_updates.py [updates.jsonl] [repeat]
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import aiohttp
+
+from config import ADMIN_ID, WEBHOOK_HOST, WEBHOOK_PATH, WEBHOOK_PORT, WEBHOOK_SECRET
+
+
+def _load(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        text = f.read().strip()
+    if text.startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def _start_update() -> dict:
+    user = {"id": int(ADMIN_ID or 1), "is_bot": False, "first_name": "Local"}
+    return {"update_id": 1, "message": {
+        "message_id": 1, "date": int(time.time()), "chat": {"id": user["id"], "type": "private"},
+        "from": user, "text": "/start", "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+    }}
+
+
+async def main() -> int:
+    updates = _load(sys.argv[1]) if len(sys.argv) > 1 else [_start_update()]
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    url = f"http://{WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}"
+    headers = {"X-Telegram-Bot-Api-Secret-Token": WEBHOOK_SECRET}
+
+    async with aiohttp.ClientSession(headers=headers) as session:
+        async def post(update):
+            t0 = time.perf_counter()
+            async with session.post(url, json=update) as response:
+                return response.status, time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        results = await asyncio.gather(*(post(u) for _ in range(repeat) for u in updates))
+        elapsed = time.perf_counter() - t0
+
+    statuses = {}
+    for status, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    latencies = sorted(latency for _, latency in results)
+    print(f"{len(results)} updates to {url} in {elapsed:.2f}s, statuses {statuses}, "
+          f"answer p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, max {latencies[-1] * 1000:.1f} ms")
+    return 0 if set(statuses) == {200} else 1
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,128 @@
+"""
+Stress test: concurrent bookings must never double-book.
+
+Several worker processes (each with its own connection pool, like separate
+bot instances on one database) run hundreds of concurrent book_slot calls
+against the same small set of slots, with services of different lengths.
+Afterwards the schedule is checked:
+  * every successful booking owns its slot (no slot was booked twice),
+  * no two bookings of the master overlap in time,
+  * every slot covered by a booking is marked as booked.
+
+Usage: python scripts/stress_booking.py [bookers_per_process] [processes]
+"""
+import asyncio
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database.setup import pool, init_db, close_db
+from utils.slot_time import format_slot, to_ts
+
+SLOTS = 60
+DURATIONS = [30, 60, 90, 120]
+
+
+async def _seed():
+    async with pool.write() as db:
+        await db.execute("INSERT INTO masters (id, telegram_id, name) VALUES (1, 1000, 'Stress')")
+        await db.executemany(
+            "INSERT INTO services (id, master_id, category, name, price, duration) VALUES (?, 1, 'Stress', ?, 1000, ?)",
+            [(i + 1, f"Service {i}", d) for i, d in enumerate(DURATIONS)]
+        )
+        start = datetime.now().replace(hour=9, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        rows = []
+        for k in range(SLOTS):
+            slot = start + timedelta(days=k // 24, minutes=30 * (k % 24))
+            rows.append((format_slot(slot), to_ts(slot), to_ts(slot + timedelta(minutes=30))))
+        await db.executemany(
+            "INSERT INTO slots (master_id, datetime, is_booked, start_ts, end_ts) VALUES (1, ?, 0, ?, ?)", rows
+        )
+
+
+async def _bookers(path: str, worker: int, count: int):
+    from database.db_cmds import book_slot
+    pool.path = path
+    await pool.open()
+    rng = random.Random(worker)
+
+    async def one(n: int):
+        client_id = worker * 100000 + n
+        slot_id = rng.randint(1, SLOTS)
+        service_id = rng.randint(1, len(DURATIONS))
+        if await book_slot(slot_id, client_id, service_id):
+            return slot_id, client_id
+        return None
+
+    results = await asyncio.gather(*(one(n) for n in range(count)))
+    await close_db()
+    return [r for r in results if r]
+
+
+def _worker(args):
+    return asyncio.run(_bookers(*args))
+
+
+async def _verify(successes):
+    async with pool.read() as db:
+        async with db.execute(
+            "SELECT id, client_id, start_ts, end_ts FROM slots WHERE is_booked = 1 AND blocked_by IS NULL ORDER BY start_ts"
+        ) as cursor:
+            bookings = await cursor.fetchall()
+        async with db.execute(
+            "SELECT COUNT(*) FROM slots WHERE is_booked = 0 AND start_ts IN "
+            "(SELECT s.start_ts FROM slots s JOIN slots b ON b.is_booked = 1 AND b.blocked_by IS NULL "
+            "AND s.start_ts >= b.start_ts AND s.start_ts < b.end_ts)"
+        ) as cursor:
+            uncovered = (await cursor.fetchone())[0]
+
+    errors = []
+    slot_ids = [slot_id for slot_id, _ in successes]
+    if len(slot_ids) != len(set(slot_ids)):
+        errors.append(f"{len(slot_ids) - len(set(slot_ids))} slots were booked more than once")
+    if sorted(successes) != sorted((slot_id, client_id) for slot_id, client_id, _, _ in bookings):
+        errors.append("successful bookings don't match the booked slots in the database")
+    for prev, cur in zip(bookings, bookings[1:]):
+        if cur[2] < prev[3]:
+            errors.append(f"bookings of slots {prev[0]} and {cur[0]} overlap")
+    if uncovered:
+        errors.append(f"{uncovered} slots inside a booking are still free")
+    return errors
+
+
+async def main() -> int:
+    per_process = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    path = os.path.join(tempfile.mkdtemp(), "stress.db")
+    pool.path = path
+    await init_db()
+    await _seed()
+
+    t0 = time.perf_counter()
+    with multiprocessing.get_context("spawn").Pool(processes) as workers:
+        batches = workers.map(_worker, [(path, w + 1, per_process) for w in range(processes)])
+    elapsed = time.perf_counter() - t0
+
+    successes = [booking for batch in batches for booking in batch]
+    errors = await _verify(successes)
+    await close_db()
+
+    attempts = per_process * processes
+    print(f"{attempts} booking attempts from {processes} processes on {SLOTS} slots: "
+          f"{len(successes)} succeeded in {elapsed:.2f}s")
+    print(f"throughput: {attempts / elapsed:.0f} attempts/s, {len(successes) / elapsed:.0f} bookings/s")
+    for error in errors:
+        print(f"❌ {error}")
+    if not errors:
+        print("✅ No double bookings")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
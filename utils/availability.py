@@ -0,0 +1,44 @@
+"""
+Availability engine.
+
+Intervals are (start_ts, end_ts) pairs in epoch seconds, end exclusive.
+Busy intervals (bookings, Google Calendar events) are coalesced once, then a
+single sweep over the sorted free slots decides which ones fit the service —
+O(n log n) instead of checking every slot against every booking.
+"""
+from typing import Iterable, List, Sequence, Tuple
+
+Interval = Tuple[int, int]
+
+
+def merge_intervals(intervals: Iterable[Interval]) -> List[Interval]:
+    """Sort and coalesce overlapping or touching intervals"""
+    merged: List[Interval] = []
+    for start, end in sorted(intervals):
+        if end <= start:
+            continue
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def fits_between(slots: Sequence[tuple], busy: Sequence[Interval], duration_sec: int) -> list:
+    """
+    Keep slots whose [start, start + duration) doesn't touch a busy interval.
+    slots: rows with start_ts at index 2, sorted by it; busy: output of merge_intervals.
+    """
+    result = []
+    j = 0
+    busy_count = len(busy)
+    for slot in slots:
+        start = slot[2]
+        # Skip busy intervals that end before this slot starts — they can't hit later slots either
+        while j < busy_count and busy[j][1] <= start:
+            j += 1
+        if j < busy_count and busy[j][0] < start + duration_sec:
+            continue
+        result.append(slot)
+    return result
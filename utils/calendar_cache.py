@@ -0,0 +1,292 @@
+"""
+Google Calendar busy-time cache.
+
+freeBusy (google_calendar.get_busy_intervals) answers the booking window
+for calendars this cache doesn't hold yet, and for calendars shared as
+free/busy only. It has no incremental mode, though: every read would be a
+round trip. So a calendar whose events can be listed is synced here once
+and then served from memory. The sync asks only for what freeBusy would
+return — id, status, times and transparency, no event bodies — and counts
+the same events as busy (not the ones shown as free).
+
+One full sync per calendar (events from CALENDAR_LOOKBACK_DAYS ago onwards),
+then incremental refreshes with the syncToken Google returns, at most once per
+CALENDAR_SYNC_SECONDS. Busy intervals live in memory as (start_ts, end_ts)
+pairs, so any sub-range is answered without an API call. The token and the
+intervals are persisted in calendar_sync / calendar_busy and loaded back after
+a restart. An expired token (HTTP 410) triggers a full resync.
+
+Reads never wait for a refresh once a calendar has data: stale intervals are
+served immediately and a single background refresh per calendar brings them
+up to date (stale-while-revalidate). A calendar that was never synced is
+waited for up to CALENDAR_READ_TIMEOUT; the sync itself goes on in the
+background. Syncs page through google_calendar.sync_call: a longer deadline
+per page, their own threads, and no say in the circuit breaker, which is
+about client reads.
+"""
+import asyncio
+import bisect
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from config import CALENDAR_SYNC_SECONDS, CALENDAR_LOOKBACK_DAYS, CALENDAR_READ_TIMEOUT
+from database.setup import pool
+
+Interval = Tuple[int, int]
+
+# Partial response: only what busy intervals need, not summaries, attendees, descriptions
+EVENT_FIELDS = "items(id,status,start,end,transparency),nextPageToken,nextSyncToken"
+
+
+class SyncTokenExpired(Exception):
+    pass
+
+
+class CalendarState:
+    def __init__(self, calendar_id: str):
+        self.calendar_id = calendar_id
+        self.sync_token: Optional[str] = None
+        self.events: Dict[str, Interval] = {}
+        self.intervals: List[Interval] = []  # sorted by start
+        self.starts: List[int] = []
+        self.synced_at: Optional[float] = None  # monotonic time of the last sync attempt
+        self.loaded = False
+        self.lock = asyncio.Lock()
+        self.refresh_task: Optional[asyncio.Task] = None
+        self.last_error: Optional[str] = None
+
+    def is_stale(self, max_age: float) -> bool:
+        return self.synced_at is None or time.monotonic() - self.synced_at >= max_age
+
+    def rebuild(self):
+        self.intervals = sorted(self.events.values())
+        self.starts = [start for start, _ in self.intervals]
+
+
+def parse_event(event: dict) -> Optional[Interval]:
+    """(start_ts, end_ts) of a timed busy event; None for all-day, "show as free" or unparsable events"""
+    if event.get('transparency') == 'transparent':
+        return None  # Not busy for freeBusy either
+    start = event.get('start', {}).get('dateTime', '')
+    end = event.get('end', {}).get('dateTime', '')
+    if not start or not end or 'T' not in start:
+        return None  # All-day event — skip
+    try:
+        start_dt = datetime.fromisoformat(start.replace('Z', '+00:00'))
+        end_dt = datetime.fromisoformat(end.replace('Z', '+00:00'))
+        return int(start_dt.timestamp()), int(end_dt.timestamp())
+    except ValueError as e:
+        logging.warning(f"Google Calendar: could not parse event time '{start}': {e}")
+        return None
+
+
+def _list_page(service, params: dict) -> dict:
+    """One page of events.list (blocking)"""
+    return service.events().list(**params).execute()
+
+
+async def _list_events(service, calendar_id: str, sync_token: Optional[str], time_min: Optional[str]):
+    """All pages of events.list, each one a sync_call. Returns (items, next_sync_token)."""
+    from utils.google_calendar import sync_call
+
+    params = {'calendarId': calendar_id, 'singleEvents': True, 'maxResults': 2500, 'fields': EVENT_FIELDS}
+    if sync_token:
+        params['syncToken'] = sync_token
+    else:
+        params['timeMin'] = time_min
+    items = []
+    while True:
+        result = await sync_call(_list_page, service, dict(params))
+        items.extend(result.get('items', []))
+        if not result.get('nextPageToken'):
+            return items, result.get('nextSyncToken')
+        params['pageToken'] = result['nextPageToken']
+
+
+class CalendarBusyCache:
+    def __init__(self, refresh_seconds: int = CALENDAR_SYNC_SECONDS, lookback_days: int = CALENDAR_LOOKBACK_DAYS,
+                 get_service=None, read_timeout: float = CALENDAR_READ_TIMEOUT):
+        self.refresh_seconds = refresh_seconds
+        self.lookback_days = lookback_days
+        self.read_timeout = read_timeout
+        self._get_service = get_service
+        self._calendars: Dict[str, CalendarState] = {}
+        self.full_syncs = 0
+        self.incremental_syncs = 0
+        self.sync_errors = 0
+        self.stale_served = 0
+
+    async def get_busy(self, calendar_id: str, ts_from: int, ts_to: int) -> List[Interval]:
+        """
+        Busy intervals overlapping [ts_from, ts_to). Stale data is served at once
+        while one background refresh runs; only a calendar that was never synced
+        waits for Google (bounded by the read deadline).
+        """
+        cal = self._state(calendar_id)
+        if not cal.loaded:
+            async with cal.lock:
+                if not cal.loaded:
+                    await self._load(cal)
+        if cal.is_stale(self.refresh_seconds):
+            if cal.sync_token:
+                self.stale_served += 1
+                self._revalidate(cal)
+            else:
+                # Never synced: wait up to the read deadline, the sync goes on in the background
+                self._revalidate(cal)
+                try:
+                    await asyncio.wait_for(asyncio.shield(cal.refresh_task), self.read_timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+        # Intervals starting before ts_to; long events may start well before ts_from
+        end = bisect.bisect_left(cal.starts, ts_to)
+        return [(start, stop) for start, stop in cal.intervals[:end] if stop > ts_from]
+
+    def is_warm(self, calendar_id: str) -> bool:
+        """Synced at least once, so reads are served from memory"""
+        cal = self._calendars.get(calendar_id)
+        return bool(cal and cal.loaded and cal.sync_token)
+
+    def warm_up(self, calendar_id: str):
+        """Start the first sync of a calendar in the background"""
+        self._revalidate(self._state(calendar_id))
+
+    def invalidate(self, calendar_id: str):
+        """Refresh on the next read (the bot itself just changed the calendar)"""
+        cal = self._calendars.get(calendar_id)
+        if cal:
+            cal.synced_at = None
+
+    async def refresh(self, calendar_id: str):
+        """Sync now and wait for it"""
+        self.invalidate(calendar_id)
+        await self._refresh(self._state(calendar_id))
+
+    def stats(self) -> dict:
+        return {
+            "calendars": len(self._calendars),
+            "events": sum(len(cal.events) for cal in self._calendars.values()),
+            "full_syncs": self.full_syncs,
+            "incremental_syncs": self.incremental_syncs,
+            "sync_errors": self.sync_errors,
+            "stale_served": self.stale_served,
+            "refreshing": sum(1 for cal in self._calendars.values() if cal.refresh_task and not cal.refresh_task.done()),
+        }
+
+    def _state(self, calendar_id: str) -> CalendarState:
+        cal = self._calendars.get(calendar_id)
+        if cal is None:
+            cal = self._calendars[calendar_id] = CalendarState(calendar_id)
+        return cal
+
+    def _revalidate(self, cal: CalendarState):
+        """At most one background refresh per calendar"""
+        if cal.refresh_task is None or cal.refresh_task.done():
+            cal.refresh_task = asyncio.create_task(self._refresh(cal))
+
+    async def _service(self):
+        if self._get_service is None:
+            from utils.google_calendar import get_calendar_service
+            self._get_service = get_calendar_service
+        return await self._get_service()
+
+    async def _refresh(self, cal: CalendarState):
+        async with cal.lock:
+            # Another request may have refreshed it while we waited
+            if not cal.is_stale(self.refresh_seconds):
+                return
+            from utils.google_calendar import CalendarUnavailable
+            try:
+                if not cal.loaded:
+                    await self._load(cal)
+                service = await self._service()
+                if not service:
+                    raise CalendarUnavailable("no service")
+                try:
+                    await self._sync(service, cal, full=not cal.sync_token)
+                except SyncTokenExpired:
+                    logging.info(f"Google Calendar: sync token expired for {cal.calendar_id}, full resync")
+                    await self._sync(service, cal, full=True)
+                cal.last_error = None
+            except Exception as e:
+                # Serve what we have; try again on the next read after the refresh interval.
+                # Outages are counted (read_stats); other errors logged once per change
+                self.sync_errors += 1
+                cal.synced_at = time.monotonic()
+                if not isinstance(e, CalendarUnavailable) and str(e) != cal.last_error:
+                    logging.error(f"Google Calendar: sync of {cal.calendar_id} failed: {e}")
+                cal.last_error = str(e)
+
+    async def _sync(self, service, cal: CalendarState, full: bool):
+        time_min = None
+        if full:
+            time_min = (datetime.now().astimezone() - timedelta(days=self.lookback_days)).isoformat()
+        try:
+            items, next_token = await _list_events(service, cal.calendar_id, None if full else cal.sync_token, time_min)
+        except Exception as e:
+            if not full and getattr(getattr(e, 'resp', None), 'status', None) == 410:
+                raise SyncTokenExpired() from e
+            raise
+
+        changed = {}
+        removed = []
+        for event in items:
+            interval = parse_event(event) if event.get('status') != 'cancelled' else None
+            if interval:
+                changed[event['id']] = interval
+            else:
+                removed.append(event['id'])
+
+        if full:
+            cal.events = changed
+            self.full_syncs += 1
+        else:
+            for event_id in removed:
+                cal.events.pop(event_id, None)
+            cal.events.update(changed)
+            self.incremental_syncs += 1
+        cal.sync_token = next_token
+        cal.rebuild()
+        cal.synced_at = time.monotonic()
+        await self._save(cal, full, changed, removed)
+
+    async def _load(self, cal: CalendarState):
+        """Restore the token and intervals persisted by a previous run"""
+        async with pool.read() as db:
+            async with db.execute(
+                "SELECT sync_token FROM calendar_sync WHERE calendar_id = ?", (cal.calendar_id,)
+            ) as cursor:
+                row = await cursor.fetchone()
+            async with db.execute(
+                "SELECT event_id, start_ts, end_ts FROM calendar_busy WHERE calendar_id = ?", (cal.calendar_id,)
+            ) as cursor:
+                rows = await cursor.fetchall()
+        if row:
+            cal.sync_token = row[0]
+            cal.events = {event_id: (start_ts, end_ts) for event_id, start_ts, end_ts in rows}
+            cal.rebuild()
+        cal.loaded = True
+
+    async def _save(self, cal: CalendarState, full: bool, changed: dict, removed: list):
+        async with pool.write() as db:
+            if full:
+                await db.execute("DELETE FROM calendar_busy WHERE calendar_id = ?", (cal.calendar_id,))
+            else:
+                await db.executemany(
+                    "DELETE FROM calendar_busy WHERE calendar_id = ? AND event_id = ?",
+                    [(cal.calendar_id, event_id) for event_id in removed]
+                )
+            await db.executemany(
+                "INSERT OR REPLACE INTO calendar_busy (calendar_id, event_id, start_ts, end_ts) VALUES (?, ?, ?, ?)",
+                [(cal.calendar_id, event_id, start, end) for event_id, (start, end) in changed.items()]
+            )
+            await db.execute(
+                "INSERT OR REPLACE INTO calendar_sync (calendar_id, sync_token, synced_at) VALUES (?, ?, ?)",
+                (cal.calendar_id, cal.sync_token, datetime.now().isoformat())
+            )
+
+
+busy_cache = CalendarBusyCache()
@@ -0,0 +1,229 @@
+"""
+Google Calendar outbox.
+
+Calendar writes never run on the booking path. book_slot queues a 'create'
+job; cancelling or deleting a booking queues a 'delete' of the event stored
+on the slot — each in the transaction of the booking change itself
+(database/db_cmds.py), so a crash can't separate the two. A background worker sends due jobs in batches — one
+BatchHttpRequest round trip for up to CALENDAR_OUTBOX_BATCH jobs — stores
+created event IDs on the slots and retries failures with exponential backoff.
+After CALENDAR_OUTBOX_MAX_ATTEMPTS a job is parked (next_attempt_ts = NULL)
+and the admin is told once.
+"""
+import asyncio
+import json
+import logging
+from datetime import datetime
+from typing import Optional
+
+from config import (
+    ADMIN_ID, CALENDAR_OUTBOX_BATCH, CALENDAR_OUTBOX_POLL_SECONDS,
+    CALENDAR_OUTBOX_MAX_ATTEMPTS, CALENDAR_OUTBOX_RETRY_SECONDS
+)
+from database.setup import pool
+from database.versions import shared_versions
+from utils.messenger import messenger, Priority
+from utils.slot_time import to_ts
+
+# Deleting an event that is already gone counts as done
+GONE_STATUSES = (404, 410)
+
+ACTIONS_RU = {"create": "создать", "delete": "удалить"}
+
+JOB_COLUMNS = "id, slot_id, action, calendar_id, event_id, body, attempts"
+
+# Shared version key bumped by processes that queue jobs without running the worker
+OUTBOX_KEY = "outbox"
+
+
+def _http_status(error) -> Optional[int]:
+    return getattr(getattr(error, 'resp', None), 'status', None)
+
+
+def _execute_batch(service, jobs) -> dict:
+    """One HTTP round trip for all jobs (blocking). Returns {job_id: (response, exception)}."""
+    results = {}
+
+    def callback(request_id, response, exception):
+        results[int(request_id)] = (response, exception)
+
+    batch = service.new_batch_http_request(callback=callback)
+    for job_id, slot_id, action, calendar_id, event_id, body, attempts in jobs:
+        events = service.events()
+        if action == 'create':
+            request = events.insert(calendarId=calendar_id, body=json.loads(body))
+        else:
+            request = events.delete(calendarId=calendar_id, eventId=event_id)
+        batch.add(request, request_id=str(job_id))
+    batch.execute()
+    return results
+
+
+class CalendarOutbox:
+    def __init__(self, batch_size: int = CALENDAR_OUTBOX_BATCH, poll_seconds: float = CALENDAR_OUTBOX_POLL_SECONDS,
+                 max_attempts: int = CALENDAR_OUTBOX_MAX_ATTEMPTS, retry_seconds: int = CALENDAR_OUTBOX_RETRY_SECONDS,
+                 get_service=None):
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.max_attempts = max_attempts
+        self.retry_seconds = retry_seconds
+        self._get_service = get_service
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._stopping = False
+        self.processed = 0
+        self.retried = 0
+        self.failed = 0
+        self.batches = 0
+
+    def start(self):
+        """Start the background worker (call once the event loop is running)"""
+        if self._task is None:
+            self._stopping = False
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+            logging.info(f"Calendar outbox: batches of {self.batch_size}, up to {self.max_attempts} attempts")
+
+    async def stop(self, timeout: float = 10.0):
+        """Let the batch in flight finish (up to timeout), then stop. Queued jobs stay in the database."""
+        if self._task is None:
+            return
+        self._stopping = True
+        self.wake()
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            logging.warning("Calendar outbox: batch still in flight at shutdown, will be retried")
+        self._task = None
+        self._wake = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None
+
+    def wake(self):
+        """New job queued: don't wait for the next poll"""
+        if self._wake:
+            self._wake.set()
+        else:
+            # The worker runs in another process (utils/workers.py)
+            shared_versions.publish(OUTBOX_KEY)
+
+    async def stats(self) -> dict:
+        async with pool.read() as db:
+            # ">= 0" rather than "IS NOT NULL" so the range is read from idx_calendar_outbox_due
+            async with db.execute(
+                "SELECT COUNT(*), MIN(created_ts) FROM calendar_outbox WHERE next_attempt_ts >= 0"
+            ) as cursor:
+                pending, oldest_ts = await cursor.fetchone()
+            async with db.execute("SELECT COUNT(*) FROM calendar_outbox WHERE next_attempt_ts IS NULL") as cursor:
+                parked = (await cursor.fetchone())[0]
+        return {
+            "pending": pending,
+            "parked": parked,
+            "lag_seconds": to_ts(datetime.now()) - oldest_ts if oldest_ts else 0,
+            "processed": self.processed,
+            "retried": self.retried,
+            "failed": self.failed,
+            "batches": self.batches,
+        }
+
+    async def _service(self):
+        if self._get_service is None:
+            from utils.google_calendar import get_calendar_service
+            self._get_service = get_calendar_service
+        return await self._get_service()
+
+    async def _run(self):
+        while not self._stopping:
+            # Cleared before the query, so a job queued while a batch is in flight still wakes us
+            self._wake.clear()
+            try:
+                sent = await self.process_due()
+            except Exception as e:
+                logging.exception(f"Calendar outbox: unexpected error: {e}")
+                sent = 0
+            if not sent and not self._stopping:
+                # Nothing due: sleep until a new job or the next poll (retries come due on their own)
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def process_due(self) -> int:
+        """Send one batch of due jobs. Returns the number of jobs sent."""
+        async with pool.read() as db:
+            async with db.execute(
+                f"SELECT {JOB_COLUMNS} FROM calendar_outbox WHERE next_attempt_ts <= ? ORDER BY next_attempt_ts LIMIT ?",
+                (to_ts(datetime.now()), self.batch_size)
+            ) as cursor:
+                jobs = await cursor.fetchall()
+        if not jobs:
+            return 0
+
+        try:
+            service = await self._service()
+            if not service:
+                raise Exception("Google Calendar service unavailable")
+            results = await asyncio.to_thread(_execute_batch, service, jobs)
+            self.batches += 1
+        except Exception as e:
+            results = {job[0]: (None, e) for job in jobs}
+        await self._apply(jobs, results)
+        return len(jobs)
+
+    async def _apply(self, jobs, results: dict):
+        now_ts = to_ts(datetime.now())
+        alerts = []
+        calendars = set()
+        async with pool.write() as db:
+            for job_id, slot_id, action, calendar_id, event_id, body, attempts in jobs:
+                response, error = results.get(job_id, (None, Exception("no response in batch")))
+                if error is not None and not (action == 'delete' and _http_status(error) in GONE_STATUSES):
+                    attempts += 1
+                    if attempts >= self.max_attempts:
+                        next_attempt_ts = None
+                        self.failed += 1
+                        alerts.append(f"⚠️ Ошибка Google Calendar: не удалось {ACTIONS_RU.get(action, action)} "
+                                      f"событие (слот {slot_id}) за {attempts} попыток: {error}")
+                    else:
+                        next_attempt_ts = now_ts + self.retry_seconds * 2 ** (attempts - 1)
+                        self.retried += 1
+                    await db.execute(
+                        "UPDATE calendar_outbox SET attempts = ?, next_attempt_ts = ?, last_error = ? WHERE id = ?",
+                        (attempts, next_attempt_ts, str(error)[:500], job_id)
+                    )
+                    continue
+
+                self.processed += 1
+                calendars.add(calendar_id)
+                if action == 'create':
+                    await self._created(db, job_id, slot_id, calendar_id, (response or {}).get('id'), now_ts)
+                else:
+                    await db.execute("DELETE FROM calendar_outbox WHERE id = ?", (job_id,))
+
+        from utils.calendar_cache import busy_cache
+        for calendar_id in calendars:
+            busy_cache.invalidate(calendar_id)
+        for text in alerts:
+            logging.error(text)
+            messenger.send(ADMIN_ID, text, priority=Priority.LOW)
+
+    async def _created(self, db, job_id, slot_id, calendar_id, event_id, now_ts):
+        """Store the new event on the slot, unless the booking was cancelled while it was being created"""
+        cursor = await db.execute("DELETE FROM calendar_outbox WHERE id = ?", (job_id,))
+        if cursor.rowcount:
+            await db.execute(
+                "UPDATE slots SET gcal_calendar_id = ?, gcal_event_id = ? WHERE id = ?", (calendar_id, event_id, slot_id)
+            )
+            return
+
+        # The booking was cancelled meanwhile: remove the event again
+        await db.execute(
+            "INSERT INTO calendar_outbox (slot_id, action, calendar_id, event_id, attempts, next_attempt_ts, created_ts) "
+            "VALUES (?, 'delete', ?, ?, 0, ?, ?)",
+            (slot_id, calendar_id, event_id, now_ts, now_ts)
+        )
+
+
+outbox = CalendarOutbox()
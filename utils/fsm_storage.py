@@ -0,0 +1,268 @@
+"""
+FSM storage in SQLite with an in-memory write-back tier.
+
+aiogram's MemoryStorage loses every booking/template flow in progress on a
+restart (update.sh stops and starts the service). SQLiteStorage keeps the
+same dictionaries in memory, so get_state/get_data stay dictionary lookups,
+and only remembers which sessions changed. FSMFlushMiddleware writes them
+after each update — the several update_data() calls of one handler end up
+in a single transaction — and close() (called by the dispatcher on
+shutdown) writes whatever is left.
+
+warm() loads the table at startup; after that a session missing from memory
+is simply empty and needs no query. A worker process (utils/workers.py)
+loads only the chats routed to it — nobody else writes them.
+
+Clients often leave a flow halfway. A background sweeper clears sessions
+nobody touched for their state group's TTL (FSM_SESSION_TTL_MINUTES,
+overridden per group by FSM_STATE_TTL_MINUTES) and drops cleared sessions
+from memory, so the footprint follows the active users only.
+"""
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from aiogram.types import TelegramObject
+
+from config import FSM_SESSION_TTL_MINUTES, FSM_STATE_TTL_MINUTES, FSM_SWEEP_MINUTES
+from database.setup import pool
+from utils.slot_time import to_ts
+
+
+def parse_state_ttls(value: Optional[str]) -> Dict[str, float]:
+    """'BookingStates=180, TemplateStates=720' -> {group: minutes}"""
+    ttls = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            group, minutes = item.split("=", 1)
+            ttls[group.strip()] = float(minutes)
+    return ttls
+
+
+def chat_id_of(key: str) -> int:
+    """Chat of a storage key string ('fsm:<bot_id>:<chat_id>:<user_id>:<destiny>')"""
+    return int(key.split(":")[2])
+
+
+class Session:
+    __slots__ = ("state", "data", "touched")
+
+    def __init__(self, state: Optional[str], data: Dict[str, Any], touched: float):
+        self.state = state
+        self.data = data
+        self.touched = touched  # time.monotonic() of the last access
+
+    def is_empty(self) -> bool:
+        return self.state is None and not self.data
+
+
+class SQLiteStorage(BaseStorage):
+    def __init__(self, ttl_minutes: float = FSM_SESSION_TTL_MINUTES, state_ttls: Optional[Dict[str, float]] = None,
+                 sweep_minutes: float = FSM_SWEEP_MINUTES):
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        # TTL in minutes, 0 = never expire
+        self.ttl_minutes = ttl_minutes
+        self.state_ttls = parse_state_ttls(FSM_STATE_TTL_MINUTES) if state_ttls is None else state_ttls
+        self.sweep_minutes = sweep_minutes
+        # storage key string -> Session
+        self._sessions: Dict[str, Session] = {}
+        self._dirty = set()
+        self._loaded = False
+        self._task: Optional[asyncio.Task] = None
+        self.loads = 0
+        self.flushes = 0
+        self.rows_written = 0
+        self.flush_errors = 0
+        self.expired = 0
+
+    async def warm(self, owns: Optional[Callable[[int], bool]] = None):
+        """Load stored sessions (call once at startup, after init_db); owns(chat_id) picks this worker's chats"""
+        async with pool.read() as db:
+            async with db.execute("SELECT key, state, data, updated_ts FROM fsm_sessions") as cursor:
+                rows = await cursor.fetchall()
+        now, now_ts = time.monotonic(), to_ts(datetime.now())
+        if owns is not None:
+            rows = [row for row in rows if owns(chat_id_of(row[0]))]
+        for key, state, data, updated_ts in rows:
+            # Idle time carries over the restart
+            touched = now - max(0, now_ts - (updated_ts or now_ts))
+            self._sessions.setdefault(key, Session(state, json.loads(data) if data else {}, touched))
+        self._loaded = True
+        logging.info(f"FSM storage: {len(rows)} sessions restored")
+        # Sessions that went idle while the bot was down
+        await self.sweep()
+
+    def start(self):
+        """Start the idle-session sweeper (call once the event loop is running)"""
+        if self._task is None and self.sweep_minutes > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    # --- BaseStorage ---
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        name = self.key_builder.build(key)
+        session = await self._session(name)
+        session.state = state.state if isinstance(state, State) else state
+        self._dirty.add(name)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._session(self.key_builder.build(key))).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        name = self.key_builder.build(key)
+        session = await self._session(name)
+        session.data = data.copy()
+        self._dirty.add(name)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._session(self.key_builder.build(key))).data.copy()
+
+    async def close(self) -> None:
+        await self.stop()
+        await self.flush()
+
+    # --- Write-back ---
+    async def flush(self) -> int:
+        """Write changed sessions in one transaction. Returns the number of rows written."""
+        if not self._dirty:
+            return 0
+        keys, self._dirty = self._dirty, set()
+        now_ts = to_ts(datetime.now())
+        upserts, deletes = [], []
+        for name in keys:
+            session = self._sessions.get(name)
+            if session is None or session.is_empty():
+                deletes.append((name,))
+            else:
+                upserts.append((name, session.state, json.dumps(session.data, ensure_ascii=False), now_ts))
+        try:
+            async with pool.write() as db:
+                if upserts:
+                    await db.executemany(
+                        "INSERT INTO fsm_sessions (key, state, data, updated_ts) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data, "
+                        "updated_ts = excluded.updated_ts",
+                        upserts
+                    )
+                if deletes:
+                    await db.executemany("DELETE FROM fsm_sessions WHERE key = ?", deletes)
+        except Exception as e:
+            # Keep them dirty: the next flush retries
+            self._dirty |= keys
+            self.flush_errors += 1
+            logging.error(f"FSM storage: cannot save {len(keys)} sessions: {e}")
+            return 0
+        self.flushes += 1
+        self.rows_written += len(keys)
+        return len(keys)
+
+    async def _session(self, name: str) -> Session:
+        session = self._sessions.get(name)
+        if session is None:
+            state, data = None, {}
+            if not self._loaded:
+                async with pool.read() as db:
+                    async with db.execute("SELECT state, data FROM fsm_sessions WHERE key = ?", (name,)) as cursor:
+                        row = await cursor.fetchone()
+                self.loads += 1
+                if row:
+                    state, data = row[0], json.loads(row[1]) if row[1] else {}
+            # A write may have landed while we were reading
+            session = self._sessions.setdefault(name, Session(state, data, time.monotonic()))
+        session.touched = time.monotonic()
+        return session
+
+    # --- Expiry ---
+    def ttl_seconds(self, state: Optional[str]) -> float:
+        group = state.split(":", 1)[0] if state else None
+        return self.state_ttls.get(group, self.ttl_minutes) * 60
+
+    async def sweep(self) -> int:
+        """Clear sessions idle longer than their TTL, drop empty ones from memory. Returns the number cleared."""
+        now = time.monotonic()
+        expired = 0
+        for name, session in list(self._sessions.items()):
+            if name in self._dirty:
+                continue
+            if session.is_empty():
+                del self._sessions[name]
+                continue
+            ttl = self.ttl_seconds(session.state)
+            if ttl and now - session.touched > ttl:
+                session.state, session.data = None, {}
+                self._dirty.add(name)
+                expired += 1
+        if expired:
+            self.expired += expired
+            logging.info(f"FSM storage: {expired} idle sessions expired")
+            await self.flush()
+            # Gone from the table now; forget them unless touched again meanwhile
+            for name, session in list(self._sessions.items()):
+                if session.is_empty() and name not in self._dirty:
+                    del self._sessions[name]
+        return expired
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sweep_minutes * 60)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logging.exception(f"FSM storage: sweep failed: {e}")
+
+    def stats(self) -> dict:
+        """Live sessions and their approximate size (key + serialized data), in total and per state"""
+        by_state: Dict[str, list] = {}
+        total_bytes = 0
+        for name, session in self._sessions.items():
+            if session.is_empty():
+                continue
+            size = len(name) + len(session.state or "") + len(json.dumps(session.data, ensure_ascii=False))
+            total_bytes += size
+            entry = by_state.setdefault(session.state or "-", [0, 0])
+            entry[0] += 1
+            entry[1] += size
+        stats = {
+            "sessions": sum(count for count, _ in by_state.values()),
+            "bytes": total_bytes,
+            "dirty": len(self._dirty),
+            "expired": self.expired,
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "flush_errors": self.flush_errors,
+            "loads": self.loads,
+        }
+        for state, (count, size) in sorted(by_state.items()):
+            stats[state] = f"{count} ({size} B)"
+        return stats
+
+
+class FSMFlushMiddleware(BaseMiddleware):
+    """Outer update middleware: write the sessions an update changed once it's handled"""
+
+    def __init__(self, storage: SQLiteStorage):
+        self.storage = storage
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        try:
+            return await handler(event, data)
+        finally:
+            await self.storage.flush()
+
+
+fsm_storage = SQLiteStorage()
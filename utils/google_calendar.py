@@ -1,10 +1,20 @@
 import os
 import asyncio
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
 from google.oauth2 import service_account
 
+from config import (
+    CALENDAR_READ_TIMEOUT, CALENDAR_HTTP_TIMEOUT, CALENDAR_READ_THREADS,
+    CALENDAR_SYNC_TIMEOUT, CALENDAR_SYNC_THREADS,
+    CALENDAR_BREAKER_FAILURES, CALENDAR_BREAKER_RESET_SECONDS
+)
+
 SCOPES = ['https://www.googleapis.com/auth/calendar']
 
 # Build absolute path to google_key.json relative to this file's parent directory
@@ -14,6 +24,129 @@ SERVICE_ACCOUNT_FILE = os.path.join(BASE_DIR, 'google_key.json')
 # Module-level cache: build the service once, reuse it forever
 _service_cache = None
 
+# freeBusy rejects long ranges; longer windows are split into chunks of this size
+FREEBUSY_MAX_DAYS = 60
+
+# Reads run in their own small pool: calls hanging on a slow Google can't
+# starve the default executor the rest of the bot uses
+_read_executor = ThreadPoolExecutor(max_workers=CALENDAR_READ_THREADS, thread_name_prefix="gcal-read")
+# Background syncs get their own: a long first sync doesn't hold a read thread
+_sync_executor = ThreadPoolExecutor(max_workers=CALENDAR_SYNC_THREADS, thread_name_prefix="gcal-sync")
+
+
+class CalendarUnavailable(Exception):
+    """The read was not made (breaker open) or did not finish in time"""
+
+
+class CircuitBreaker:
+    """
+    closed -> open after `failure_threshold` consecutive failures; while open,
+    calls are refused at once. After `reset_seconds` one trial call goes
+    through (half-open): success closes the breaker, failure opens it again.
+    """
+    def __init__(self, failure_threshold: int = CALENDAR_BREAKER_FAILURES,
+                 reset_seconds: float = CALENDAR_BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+            self.state = "half_open"
+            return True
+        return False
+
+    def is_open(self) -> bool:
+        """Open and not yet due a trial call"""
+        return self.state == "open" and time.monotonic() - self.opened_at < self.reset_seconds
+
+    def record_success(self):
+        if self.state != "closed":
+            logging.info("Google Calendar: reads recovered, circuit closed")
+        self.state = "closed"
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.opens += 1
+                logging.warning(f"Google Calendar: {self.failures} failed reads, circuit open for {self.reset_seconds}s")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+
+read_breaker = CircuitBreaker()
+read_stats = {"calls": 0, "timeouts": 0, "errors": 0, "short_circuited": 0,
+              "sync_calls": 0, "sync_timeouts": 0, "sync_errors": 0}
+
+
+def _is_outage(error: Exception) -> bool:
+    """Timeouts, network errors, 5xx and 429 say Google is unhealthy; other 4xx are about the request"""
+    status = getattr(getattr(error, 'resp', None), 'status', None)
+    return status is None or status >= 500 or status == 429
+
+
+async def read_call(func, *args):
+    """
+    Run a blocking Calendar read in the read pool, bounded by CALENDAR_READ_TIMEOUT
+    and guarded by the circuit breaker. Raises CalendarUnavailable instead of waiting.
+    """
+    if not read_breaker.allow():
+        read_stats["short_circuited"] += 1
+        raise CalendarUnavailable("circuit open")
+    read_stats["calls"] += 1
+    loop = asyncio.get_running_loop()
+    try:
+        result = await asyncio.wait_for(loop.run_in_executor(_read_executor, func, *args), CALENDAR_READ_TIMEOUT)
+    except asyncio.TimeoutError:
+        read_stats["timeouts"] += 1
+        read_breaker.record_failure()
+        raise CalendarUnavailable(f"no answer in {CALENDAR_READ_TIMEOUT:g}s")
+    except Exception as e:
+        if _is_outage(e):
+            read_stats["errors"] += 1
+            read_breaker.record_failure()
+        else:
+            read_breaker.record_success()
+        raise
+    read_breaker.record_success()
+    return result
+
+
+async def sync_call(func, *args):
+    """
+    Run a blocking background read (a cache sync page) in the sync pool, bounded by
+    CALENDAR_SYNC_TIMEOUT. No client waits on it, so its timeouts and errors don't
+    count toward the breaker; it only stays away while the breaker is open, and an
+    answer closes it.
+    """
+    if read_breaker.is_open():
+        read_stats["short_circuited"] += 1
+        raise CalendarUnavailable("circuit open")
+    read_stats["sync_calls"] += 1
+    loop = asyncio.get_running_loop()
+    try:
+        result = await asyncio.wait_for(loop.run_in_executor(_sync_executor, func, *args), CALENDAR_SYNC_TIMEOUT)
+    except asyncio.TimeoutError:
+        read_stats["sync_timeouts"] += 1
+        raise CalendarUnavailable(f"no answer in {CALENDAR_SYNC_TIMEOUT:g}s")
+    except Exception as e:
+        if _is_outage(e):
+            read_stats["sync_errors"] += 1
+        raise
+    read_breaker.record_success()
+    return result
+
+
+def calendar_read_stats() -> dict:
+    return dict(read_stats, breaker=read_breaker.state, breaker_opens=read_breaker.opens)
+
 
 def _build_service_sync():
     """
@@ -31,8 +164,10 @@ def _build_service_sync():
     try:
         creds = service_account.Credentials.from_service_account_file(
             SERVICE_ACCOUNT_FILE, scopes=SCOPES)
+        # Socket timeout, so a hung request eventually frees its thread
+        http = AuthorizedHttp(creds, http=httplib2.Http(timeout=CALENDAR_HTTP_TIMEOUT))
         # static_discovery=False avoids downloading the discovery document from Google
-        _service_cache = build('calendar', 'v3', credentials=creds, static_discovery=False)
+        _service_cache = build('calendar', 'v3', http=http, static_discovery=False)
         logging.info("Google Calendar: service built and cached successfully.")
         return _service_cache
     except Exception as e:
@@ -47,15 +182,49 @@ async def get_calendar_service():
 
 async def get_occupied_slots_range(calendar_id: str, date_from: str, date_to: str) -> list:
     """
-    Fetches ALL events from Google Calendar in a date range with ONE API call.
+    Busy events of a calendar in a date range, served from the synced cache
+    (utils/calendar_cache.py) — no API call unless the cache is due a refresh.
     date_from / date_to format: 'YYYY-MM-DD'
     Returns a list of (date_str, start_time, end_time) tuples in MOSCOW TIME,
     e.g. [('2026-03-25', '14:00', '15:00'), ...]
     ALWAYS returns [] on any error.
     """
     from datetime import timezone
+    from utils.calendar_cache import busy_cache
     MOSCOW_TZ = timezone(timedelta(hours=3))
 
+    try:
+        ts_from = int(datetime.fromisoformat(f"{date_from}T00:00:00+03:00").timestamp())
+        ts_to = int(datetime.fromisoformat(f"{date_to}T00:00:00+03:00").timestamp()) + 86400
+        busy = await busy_cache.get_busy(calendar_id, ts_from, ts_to)
+    except Exception as e:
+        logging.error(f"Google Calendar: error fetching range {date_from}–{date_to}: {e}")
+        return []
+
+    occupied = []
+    for start_ts, end_ts in busy:
+        start_moscow = datetime.fromtimestamp(start_ts, MOSCOW_TZ)
+        end_moscow = datetime.fromtimestamp(end_ts, MOSCOW_TZ)
+        occupied.append((start_moscow.strftime('%Y-%m-%d'), start_moscow.strftime('%H:%M'), end_moscow.strftime('%H:%M')))
+    return occupied
+
+
+def split_calendar_ids(value) -> list:
+    """
+    masters.google_calendar_id may list several calendars separated by commas
+    (personal, salon, ...). The first one is where bot bookings are written.
+    """
+    return [cal_id.strip() for cal_id in (value or '').split(',') if cal_id.strip()]
+
+
+def _to_ts(value: str) -> int:
+    return int(datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp())
+
+
+async def _query_freebusy(calendar_ids: list, ts_from: int, ts_to: int) -> list:
+    """Busy periods of the calendars from freeBusy — one request per FREEBUSY_MAX_DAYS"""
+    from datetime import timezone
+
     try:
         service = await get_calendar_service()
         if not service:
@@ -64,50 +233,60 @@ async def get_occupied_slots_range(calendar_id: str, date_from: str, date_to: st
         logging.warning(f"Google Calendar: service unavailable: {e}")
         return []
 
-    try:
-        # Query in Moscow timezone so we don't miss events at day boundaries
-        time_min = f"{date_from}T00:00:00+03:00"
-        time_max = f"{date_to}T23:59:59+03:00"
-
-        def _fetch():
-            return service.events().list(
-                calendarId=calendar_id,
-                timeMin=time_min,
-                timeMax=time_max,
-                singleEvents=True,
-                orderBy='startTime'
-            ).execute()
-
-        events_result = await asyncio.to_thread(_fetch)
-        events = events_result.get('items', [])
-        occupied = []
-
-        for event in events:
-            start = event['start'].get('dateTime', '')
-            end = event['end'].get('dateTime', '')
-            if not start or 'T' not in start:
-                # All-day event — skip
-                continue
-            try:
-                # Parse with timezone and convert to Moscow time
-                start_dt = datetime.fromisoformat(start.replace('Z', '+00:00'))
-                end_dt = datetime.fromisoformat(end.replace('Z', '+00:00'))
-                start_moscow = start_dt.astimezone(MOSCOW_TZ).replace(tzinfo=None)
-                end_moscow = end_dt.astimezone(MOSCOW_TZ).replace(tzinfo=None)
-
-                date_part = start_moscow.strftime('%Y-%m-%d')
-                start_time = start_moscow.strftime('%H:%M')
-                end_time = end_moscow.strftime('%H:%M')
-                occupied.append((date_part, start_time, end_time))
-            except Exception as ex:
-                logging.warning(f"Google Calendar: could not parse event time '{start}': {ex}")
-                continue
-
-        return occupied
+    def _fetch(start_ts, end_ts):
+        body = {
+            'timeMin': datetime.fromtimestamp(start_ts, timezone.utc).isoformat(),
+            'timeMax': datetime.fromtimestamp(end_ts, timezone.utc).isoformat(),
+            'items': [{'id': cal_id} for cal_id in calendar_ids],
+        }
+        return service.freebusy().query(body=body).execute()
 
+    busy = []
+    chunk_from = ts_from
+    try:
+        while chunk_from < ts_to:
+            chunk_to = min(ts_to, chunk_from + FREEBUSY_MAX_DAYS * 86400)
+            result = await read_call(_fetch, chunk_from, chunk_to)
+            for cal_id, calendar in result.get('calendars', {}).items():
+                if calendar.get('errors'):
+                    logging.warning(f"Google Calendar: freeBusy error for {cal_id}: {calendar['errors']}")
+                for period in calendar.get('busy', []):
+                    busy.append((_to_ts(period['start']), _to_ts(period['end'])))
+            chunk_from = chunk_to
+    except CalendarUnavailable:
+        pass  # counted in read_stats; the slots are shown without this calendar
     except Exception as e:
-        logging.error(f"Google Calendar: error fetching range {date_from}–{date_to}: {e}")
-        return []
+        logging.error(f"Google Calendar: freeBusy request for {', '.join(calendar_ids)} failed: {e}")
+    return busy
+
+
+async def get_busy_intervals(calendar_ids: list, ts_from: int, ts_to: int) -> list:
+    """
+    Merged busy intervals [(start_ts, end_ts), ...] of several calendars in [ts_from, ts_to).
+    Calendars not held by the sync cache go out in ONE freeBusy request (busy
+    periods only, no event bodies); the others are answered from memory, kept
+    current by incremental syncs that freeBusy can't do (utils/calendar_cache.py).
+    A calendar is synced in the background after its first freeBusy answer;
+    one shared as free/busy only can't be listed and stays on freeBusy.
+    ALWAYS returns what it could get, [] on errors.
+    """
+    from utils.availability import merge_intervals
+    from utils.calendar_cache import busy_cache
+
+    busy = []
+    cold = []
+    for cal_id in calendar_ids:
+        if busy_cache.is_warm(cal_id):
+            busy.extend(await busy_cache.get_busy(cal_id, ts_from, ts_to))
+        else:
+            cold.append(cal_id)
+
+    if cold:
+        busy.extend(await _query_freebusy(cold, ts_from, ts_to))
+        for cal_id in cold:
+            busy_cache.warm_up(cal_id)
+
+    return merge_intervals(busy)
 
 
 # Keep backward-compatible single-date version (used in some places)
@@ -120,48 +299,47 @@ async def get_occupied_slots(calendar_id: str, date_str: str) -> list:
     return [(s, e) for _, s, e in results]
 
 
+def build_event_body(start_dt: datetime, duration_minutes: int, client_name: str, service_name: str) -> dict:
+    """Calendar event for a booking; start_dt is local (Moscow) time"""
+    end_dt = start_dt + timedelta(minutes=duration_minutes)
+
+    def to_rfc3339(dt):
+        return dt.strftime('%Y-%m-%dT%H:%M:%S+03:00')
+
+    return {
+        'summary': f'{client_name} — {service_name}',
+        'description': f'Запись через Telegram-бот. Услуга: {service_name}',
+        'start': {'dateTime': to_rfc3339(start_dt), 'timeZone': 'Europe/Moscow'},
+        'end': {'dateTime': to_rfc3339(end_dt), 'timeZone': 'Europe/Moscow'},
+    }
+
+
 async def create_calendar_event(
     calendar_id: str,
-    date_str: str,       # 'DD.MM' format, e.g. '15.03'
-    time_str: str,       # 'HH:MM' format, e.g. '14:00'
+    start_dt: datetime,  # local (Moscow) start of the booking
     duration_minutes: int,
     client_name: str,
     service_name: str
 ):
     """
-    Creates an event in Google Calendar when a client books via the bot.
+    Creates an event in Google Calendar right away.
+    Bookings go through utils/calendar_outbox.py instead; this is for one-off use.
     Raises Exception on failure so the caller can notify the admin.
     """
     service = await get_calendar_service()
     if not service:
         raise Exception(f"Не удалось подключиться к Google Calendar (файл ключа: {SERVICE_ACCOUNT_FILE})")
 
-    now = datetime.now()
-    day, month = map(int, date_str.split('.'))
-    year = now.year
-    if month < now.month:
-        year += 1
-
-    hour, minute = map(int, time_str.split(':'))
-    start_dt = datetime(year, month, day, hour, minute)
-    end_dt = start_dt + timedelta(minutes=duration_minutes)
-
-    def to_rfc3339(dt):
-        return dt.strftime('%Y-%m-%dT%H:%M:%S+03:00')
-
-    event = {
-        'summary': f'{client_name} — {service_name}',
-        'description': f'Запись через Telegram-бот. Услуга: {service_name}',
-        'start': {'dateTime': to_rfc3339(start_dt), 'timeZone': 'Europe/Moscow'},
-        'end': {'dateTime': to_rfc3339(end_dt), 'timeZone': 'Europe/Moscow'},
-    }
+    event = build_event_body(start_dt, duration_minutes, client_name, service_name)
 
     def _insert():
         return service.events().insert(calendarId=calendar_id, body=event).execute()
 
     try:
         created = await asyncio.to_thread(_insert)
-        logging.info(f"Google Calendar: created event '{event['summary']}' at {to_rfc3339(start_dt)}")
+        from utils.calendar_cache import busy_cache
+        busy_cache.invalidate(calendar_id)
+        logging.info(f"Google Calendar: created event '{event['summary']}' at {event['start']['dateTime']}")
         return created.get('id')
     except Exception as e:
         raise Exception(f"Ошибка при создании события в Google Calendar: {e}")
@@ -0,0 +1,176 @@
+"""
+Leader election for background jobs.
+
+Several processes can work on one database: the workers of multi-worker
+mode (utils/workers.py), or two services pointed at the same file. Each one
+would otherwise send every reminder and every calendar write itself. The
+lease decides which process runs them.
+
+A lease is a row in the leases table: holder and expiry. Every
+LEADER_HEARTBEAT_SECONDS each process tries to claim it, inside a BEGIN
+IMMEDIATE transaction. That works when the lease is free, expired or
+already ours, and moves the expiry LEADER_LEASE_SECONDS ahead. The holder
+runs the on_acquired callbacks, which start the jobs. It steps down
+(on_lost) when a claim fails. It also steps down when the lease would
+expire before the next heartbeat could renew it, so it is already out by
+the time another process may take over. A clean stop releases the lease,
+and the next process picks it up within a heartbeat.
+
+Jobs registered through guard() also check the lease right before they
+run. A holder that stalled past its expiry skips them instead of running
+them next to the new one.
+"""
+import asyncio
+import functools
+import logging
+import os
+import socket
+import time
+from typing import Awaitable, Callable, List, Optional
+
+from config import LEADER_LEASE_SECONDS, LEADER_HEARTBEAT_SECONDS
+from database.setup import pool
+
+JOBS_LEASE = "jobs"
+
+
+class LeaderLease:
+    def __init__(self, name: str = JOBS_LEASE, lease_seconds: float = LEADER_LEASE_SECONDS,
+                 heartbeat_seconds: float = LEADER_HEARTBEAT_SECONDS, holder: Optional[str] = None):
+        self.name = name
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.holder = holder or f"{socket.gethostname()}:{os.getpid()}"
+        self.is_leader = False
+        # Wall clock (the lease row is compared across processes): our claim is good until then
+        self._valid_until = 0.0
+        self._on_acquired: List[Callable[[], Awaitable]] = []
+        self._on_lost: List[Callable[[], Awaitable]] = []
+        self._task: Optional[asyncio.Task] = None
+        self.term = 0
+        self.acquired = 0
+        self.lost = 0
+        self.skipped = 0
+        self.errors = 0
+
+    def on_acquired(self, callback: Callable[[], Awaitable]):
+        self._on_acquired.append(callback)
+
+    def on_lost(self, callback: Callable[[], Awaitable]):
+        self._on_lost.append(callback)
+
+    def holds(self) -> bool:
+        """This process holds the lease right now"""
+        return self.is_leader and time.time() < self._valid_until
+
+    async def start(self):
+        """Try to take the lease at once, then keep heartbeating"""
+        await self.heartbeat()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the jobs (if we run them) and hand the lease over"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.is_leader:
+            await self._step_down("shutdown")
+            try:
+                async with pool.write() as db:
+                    await db.execute(
+                        "UPDATE leases SET expires_at = 0 WHERE name = ? AND holder = ?", (self.name, self.holder)
+                    )
+            except Exception as e:
+                logging.error(f"Leader: cannot release lease '{self.name}': {e}")
+
+    async def heartbeat(self):
+        """Claim or renew the lease once; start or stop the jobs when that changes"""
+        now = time.time()
+        try:
+            claimed = await self._claim(now)
+        except Exception as e:
+            # Not known either way: keep running while our claim is still safely valid
+            self.errors += 1
+            logging.error(f"Leader: lease '{self.name}' heartbeat failed: {e}")
+            claimed = None
+        if claimed:
+            self._valid_until = now + self.lease_seconds
+            if not self.is_leader:
+                self.is_leader = True
+                self.acquired += 1
+                logging.info(f"Leader: {self.holder} took lease '{self.name}' (term {self.term})")
+                await self._notify(self._on_acquired)
+        elif self.is_leader and (claimed is False or time.time() + self.heartbeat_seconds >= self._valid_until):
+            await self._step_down("lease lost" if claimed is False else "cannot renew the lease")
+
+    async def _claim(self, now: float) -> bool:
+        async with pool.write() as db:
+            async with db.execute("SELECT holder, expires_at, term FROM leases WHERE name = ?", (self.name,)) as cursor:
+                row = await cursor.fetchone()
+            if row is None:
+                term = 1
+                await db.execute(
+                    "INSERT INTO leases (name, holder, expires_at, term) VALUES (?, ?, ?, ?)",
+                    (self.name, self.holder, now + self.lease_seconds, term)
+                )
+            elif row[0] == self.holder or row[1] < now:
+                # A new holder starts a new term
+                term = row[2] if row[0] == self.holder else row[2] + 1
+                await db.execute(
+                    "UPDATE leases SET holder = ?, expires_at = ?, term = ? WHERE name = ?",
+                    (self.holder, now + self.lease_seconds, term, self.name)
+                )
+            else:
+                return False
+        self.term = term
+        return True
+
+    async def _step_down(self, reason: str):
+        self.is_leader = False
+        self._valid_until = 0.0
+        self.lost += 1
+        logging.warning(f"Leader: {self.holder} gave up lease '{self.name}' ({reason})")
+        await self._notify(self._on_lost)
+
+    async def _notify(self, callbacks: List[Callable[[], Awaitable]]):
+        for callback in callbacks:
+            try:
+                await callback()
+            except Exception as e:
+                logging.exception(f"Leader: lease '{self.name}' callback failed: {e}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            await self.heartbeat()
+
+    def guard(self, job: Callable[..., Awaitable]) -> Callable[..., Awaitable]:
+        """Wrap a scheduled coroutine function: it runs only while we hold the lease"""
+        @functools.wraps(job)
+        async def guarded(*args, **kwargs):
+            if not self.holds():
+                self.skipped += 1
+                logging.warning(f"Leader: skipped {job.__name__}, lease '{self.name}' not held")
+                return None
+            return await job(*args, **kwargs)
+        return guarded
+
+    def stats(self) -> dict:
+        return {
+            "leader": self.is_leader,
+            "holder": self.holder,
+            "term": self.term,
+            "valid_for_s": round(max(0.0, self._valid_until - time.time()), 1) if self.is_leader else 0,
+            "acquired": self.acquired,
+            "lost": self.lost,
+            "skipped_jobs": self.skipped,
+            "errors": self.errors,
+        }
+
+
+leader = LeaderLease()
@@ -0,0 +1,251 @@
+"""
+Outbound message queue.
+
+Every notification the bot sends on its own (reminders, booking and cancel
+notices, admin alerts) goes through `messenger.send()` instead of calling
+bot.send_message directly. Messages wait in a priority queue and a few
+workers deliver them within Telegram's limits:
+  * a global token bucket (TG_GLOBAL_RATE messages/s),
+  * a token bucket per chat (TG_CHAT_RATE messages/s, bursts of TG_CHAT_BURST),
+  * on 429 the whole queue pauses for retry_after and the message is retried,
+  * network/server errors are retried with exponential backoff.
+Messages to chats that blocked the bot or don't exist are dropped and counted.
+
+Replies to the user's own action (message.answer, edit_text) stay direct.
+"""
+import asyncio
+import itertools
+import logging
+import time
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Dict, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+from config import TG_GLOBAL_RATE, TG_CHAT_RATE, TG_CHAT_BURST, TG_SEND_WORKERS, TG_SEND_RETRIES
+
+# Idle per-chat buckets are dropped once there are more than this many
+MAX_CHAT_BUCKETS = 10000
+
+
+class Priority(IntEnum):
+    HIGH = 0    # cancellations and new bookings
+    NORMAL = 1  # reminders
+    LOW = 2     # admin diagnostics
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Seconds until a token is available (0 if one is available now)"""
+        self._refill(time.monotonic())
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def reserve(self) -> float:
+        """Take a token, possibly on credit. Returns how long to wait before using it."""
+        wait = self.delay()
+        self.tokens -= 1
+        return wait
+
+    @property
+    def is_full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+@dataclass
+class OutboundMessage:
+    chat_id: int
+    text: str
+    kwargs: dict
+    priority: Priority
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.monotonic)
+    attempts: int = 0
+
+
+class Messenger:
+    def __init__(self, global_rate: float = TG_GLOBAL_RATE, chat_rate: float = TG_CHAT_RATE,
+                 chat_burst: int = TG_CHAT_BURST, workers: int = TG_SEND_WORKERS, retries: int = TG_SEND_RETRIES):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.workers = workers
+        self.retries = retries
+        self.bot: Optional[Bot] = None
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: Dict[int, TokenBucket] = {}
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._seq = itertools.count()
+        self._tasks = []
+        # Messages waiting out a backoff or retry_after: timer -> message
+        self._deferred: Dict[asyncio.TimerHandle, OutboundMessage] = {}
+        self._paused_until = 0.0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.rate_limited = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    def set_global_rate(self, rate: float):
+        """Change the bot-wide limit (each worker process gets its share of TG_GLOBAL_RATE)"""
+        self._global = TokenBucket(rate, rate)
+
+    @property
+    def is_running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self, bot: Bot):
+        """Start the delivery workers (call once the event loop is running)"""
+        self.bot = bot
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+            logging.info(f"Messenger: {self.workers} workers, {self._global.rate:g} msg/s global, {self.chat_rate:g} msg/s per chat")
+
+    async def stop(self, timeout: float = 10.0):
+        """Deliver what is queued (up to timeout), then stop the workers; what is left is dropped"""
+        if not self._tasks:
+            return
+        deadline = time.monotonic() + timeout
+        while (not self._queue.empty() or self._deferred) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for handle, item in self._deferred.items():
+            handle.cancel()
+            self._finish(item, False)
+        self._deferred.clear()
+        while not self._queue.empty():
+            _, _, item = self._queue.get_nowait()
+            self._finish(item, False)
+        logging.info(f"Messenger stopped: {self.stats()}")
+
+    def send(self, chat_id: int, text: str, priority: Priority = Priority.NORMAL, **kwargs) -> asyncio.Future:
+        """
+        Queue a message. Returns a future that resolves to True when delivered,
+        False when dropped; awaiting it is optional.
+        """
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+        future = asyncio.get_running_loop().create_future()
+        if not chat_id:
+            # e.g. ADMIN_ID not configured
+            future.set_result(False)
+            return future
+        self._put(OutboundMessage(chat_id, text, kwargs, priority, future))
+        return future
+
+    def stats(self) -> dict:
+        return {
+            "queued": (self._queue.qsize() if self._queue else 0) + len(self._deferred),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "rate_limited": self.rate_limited,
+            "avg_latency_ms": round(self._latency_total / self.sent * 1000, 1) if self.sent else 0.0,
+            "max_latency_ms": round(self._latency_max * 1000, 1),
+        }
+
+    def _put(self, item: OutboundMessage):
+        self._queue.put_nowait((item.priority, next(self._seq), item))
+
+    def _defer(self, item: OutboundMessage, delay: float):
+        """Put the message back after a delay without holding a worker"""
+        def put_back():
+            del self._deferred[handle]
+            self._put(item)
+
+        handle = asyncio.get_running_loop().call_later(delay, put_back)
+        self._deferred[handle] = item
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= MAX_CHAT_BUCKETS:
+                self._chats = {cid: b for cid, b in self._chats.items() if not b.is_full}
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _finish(self, item: OutboundMessage, delivered: bool):
+        if not item.future.done():
+            item.future.set_result(delivered)
+
+    async def _worker(self):
+        while True:
+            _, _, item = await self._queue.get()
+            try:
+                await self._deliver(item)
+            except asyncio.CancelledError:
+                self._put(item)
+                raise
+            except Exception as e:
+                logging.exception(f"Messenger: unexpected error for chat {item.chat_id}: {e}")
+                self.failed += 1
+                self._finish(item, False)
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, item: OutboundMessage):
+        # Per-chat limit: come back later instead of blocking a worker
+        chat_wait = self._chat_bucket(item.chat_id).delay()
+        if chat_wait > 0:
+            self._defer(item, chat_wait)
+            return
+        self._chat_bucket(item.chat_id).reserve()
+
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+        global_wait = self._global.reserve()
+        if global_wait > 0:
+            await asyncio.sleep(global_wait)
+
+        try:
+            await self.bot.send_message(item.chat_id, item.text, **item.kwargs)
+        except TelegramRetryAfter as e:
+            # Flood control: everyone waits, the message keeps its place
+            self.rate_limited += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+            logging.warning(f"Messenger: 429 for chat {item.chat_id}, pausing {e.retry_after}s")
+            self._defer(item, e.retry_after)
+            return
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # Bot blocked, chat not found, bad markup — retrying won't help
+            self.failed += 1
+            logging.warning(f"Messenger: message to {item.chat_id} dropped: {e}")
+            self._finish(item, False)
+            return
+        except Exception as e:
+            item.attempts += 1
+            if item.attempts > self.retries:
+                self.failed += 1
+                logging.error(f"Messenger: giving up on chat {item.chat_id} after {item.attempts} attempts: {e}")
+                self._finish(item, False)
+            else:
+                self.retried += 1
+                self._defer(item, min(2 ** item.attempts, 60))
+            return
+
+        latency = time.monotonic() - item.enqueued_at
+        self.sent += 1
+        self._latency_total += latency
+        self._latency_max = max(self._latency_max, latency)
+        self._finish(item, True)
+
+
+messenger = Messenger()
@@ -1,18 +1,19 @@
 """
 Slot Generator - Creates slots from weekly templates
 """
-import aiosqlite
+from collections import defaultdict
 from datetime import datetime, timedelta
-from database.setup import DB_NAME
-from database.template_cmds import get_all_template_times, is_vacation_day
+from database.setup import pool
+from database.cache import availability_cache
 from database.db_cmds import get_master_id_by_tg_id
+from utils.slot_time import GENERATION_HORIZON_DAYS, format_slot, local_now, slot_end, to_ts
 
 WEEKDAYS_RU = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
 
-async def generate_slots_from_template(master_tg_id: int, days_ahead: int = 30) -> dict:
+async def generate_slots_from_template(master_tg_id: int, days_ahead: int = GENERATION_HORIZON_DAYS) -> dict:
     """
     Generate slots for the next N days based on weekly template.
-    
+
     Returns:
         dict: {
             "created": int,  # Number of new slots created
@@ -23,67 +24,99 @@ async def generate_slots_from_template(master_tg_id: int, days_ahead: int = 30)
     master_id = await get_master_id_by_tg_id(master_tg_id)
     if not master_id:
         return {"created": 0, "skipped": 0, "errors": ["Master not found"]}
-    
-    # Get template times
-    template_times = await get_all_template_times(master_id)
-    if not template_times:
-        return {"created": 0, "skipped": 0, "errors": ["No template configured"]}
-    
-    # Organize by day of week
-    template_by_day = {}
-    for _, day_of_week, time in template_times:
-        if day_of_week not in template_by_day:
-            template_by_day[day_of_week] = []
-        template_by_day[day_of_week].append(time)
-    
-    created = 0
-    skipped = 0
-    errors = []
-    
-    # Generate for each day
-    start_date = datetime.now().date()
-    
-    async with aiosqlite.connect(DB_NAME) as db:
-        for i in range(days_ahead):
-            current_date = start_date + timedelta(days=i)
-            day_of_week = current_date.weekday()  # 0=Mon, 6=Sun
-            
-            # Check if this day has template times
-            if day_of_week not in template_by_day:
-                continue
-            
-            # Format date as DD.MM.YYYY
-            date_str = current_date.strftime("%d.%m.%Y")
-            
-            # Check if vacation day
-            if await is_vacation_day(master_id, date_str):
-                skipped += len(template_by_day[day_of_week])
-                continue
-            
-            # Create slots for each time in template
-            for time in template_by_day[day_of_week]:
-                # Format: "DD.MM HH:MM"
-                datetime_str = f"{current_date.strftime('%d.%m')} {time}"
-                
-                # Check if slot already exists
-                async with db.execute(
-                    "SELECT id FROM slots WHERE master_id = ? AND datetime = ?",
-                    (master_id, datetime_str)
-                ) as cursor:
-                    if await cursor.fetchone():
-                        skipped += 1
-                        continue
-                
-                # Create slot
+
+    results = await _generate(days_ahead, master_id)
+    return results.get(master_id) or {"created": 0, "skipped": 0, "errors": ["No template configured"]}
+
+async def generate_slots_for_all_masters(days_ahead: int = GENERATION_HORIZON_DAYS) -> dict:
+    """
+    Generate slots for every master with a template, in one transaction.
+    Returns {master_id: result dict as in generate_slots_from_template}.
+    """
+    return await _generate(days_ahead)
+
+async def _generate(days_ahead: int, master_id: int = None) -> dict:
+    """Templates and vacations are read in one query each, slots written with one executemany per master"""
+    start_date = local_now().date()  # Moscow date, whatever zone cron runs in
+    results = {}
+
+    async with pool.write() as db:
+        templates = await _load_templates(db, master_id)
+        vacations = await _load_vacations(db, master_id)
+
+        for m_id, template_by_day in templates.items():
+            rows, vacation_skipped = _build_rows(m_id, template_by_day, vacations.get(m_id, set()), start_date, days_ahead)
+            errors = []
+            created = 0
+            if rows:
                 try:
-                    await db.execute(
-                        "INSERT INTO slots (master_id, datetime, is_booked) VALUES (?, ?, 0)",
-                        (master_id, datetime_str)
-                    )
-                    created += 1
+                    created = await _insert_rows(db, rows)
                 except Exception as e:
-                    errors.append(f"Error creating slot {datetime_str}: {str(e)}")
-        
-        await db.commit()
-    
-    return {"created": created, "skipped": skipped, "errors": errors}
+                    errors.append(f"Error creating slots: {str(e)}")
+            results[m_id] = {
+                "created": created,
+                "skipped": vacation_skipped + len(rows) - created,
+                "errors": errors,
+            }
+
+    for m_id, result in results.items():
+        if result["created"]:
+            availability_cache.bump(m_id)
+    return results
+
+async def _load_templates(db, master_id: int = None) -> dict:
+    """{master_id: {day_of_week: [time, ...]}}"""
+    if master_id:
+        query, params = "SELECT master_id, day_of_week, time FROM schedule_template WHERE master_id = ?", (master_id,)
+    else:
+        query, params = "SELECT master_id, day_of_week, time FROM schedule_template", ()
+
+    templates = defaultdict(lambda: defaultdict(list))
+    async with db.execute(query, params) as cursor:
+        for m_id, day_of_week, time in await cursor.fetchall():
+            templates[m_id][day_of_week].append(time)
+    return templates
+
+async def _load_vacations(db, master_id: int = None) -> dict:
+    """{master_id: {'DD.MM.YYYY', ...}}"""
+    if master_id:
+        query, params = "SELECT master_id, date FROM vacation_days WHERE master_id = ?", (master_id,)
+    else:
+        query, params = "SELECT master_id, date FROM vacation_days", ()
+
+    vacations = defaultdict(set)
+    async with db.execute(query, params) as cursor:
+        for m_id, date in await cursor.fetchall():
+            vacations[m_id].add(date)
+    return vacations
+
+def _build_rows(master_id: int, template_by_day: dict, vacation_dates: set, start_date, days_ahead: int):
+    """Candidate slot rows for the horizon, plus the number of template times that fall on vacation days"""
+    rows = []
+    vacation_skipped = 0
+    for i in range(days_ahead):
+        current_date = start_date + timedelta(days=i)
+        times = template_by_day.get(current_date.weekday())  # 0=Mon, 6=Sun
+        if not times:
+            continue
+
+        if current_date.strftime("%d.%m.%Y") in vacation_dates:
+            vacation_skipped += len(times)
+            continue
+
+        for time in times:
+            hour, minute = map(int, time.split(':'))
+            start = datetime(current_date.year, current_date.month, current_date.day, hour, minute)
+            rows.append((master_id, format_slot(start), to_ts(start), to_ts(slot_end(start))))
+    return rows, vacation_skipped
+
+async def _insert_rows(db, rows) -> int:
+    """Insert slots, skipping existing ones (unique master_id + start_ts). Returns the number created."""
+    async with db.execute("SELECT total_changes()") as cursor:
+        before = (await cursor.fetchone())[0]
+    await db.executemany(
+        "INSERT OR IGNORE INTO slots (master_id, datetime, is_booked, start_ts, end_ts) VALUES (?, ?, 0, ?, ?)",
+        rows
+    )
+    async with db.execute("SELECT total_changes()") as cursor:
+        return (await cursor.fetchone())[0] - before
@@ -0,0 +1,94 @@
+"""
+Slot time helpers.
+
+Slots are displayed as year-less 'DD.MM HH:MM' strings, but stored with an
+absolute epoch start (slots.start_ts) so range queries can run in SQL and
+December→January doesn't need guessing in every handler.
+
+Naive datetimes here are Moscow time (config.TIMEZONE), whatever zone the
+host or the calling script runs in: to_ts/from_ts convert with it explicitly.
+"""
+from datetime import datetime, timedelta
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+from config import TIMEZONE
+
+SLOT_TZ = ZoneInfo(TIMEZONE)
+
+# Length of a single schedule slot in minutes
+SLOT_MINUTES = 30
+# How far ahead slots get generated from templates (utils/slot_generator.py)
+GENERATION_HORIZON_DAYS = 30
+
+
+def resolve_slot_datetime(datetime_str: str, now: Optional[datetime] = None,
+                          not_after: Optional[datetime] = None) -> Optional[datetime]:
+    """
+    Parse 'DD.MM HH:MM' into a datetime, picking the year that puts it closest to now.
+    '05.01 10:00' typed on Dec 28 -> next January, '28.12 10:00' on Jan 3 -> last December.
+    With not_after: the latest occurrence not later than it, for rows that already exist
+    (an old '25.03 14:00' stays in the past instead of jumping to next March).
+    """
+    now = now or local_now()
+    try:
+        day_month, time = datetime_str.split()
+        day, month = map(int, day_month.split('.'))
+        hour, minute = map(int, time.split(':'))
+    except (ValueError, AttributeError):
+        return None
+
+    if not_after is not None:
+        # Eight years back always include a leap year for 29.02
+        for year in range(not_after.year, not_after.year - 8, -1):
+            try:
+                dt = datetime(year, month, day, hour, minute)
+            except ValueError:
+                continue
+            if dt <= not_after:
+                return dt
+        return None
+
+    candidates = []
+    for year in (now.year - 1, now.year, now.year + 1):
+        try:
+            candidates.append(datetime(year, month, day, hour, minute))
+        except ValueError:
+            continue  # 29.02 in a non-leap year
+    if not candidates:
+        return None
+    return min(candidates, key=lambda dt: abs(dt - now))
+
+
+def local_now() -> datetime:
+    """Current Moscow time as a naive datetime"""
+    return datetime.now(SLOT_TZ).replace(tzinfo=None)
+
+
+def to_ts(dt: datetime) -> int:
+    """Moscow datetime -> epoch seconds (aware datetimes keep their own zone)"""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=SLOT_TZ)
+    return int(dt.timestamp())
+
+
+def from_ts(ts: int) -> datetime:
+    """Epoch seconds -> naive Moscow datetime"""
+    return datetime.fromtimestamp(ts, SLOT_TZ).replace(tzinfo=None)
+
+
+def format_slot(dt: datetime) -> str:
+    """datetime -> 'DD.MM HH:MM' (the format stored in slots.datetime)"""
+    return dt.strftime('%d.%m %H:%M')
+
+
+def slot_end(start: datetime, duration_minutes: Optional[int] = None) -> datetime:
+    """End of a slot occupied for duration_minutes (defaults to one slot)"""
+    return start + timedelta(minutes=duration_minutes or SLOT_MINUTES)
+
+
+def month_bounds(year: int, month: int):
+    """(first moment of the month, first moment of the next month)"""
+    start = datetime(year, month, 1)
+    end = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+    return start, end
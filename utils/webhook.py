@@ -0,0 +1,193 @@
+"""
+Webhook run mode (BOT_MODE=webhook): aiohttp server instead of long polling.
+
+Telegram POSTs each update to WEBHOOK_PATH. The request is checked against
+the secret token, answered with 200 right away and handled in a background
+task, at most WEBHOOK_MAX_IN_FLIGHT at a time — when that many are running,
+the HTTP answer waits for a free slot, which slows Telegram down instead of
+piling up tasks. Updates of one chat are handled in the order they arrived:
+each waits for the chat's previous one, so a quick double tap can't run two
+handlers on the same FSM state at once. Waiting for the chat doesn't take a
+slot (it is taken after), so a burst from one chat behind a slow handler
+can't hold up everyone else; such updates are answered at once.
+
+The server listens on WEBHOOK_HOST:WEBHOOK_PORT (plain HTTP, localhost by
+default) behind a TLS reverse proxy that forwards WEBHOOK_URL + WEBHOOK_PATH.
+The webhook is registered on startup and left in place on shutdown, so
+Telegram keeps the updates that arrive during a restart. Without
+WEBHOOK_URL nothing is registered: the server only takes what is POSTed to
+it locally (scripts/post_updates.py). Worker processes (utils/workers.py)
+run the same server on their own port and never register.
+"""
+import asyncio
+import logging
+import secrets
+import signal
+from typing import Any, Dict, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from config import (
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT,
+    WEBHOOK_MAX_IN_FLIGHT, WEBHOOK_MAX_CONNECTIONS
+)
+
+
+def update_chat_id(update: Dict[str, Any]) -> Optional[int]:
+    """Chat a raw update belongs to (the sender for updates without a chat, e.g. inline queries)"""
+    for name, event in update.items():
+        if name == "update_id" or not isinstance(event, dict):
+            continue
+        chat = event.get("chat") or (event.get("message") or {}).get("chat") or event.get("from") or event.get("user")
+        if chat and "id" in chat:
+            return chat["id"]
+    return None
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    """Answers Telegram at once, runs at most max_in_flight updates concurrently"""
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret_token: Optional[str],
+                 max_in_flight: int = WEBHOOK_MAX_IN_FLIGHT, **data: Any):
+        super().__init__(dispatcher, bot, handle_in_background=True, secret_token=secret_token, **data)
+        self.max_in_flight = max_in_flight
+        self._slots = asyncio.Semaphore(max_in_flight)
+        # chat id -> task of its latest update
+        self._chat_tails: Dict[int, asyncio.Task] = {}
+        self.received = 0
+        self.unauthorized = 0
+        self.waited = 0
+        self.failed = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def verify_secret(self, telegram_secret_token: str, bot: Bot) -> bool:
+        if super().verify_secret(telegram_secret_token, bot):
+            return True
+        self.unauthorized += 1
+        return False
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        update = await request.json(loads=bot.session.json_loads)
+        self.received += 1
+        chat_id = update_chat_id(update)
+        # Tail read and set with no await in between: the chat's order is the arrival order
+        previous = self._chat_tails.get(chat_id)
+        started = asyncio.get_running_loop().create_future()
+        task = asyncio.create_task(self._feed(bot, update, previous, started))
+        self._background_feed_update_tasks.add(task)
+        task.add_done_callback(self._background_feed_update_tasks.discard)
+        if chat_id is not None:
+            self._chat_tails[chat_id] = task
+            task.add_done_callback(lambda t: self._forget_tail(chat_id, t))
+        if previous is None or previous.done():
+            # Not queued behind its chat: answer once it has a slot, so Telegram slows down when all are busy
+            await asyncio.wait([started])
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def _feed(self, bot: Bot, update: Dict[str, Any], previous: Optional[asyncio.Task],
+                    started: asyncio.Future):
+        holding = False
+        try:
+            if previous is not None:
+                await asyncio.wait([previous])
+            # The slot is taken only now: waiting for the chat doesn't use up concurrency
+            if self._slots.locked():
+                self.waited += 1
+            await self._slots.acquire()
+            holding = True
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            started.set_result(None)
+            await self._background_feed_update(bot, update)
+        except Exception as e:
+            # The dispatcher logs handler errors itself; this is anything around it
+            self.failed += 1
+            logging.exception(f"Webhook: update {update.get('update_id')} failed: {e}")
+        finally:
+            if not started.done():
+                started.set_result(None)
+            if holding:
+                self.in_flight -= 1
+                self._slots.release()
+
+    def _forget_tail(self, chat_id: int, task: asyncio.Task):
+        if self._chat_tails.get(chat_id) is task:
+            del self._chat_tails[chat_id]
+
+    async def close(self, timeout: float = 10.0):
+        """Let updates in flight finish (up to timeout), then close the bot session"""
+        if self._background_feed_update_tasks:
+            _, pending = await asyncio.wait(list(self._background_feed_update_tasks), timeout=timeout)
+            if pending:
+                logging.warning(f"Webhook: {len(pending)} updates still running at shutdown")
+        await super().close()
+
+    def stats(self) -> dict:
+        return {
+            "received": self.received,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "limit": self.max_in_flight,
+            "waited_for_slot": self.waited,
+            "failed": self.failed,
+            "unauthorized": self.unauthorized,
+        }
+
+
+# The handler of the running server, for /stats
+request_handler: Optional[BoundedRequestHandler] = None
+
+
+def build_app(dp: Dispatcher, bot: Bot, secret_token: Optional[str], **data: Any) -> web.Application:
+    """aiohttp application with the webhook route and the dispatcher's startup/shutdown hooks"""
+    global request_handler
+    app = web.Application()
+    request_handler = BoundedRequestHandler(dp, bot, secret_token, **data)
+    request_handler.register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot, **data)
+    return app
+
+
+async def wait_for_stop_signal():
+    """Return on SIGTERM/SIGINT (systemctl stop, Ctrl+C)"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+    await stop.wait()
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT,
+                      secret_token: str = WEBHOOK_SECRET, register: bool = True):
+    """Serve updates until SIGTERM/SIGINT; register=False for a worker behind the front process"""
+    # Without a configured secret a fresh one per start is enough: the webhook is re-registered anyway
+    secret_token = secret_token or secrets.token_urlsafe(32)
+
+    app = build_app(dp, bot, secret_token)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+
+    if register and WEBHOOK_URL:
+        await bot.set_webhook(
+            WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=secret_token,
+            allowed_updates=dp.resolve_used_update_types(),
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+        )
+    elif register:
+        logging.warning("Webhook: WEBHOOK_URL is not set, not registering with Telegram (local testing)")
+    logging.info(f"Webhook: listening on {host}:{port}{WEBHOOK_PATH}, "
+                 f"up to {WEBHOOK_MAX_IN_FLIGHT} updates in flight")
+    try:
+        await wait_for_stop_signal()
+    finally:
+        # Stops accepting requests, waits for updates in flight, runs the dispatcher's shutdown (FSM flush)
+        await runner.cleanup()
@@ -0,0 +1,273 @@
+"""
+Multi-worker run mode (BOT_WORKERS > 1).
+
+A single bot process handles every update on one core. With BOT_WORKERS > 1,
+`python bot.py` becomes a front process: it takes updates from Telegram
+(long polling or the webhook, per BOT_MODE) and forwards each one to one of
+BOT_WORKERS worker processes that it starts itself. The worker is chosen by
+chat id, so a chat always goes to the same worker, and its updates arrive
+in order. Its FSM session lives in that worker's memory, and the worker
+handles them one after another (utils/webhook.py). Workers are ordinary
+bot processes in webhook mode on 127.0.0.1:WORKER_BASE_PORT + index. They
+don't register with Telegram.
+
+All workers share the SQLite database. Caches are per process and kept in
+step through database/versions.py. Only the holder of the jobs lease
+(utils/leader.py) runs the background jobs: the reminder scheduler (with
+the WAL checkpoint) and the Google Calendar outbox. The other workers hand
+new reminders and outbox jobs to it through the same versions.
+
+A worker that dies is restarted; its updates wait in the front's queue.
+On SIGTERM the front forwards what it holds and then stops the workers
+(systemd: KillMode=mixed, so the signal goes to the front only).
+"""
+import asyncio
+import logging
+import os
+import secrets
+import signal
+import sys
+from typing import Any, Dict, List, Optional, Sequence
+
+import aiohttp
+from aiogram import Bot
+from aiohttp import web
+
+from config import (
+    BOT_MODE, BOT_WORKERS, WORKER_INDEX, WORKER_BASE_PORT, TG_GLOBAL_RATE,
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT,
+    WEBHOOK_MAX_IN_FLIGHT, WEBHOOK_MAX_CONNECTIONS
+)
+from utils.webhook import update_chat_id, wait_for_stop_signal
+
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bot.py")
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+# Long polling timeout of getUpdates, seconds
+POLL_TIMEOUT = 30
+# Pause before restarting a worker that exited, and the longest pause between forwarding retries
+RESTART_DELAY = 1.0
+MAX_RETRY_DELAY = 5.0
+
+
+def worker_for(update: Dict[str, Any], workers: int) -> int:
+    """Index of the worker that handles this update"""
+    chat_id = update_chat_id(update)
+    return (chat_id if chat_id is not None else update.get("update_id", 0)) % workers
+
+
+# --- Inside a worker ---
+def is_worker() -> bool:
+    return WORKER_INDEX >= 0
+
+
+def owns_chat(chat_id: int) -> bool:
+    return not is_worker() or chat_id % BOT_WORKERS == WORKER_INDEX
+
+
+def start_worker():
+    """Call before messenger.start(): Telegram's ~30 msg/s is per bot, not per process"""
+    from utils.messenger import messenger
+
+    messenger.set_global_rate(TG_GLOBAL_RATE / BOT_WORKERS)
+    logging.info(f"Worker {WORKER_INDEX}/{BOT_WORKERS} started")
+
+
+async def start_shared_state():
+    """
+    Keep this process in step with the others on the same database (workers,
+    or a second service): cache invalidation and hand-off of reminders and
+    calendar jobs to whichever process holds the jobs lease.
+    """
+    from database.cache import availability_cache, SCHEDULE_KEY
+    from database.identity import identity_cache, MASTERS_KEY
+    from database.versions import shared_versions
+    from reminders.scheduler import pickup_reminders, REMINDERS_KEY
+    from utils.calendar_outbox import outbox, OUTBOX_KEY
+
+    def wake_outbox(key: str):
+        # Only where the outbox runs: wake() elsewhere would publish the key again
+        if outbox.is_running:
+            outbox.wake()
+
+    schedule_prefix = SCHEDULE_KEY.format("")
+    shared_versions.subscribe(schedule_prefix, lambda key: availability_cache.invalidate(int(key[len(schedule_prefix):])))
+    shared_versions.subscribe(MASTERS_KEY, lambda key: identity_cache.invalidate_masters())
+    shared_versions.subscribe(REMINDERS_KEY, pickup_reminders)
+    shared_versions.subscribe(OUTBOX_KEY, wake_outbox)
+    await shared_versions.start()
+
+
+# --- Front process ---
+class Front:
+    def __init__(self, workers: int = BOT_WORKERS, base_port: int = WORKER_BASE_PORT,
+                 command: Optional[Sequence[str]] = None, queue_size: int = WEBHOOK_MAX_IN_FLIGHT):
+        self.workers = workers
+        self.base_port = base_port
+        # What a worker runs; it gets BOT_WORKER_INDEX / BOT_WORKER_SECRET in the environment
+        self.command = list(command or [sys.executable, BOT_SCRIPT])
+        self.secret = secrets.token_urlsafe(32)
+        self._queues: List[asyncio.Queue] = [asyncio.Queue(queue_size) for _ in range(workers)]
+        self._processes: List[Optional[asyncio.subprocess.Process]] = [None] * workers
+        self._tasks: List[asyncio.Task] = []
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._stopping = False
+        self.received = 0
+        self.forwarded = [0] * workers
+        self.retries = 0
+        self.dropped = 0
+        self.restarts = 0
+
+    def start(self):
+        """Start the workers and one forwarder per worker (call once the event loop is running)"""
+        self._session = aiohttp.ClientSession(headers={SECRET_HEADER: self.secret})
+        for index in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._supervise(index)))
+            self._tasks.append(asyncio.create_task(self._forward(index)))
+        logging.info(f"Front: {self.workers} workers on ports {self.base_port}-{self.base_port + self.workers - 1}")
+
+    async def dispatch(self, update: Dict[str, Any]):
+        """Queue an update for its worker; waits while that worker's queue is full"""
+        self.received += 1
+        await self._queues[worker_for(update, self.workers)].put(update)
+
+    async def stop(self, timeout: float = 10.0):
+        """Forward what is queued (up to timeout), then stop the workers and wait for them"""
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self._queues)), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Front: {sum(q.qsize() for q in self._queues)} updates not forwarded at shutdown")
+        self._stopping = True
+        for process in self._processes:
+            if process is not None and process.returncode is None:
+                process.send_signal(signal.SIGTERM)
+        for process in self._processes:
+            if process is None:
+                continue
+            try:
+                await asyncio.wait_for(process.wait(), timeout)
+            except asyncio.TimeoutError:
+                process.kill()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self._session.close()
+        logging.info(f"Front stopped: {self.stats()}")
+
+    async def _supervise(self, index: int):
+        env = dict(os.environ, BOT_WORKER_INDEX=str(index), BOT_WORKER_SECRET=self.secret,
+                   BOT_WORKERS=str(self.workers), WORKER_BASE_PORT=str(self.base_port))
+        while not self._stopping:
+            # Own session: Ctrl+C reaches only the front, which stops the workers after forwarding what it holds
+            process = self._processes[index] = await asyncio.create_subprocess_exec(
+                *self.command, env=env, start_new_session=True
+            )
+            code = await process.wait()
+            if self._stopping:
+                return
+            self.restarts += 1
+            logging.error(f"Front: worker {index} exited with code {code}, restarting")
+            await asyncio.sleep(RESTART_DELAY)
+
+    async def _forward(self, index: int):
+        """POST the worker's updates one at a time, in order; retry until the worker takes each"""
+        queue = self._queues[index]
+        url = f"http://127.0.0.1:{self.base_port + index}{WEBHOOK_PATH}"
+        while True:
+            update = await queue.get()
+            delay = 0.1
+            while True:
+                try:
+                    async with self._session.post(url, json=update) as response:
+                        status = response.status
+                except aiohttp.ClientError:
+                    status = None  # worker starting or restarting
+                if status == 200:
+                    self.forwarded[index] += 1
+                    break
+                if status is not None and status < 500:
+                    self.dropped += 1
+                    logging.error(f"Front: worker {index} refused update {update.get('update_id')} ({status})")
+                    break
+                self.retries += 1
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+            queue.task_done()
+
+    def stats(self) -> dict:
+        return {
+            "received": self.received,
+            "forwarded": sum(self.forwarded),
+            "per_worker": "/".join(map(str, self.forwarded)),
+            "queued": sum(queue.qsize() for queue in self._queues),
+            "retries": self.retries,
+            "dropped": self.dropped,
+            "restarts": self.restarts,
+        }
+
+
+async def _poll(front: Front, bot: Bot, allowed_updates: List[str]):
+    """getUpdates with the raw JSON: the front never builds aiogram models"""
+    url = bot.session.api.api_url(bot.token, "getUpdates")
+    offset = 0
+    async with aiohttp.ClientSession() as session:
+        while True:
+            payload = {"offset": offset, "timeout": POLL_TIMEOUT, "allowed_updates": allowed_updates}
+            try:
+                async with session.post(url, json=payload, timeout=aiohttp.ClientTimeout(total=POLL_TIMEOUT + 10)) as response:
+                    result = await response.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logging.warning(f"Front: getUpdates failed: {e}")
+                await asyncio.sleep(RESTART_DELAY)
+                continue
+            if not result.get("ok"):
+                logging.error(f"Front: getUpdates: {result.get('description')}")
+                await asyncio.sleep((result.get("parameters") or {}).get("retry_after", RESTART_DELAY))
+                continue
+            for update in result["result"]:
+                await front.dispatch(update)
+                offset = update["update_id"] + 1
+
+
+async def _serve_webhook(front: Front, bot: Bot, allowed_updates: List[str]) -> web.AppRunner:
+    secret_token = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+
+    async def handle(request: web.Request) -> web.Response:
+        if not secrets.compare_digest(request.headers.get(SECRET_HEADER, ""), secret_token):
+            return web.Response(status=401, text="Unauthorized")
+        await front.dispatch(await request.json())
+        return web.json_response({})
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    if WEBHOOK_URL:
+        await bot.set_webhook(WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=secret_token,
+                              allowed_updates=allowed_updates, max_connections=WEBHOOK_MAX_CONNECTIONS)
+    else:
+        logging.warning("Front: WEBHOOK_URL is not set, not registering with Telegram (local testing)")
+    return runner
+
+
+async def run_front(bot: Bot, allowed_updates: List[str]):
+    """Take updates from Telegram and spread them over the workers until SIGTERM/SIGINT"""
+    front = Front()
+    front.start()
+    runner = poller = None
+    try:
+        if BOT_MODE == "webhook":
+            runner = await _serve_webhook(front, bot, allowed_updates)
+        else:
+            await bot.delete_webhook()
+            poller = asyncio.create_task(_poll(front, bot, allowed_updates))
+        await wait_for_stop_signal()
+    finally:
+        if poller is not None:
+            poller.cancel()
+            await asyncio.gather(poller, return_exceptions=True)
+        if runner is not None:
+            await runner.cleanup()
+        await front.stop()
+        await bot.session.close()